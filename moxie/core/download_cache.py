@@ -0,0 +1,268 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from requests.exceptions import RequestException
+
+from moxie.core.http import http_client
+
+logger = logging.getLogger(__name__)
+
+METADATA_KEY_FORMAT = "%s_resource_%s"
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), 'moxie-downloads')
+CHUNK_SIZE = 1 << 20
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+DEFAULT_CONCURRENCY = 4     # resources prefetched concurrently
+
+
+class DownloadCache(object):
+    """Cache of downloaded resources, stored on disk by content::
+
+        directory/blobs/<sha1>        content of resources
+        directory/partial/<sha1 of the URL>(.json)
+                                      interrupted download (and its validator)
+
+    Bodies are streamed to disk by chunks. Interrupted downloads are resumed
+    with ``Range``/``If-Range`` requests. The size (and the MD5 when the
+    server sends ``Content-MD5``) of downloads is verified before they are
+    stored. Cached resources are revalidated with ``If-None-Match`` and
+    ``If-Modified-Since``.
+
+    Metadata of resources (ETag, Last-Modified, SHA-1, size) is kept in the
+    KV store. Blobs are shared by resources with the same content, they are
+    only removed by the eviction: blobs least recently used (e.g. previous
+    versions of resources) are evicted when their total size is over
+    ``budget``.
+
+    :param kv: key-value store of the metadata
+    :param directory: directory of the cache
+    :param budget: (optional) maximum size of blobs in bytes
+    :param chunk_size: size of chunks written to disk
+    """
+
+    def __init__(self, kv, directory=DEFAULT_DIRECTORY, budget=None, chunk_size=CHUNK_SIZE):
+        self.kv = kv
+        self.directory = directory
+        self.budget = budget
+        self.chunk_size = chunk_size
+        self.blobs = os.path.join(directory, 'blobs')
+        self.partial = os.path.join(directory, 'partial')
+        for path in (self.blobs, self.partial):
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+    def metadata_key(self, url):
+        return METADATA_KEY_FORMAT % (__name__, url)
+
+    def metadata(self, url):
+        """Metadata of a cached resource
+        :return dict (etag, last_modified, sha1, size, location) or None if
+                the resource is not in the cache
+        """
+        metadata = self.kv.get(self.metadata_key(url))
+        if not metadata:
+            return None
+        metadata = json.loads(metadata)
+        try:
+            if os.path.getsize(metadata['location']) != metadata['size']:
+                logger.warning("Cached {url} has not the expected size".format(url=url))
+                return None
+        except OSError:
+            return None
+        return metadata
+
+    def fetch(self, url, force_update=False, media_type=None, timeout=60):
+        """Get a resource, downloaded if it is not cached or has changed
+        :param url: URL of the resource
+        :param force_update: download the resource even if it hasn't changed
+        :param media_type: (optional) media type requested
+        :param timeout: timeout of the request in seconds
+        :return location of the file or False if it couldn't be downloaded
+        """
+        cached = self.metadata(url)
+        headers = {}
+        if media_type:
+            headers['Accept'] = media_type
+        if cached and not force_update:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        partial_path = os.path.join(self.partial, hashlib.sha1(url).hexdigest())
+        validator = self.partial_validator(partial_path)
+        if validator:
+            headers['Range'] = 'bytes={size}-'.format(size=os.path.getsize(partial_path))
+            headers['If-Range'] = validator
+
+        response = http_client.get(url, headers=headers, stream=True, timeout=timeout)
+        try:
+            if response.status_code == 304 and cached:
+                logger.info("ETag's match. No change resource - %s" % url)
+                self.touch(cached['location'])
+                return cached['location']
+            if response.status_code == 206 and not self.resumable(response, partial_path):
+                # range not matching what we have, start again
+                response.close()
+                self.discard(partial_path)
+                return self.fetch(url, force_update=force_update, media_type=media_type,
+                                  timeout=timeout)
+            if response.status_code not in (200, 206):
+                logger.warning("Failed to download: %s Response: %s-%s" % (
+                    url, response.status_code, response.reason))
+                return False
+            metadata = self.download(response, partial_path)
+        finally:
+            response.close()
+        if not metadata:
+            return False
+
+        # the previous version of the resource is not discarded, blobs
+        # may be shared by several URLs, it is left to the eviction
+        self.kv.set(self.metadata_key(url), json.dumps(metadata))
+        logger.info("Downloaded - %s - %s bytes" % (url, metadata['size']))
+        self.evict(keep=metadata['location'])
+        return metadata['location']
+
+    def prefetch(self, resources, force_update=False, concurrency=DEFAULT_CONCURRENCY, timeout=60):
+        """Fetch resources concurrently, ``kv`` is shared by the threads
+        :param resources: list of (url, media type or None)
+        :param force_update: download resources even if they haven't changed
+        :param concurrency: number of resources fetched concurrently
+        :param timeout: timeout of requests in seconds
+        :return dict of url -> metadata of the resource, None if it couldn't
+                be downloaded
+        """
+        def fetch((url, media_type)):
+            try:
+                if self.fetch(url, force_update=force_update, media_type=media_type, timeout=timeout):
+                    return url, self.metadata(url)
+            except (RequestException, IOError, OSError):
+                logger.warning("Couldn't prefetch {url}".format(url=url), exc_info=True)
+            return url, None
+
+        if not resources:
+            return dict()
+        pool = ThreadPool(min(concurrency, len(resources)))
+        try:
+            return dict(pool.map(fetch, resources))
+        finally:
+            pool.close()
+
+    def partial_validator(self, partial_path):
+        """ETag or Last-Modified of the resource partially downloaded
+        :return validator or None if there is no partial download
+        """
+        try:
+            with open(partial_path + '.json') as f:
+                validator = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if os.path.exists(partial_path) and os.path.getsize(partial_path):
+            return validator
+        return None
+
+    def resumable(self, response, partial_path):
+        match = CONTENT_RANGE.match(response.headers.get('content-range', ''))
+        return match and int(match.group(1)) == os.path.getsize(partial_path)
+
+    def download(self, response, partial_path):
+        """Stream the body of the response at the end of the partial file,
+        then store it as a blob
+        :return metadata of the resource or None if the download is incomplete
+        """
+        sha1, md5 = hashlib.sha1(), hashlib.md5()
+        # sizes and ranges are those of the encoded body (e.g. gzip), which
+        # is decoded by requests
+        encoded = response.headers.get('content-encoding', 'identity') != 'identity'
+        if response.status_code == 206:
+            expected = CONTENT_RANGE.match(response.headers['content-range']).group(3)
+            mode = 'r+b'
+            with open(partial_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), ''):
+                    sha1.update(chunk)
+                    md5.update(chunk)
+        else:
+            expected = None if encoded else response.headers.get('content-length')
+            mode = 'wb'
+            # remember how to resume this download if it is interrupted,
+            # weak ETags can't be used in If-Range
+            etag = response.headers.get('etag')
+            if etag and etag.startswith('W/'):
+                etag = None
+            validator = etag or response.headers.get('last-modified')
+            if validator and not encoded:
+                with open(partial_path + '.json', 'w') as f:
+                    json.dump(validator, f)
+            else:
+                self.discard(partial_path + '.json')
+        with open(partial_path, mode) as f:
+            f.seek(0, os.SEEK_END)
+            for chunk in response.iter_content(self.chunk_size):
+                f.write(chunk)
+                sha1.update(chunk)
+                md5.update(chunk)
+        size = os.path.getsize(partial_path)
+
+        if expected and expected != '*' and int(expected) != size:
+            logger.warning("Incomplete download of {url}: {size} of {expected} bytes".format(
+                url=response.url, size=size, expected=expected))
+            return None
+        content_md5 = response.headers.get('content-md5')
+        if content_md5 and response.status_code == 200 and base64.b64decode(content_md5) != md5.digest():
+            logger.warning("Checksum of {url} doesn't match".format(url=response.url))
+            self.discard(partial_path)
+            return None
+
+        location = os.path.join(self.blobs, sha1.hexdigest())
+        if os.path.exists(location):
+            self.discard(partial_path)
+        else:
+            os.rename(partial_path, location)
+        self.discard(partial_path + '.json')
+        self.touch(location)
+        return {'etag': response.headers.get('etag'),
+                'last_modified': response.headers.get('last-modified'),
+                'sha1': sha1.hexdigest(),
+                'size': size,
+                'location': location}
+
+    def touch(self, location):
+        """Mark a blob as used (access time, the modification time is kept)
+        """
+        try:
+            os.utime(location, (time.time(), os.path.getmtime(location)))
+        except OSError:
+            pass
+
+    def discard(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def evict(self, keep=None):
+        """Remove blobs least recently used until blobs fit in the budget
+        :param keep: location of a blob which is never removed
+        """
+        if self.budget is None:
+            return
+        blobs = []
+        for name in os.listdir(self.blobs):
+            path = os.path.join(self.blobs, name)
+            stat = os.stat(path)
+            blobs.append((path == keep, stat.st_atime, stat.st_size, path))
+        blobs.sort()
+        total = sum(blob[2] for blob in blobs)
+        for kept, _, size, path in blobs:
+            if total <= self.budget or kept:
+                break
+            logger.info("Evicting {path} from the download cache".format(path=path))
+            self.discard(path)
+            total -= size
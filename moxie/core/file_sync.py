@@ -0,0 +1,267 @@
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import urlparse
+
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+
+from requests.exceptions import RequestException
+
+from moxie.core.http import http_client
+from moxie.core.metrics import statsd
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_KEY_FORMAT = "%s_manifest_%s"
+DEFAULT_CONCURRENCY = 8     # files downloaded concurrently
+DEFAULT_PER_HOST = 2        # files downloaded concurrently from the same host
+CHUNK_SIZE = 64 * 1024
+
+
+def makedirs(directory):
+    """Create a directory (and its parents) if it doesn't exist, files are
+    synced concurrently so it may be created by another thread
+    """
+    if not directory:
+        return
+    try:
+        os.makedirs(directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+
+
+class SyncReport(object):
+    """Counters of a :py:meth:`FileSync.sync`, ``bytes_saved`` is the
+    size of the files which have not been downloaded (unchanged or
+    referenced more than once)
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.downloaded = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.deleted = 0
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return ('<SyncReport {files} files: {downloaded} downloaded, {unchanged} unchanged, '
+                '{failed} failed, {deleted} deleted, {bytes_downloaded} bytes downloaded, '
+                '{bytes_saved} bytes saved>').format(**self.as_dict())
+
+
+class FileSync(object):
+    """Keep local copies of remote files up to date.
+
+    A manifest of the files (ETag, Last-Modified, SHA-1 and size of the
+    content, by location) is kept in the KV store. Files are requested
+    with ``If-None-Match``/``If-Modified-Since`` and only written when
+    their content has changed, bodies are streamed to disk. A URL
+    referenced by several locations is downloaded once. Files synced
+    previously but not referenced anymore are deleted.
+
+    :param kv: key-value store of the manifest
+    :param name: name of the set of files (e.g. the directory)
+    :param concurrency: number of files downloaded concurrently
+    :param per_host: number of files downloaded concurrently from a host
+    :param timeout: timeout of requests in seconds
+    """
+
+    def __init__(self, kv, name, concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST,
+                 timeout=60):
+        self.kv = kv
+        self.manifest_key = MANIFEST_KEY_FORMAT % (__name__, name)
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self._hosts = dict()
+        self._lock = threading.Lock()
+
+    def load_manifest(self):
+        manifest = self.kv.get(self.manifest_key)
+        return json.loads(manifest) if manifest else dict()
+
+    def save_manifest(self, manifest):
+        self.kv.set(self.manifest_key, json.dumps(manifest))
+
+    def sync(self, files):
+        """Download new and changed files, delete files not referenced
+        :param files: list of (url, location)
+        :return SyncReport
+        """
+        manifest = self.load_manifest()
+        locations_by_url = defaultdict(list)
+        for url, location in files:
+            if location not in locations_by_url[url]:
+                locations_by_url[url].append(location)
+
+        report = SyncReport()
+        pool = ThreadPool(self.concurrency)
+        try:
+            results = pool.map(lambda (url, locations): self.sync_url(url, locations, manifest),
+                               locations_by_url.items())
+        finally:
+            pool.close()
+        new_manifest = dict()
+        for entries, downloaded, failed in results:
+            new_manifest.update(entries)
+            report.files += len(entries)
+            if failed:
+                report.failed += 1
+            elif downloaded is None:
+                report.unchanged += 1
+            else:
+                report.downloaded += 1
+                report.bytes_downloaded += downloaded
+        report.bytes_saved = max(0, sum(entry['size'] for entry in new_manifest.values())
+                                 - report.bytes_downloaded)
+
+        for location in set(manifest) - set(new_manifest):
+            try:
+                os.unlink(location)
+                report.deleted += 1
+            except OSError:
+                pass
+        self.save_manifest(new_manifest)
+
+        logger.info(repr(report))
+        statsd.gauge('core.file_sync.bytes_downloaded', report.bytes_downloaded)
+        statsd.gauge('core.file_sync.bytes_saved', report.bytes_saved)
+        return report
+
+    def host_semaphore(self, url):
+        host = urlparse.urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def sync_url(self, url, locations, manifest):
+        """Sync the locations of a URL
+        :return (manifest entries of the locations, bytes downloaded or None
+                if the file hasn't changed, True if the download failed)
+        """
+        previous = [manifest[location] for location in locations
+                    if location in manifest and manifest[location]['url'] == url
+                    and os.path.exists(location)]
+        headers = {}
+        if previous:
+            if previous[0].get('etag'):
+                headers['If-None-Match'] = previous[0]['etag']
+            if previous[0].get('last_modified'):
+                headers['If-Modified-Since'] = previous[0]['last_modified']
+        try:
+            with self.host_semaphore(url):
+                response = http_client.get(url, headers=headers, stream=True, timeout=self.timeout)
+                try:
+                    if response.status_code == 304 and previous:
+                        entry, path, downloaded = previous[0], None, None
+                    elif response.status_code == 200:
+                        entry, path = self.download(response, os.path.dirname(locations[0]))
+                        entry['url'] = url
+                        downloaded = entry['size']
+                    else:
+                        raise RequestException("{status} {reason}".format(status=response.status_code,
+                                                                          reason=response.reason))
+                finally:
+                    response.close()
+        except (RequestException, IOError, OSError):
+            logger.warning("Couldn't sync {url}".format(url=url), exc_info=True)
+            # keep the files we have
+            return dict((location, manifest[location]) for location in locations
+                        if location in manifest), None, True
+
+        if path and previous and previous[0]['sha1'] == entry['sha1']:
+            # content unchanged (conditional request not supported)
+            os.unlink(path)
+            path = None
+            downloaded = None
+        entries = dict()
+        try:
+            self.place(path, entry, locations, manifest, entries)
+        except (IOError, OSError):
+            logger.warning("Couldn't write {url} to {locations}".format(url=url, locations=locations),
+                           exc_info=True)
+            # keep the files we have, locations already written have the new entry
+            for location in locations:
+                if location not in entries and location in manifest:
+                    entries[location] = manifest[location]
+            return entries, None, True
+        finally:
+            if path and os.path.exists(path):
+                os.unlink(path)
+        return entries, downloaded, False
+
+    def place(self, path, entry, locations, manifest, entries):
+        """Write the downloaded file (or an existing copy) to the locations
+        which are not up to date, ``entries`` is updated as locations are written
+        :param path: temporary file of the download or None if unchanged
+        """
+        source = path
+        for location in locations:
+            current = manifest.get(location)
+            if not (current and current['sha1'] == entry['sha1'] and os.path.exists(location)):
+                if path:
+                    self.move(path, location)
+                    path = None
+                else:
+                    self.copy(source or self.existing(locations, manifest, entry), location)
+                source = location
+            entries[location] = entry
+
+    def existing(self, locations, manifest, entry):
+        """Location of an unchanged copy of the file"""
+        for location in locations:
+            current = manifest.get(location)
+            if current and current['sha1'] == entry['sha1'] and os.path.exists(location):
+                return location
+
+    def move(self, path, location):
+        makedirs(os.path.dirname(location))
+        try:
+            os.rename(path, location)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # location is on another device
+            shutil.copyfile(path, location)
+            os.unlink(path)
+
+    def copy(self, source, location):
+        makedirs(os.path.dirname(location))
+        shutil.copyfile(source, location)
+
+    def download(self, response, directory):
+        """Stream the body of the response in a temporary file
+        :return (manifest entry, path of the temporary file)
+        """
+        makedirs(directory)
+        sha1 = hashlib.sha1()
+        size = 0
+        f = tempfile.NamedTemporaryFile(dir=directory or None, delete=False)
+        try:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                sha1.update(chunk)
+                size += len(chunk)
+            f.close()
+        except:
+            f.close()
+            os.unlink(f.name)
+            raise
+        entry = {'etag': response.headers.get('etag'),
+                 'last_modified': response.headers.get('last-modified'),
+                 'sha1': sha1.hexdigest(),
+                 'size': size}
+        return entry, f.name
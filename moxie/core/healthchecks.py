@@ -3,6 +3,8 @@ import logging
 
 from flask import _app_ctx_stack, make_response
 
+from moxie.core.service import registry
+
 logger = logging.getLogger(__name__)
 
 
@@ -10,6 +12,8 @@ def check_services():
     ctx = _app_ctx_stack.top
     services = ctx.app.config.get('HEALTHCHECKS', [])
     ok, result = run_healthchecks(services)
+    result.append('* Service registry: {hits} hits, {misses} misses, '
+                  '{constructed} constructed'.format(**registry.stats()))
     if ok:
         response_code = 200
     else:
@@ -0,0 +1,131 @@
+import logging
+import threading
+import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3 import Retry
+
+from moxie.core.metrics import statsd
+from moxie.core.service import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10        # default timeout in seconds
+DEFAULT_POOL_SIZE = 10      # connections kept alive per host
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF_FACTOR = 0.2
+# statuses considered transient, retried for idempotent methods only
+RETRY_STATUSES = (502, 503, 504)
+
+
+class HTTPClient(object):
+    """Shared HTTP client used for all outbound calls (search server,
+    transport providers, importers, OAuth...).
+
+    Keeps one :py:class:`requests.Session` per upstream host so TCP (and TLS)
+    connections are kept alive and reused between calls. Every request gets
+    a default timeout, a retry policy (connection errors for every method,
+    transient errors for idempotent methods only) and is timed in statsd as
+    ``core.http.<host>``. Read errors (timeouts after the request has been
+    sent) are never retried as the request might not be idempotent. Callers
+    with their own retry logic pass ``retry=False`` to get a session without
+    any retry policy.
+
+    Configuration is read from the Flask config by :py:meth:`init_app`:
+
+    - `HTTP_POOL_SIZE` connections kept alive per host (10 by default)
+    - `HTTP_TIMEOUT` default timeout in seconds (10 by default)
+    - `HTTP_RETRIES` number of retries (2 by default)
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._sessions = dict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        settings = (app.config.get('HTTP_POOL_SIZE', DEFAULT_POOL_SIZE),
+                    app.config.get('HTTP_TIMEOUT', DEFAULT_TIMEOUT),
+                    app.config.get('HTTP_RETRIES', DEFAULT_RETRIES))
+        if settings != (self.pool_size, self.timeout, self.retries):
+            self.pool_size, self.timeout, self.retries = settings
+            # pools have been sized with the previous settings
+            self.reset()
+
+    def get_retry_policy(self, retry=True):
+        if not retry:
+            return Retry(total=0, read=False, raise_on_redirect=False)
+        # urllib3 retries read errors whatever the method, a POST
+        # might have been processed before the read timed out
+        return Retry(total=self.retries, connect=self.retries, read=False,
+                     status_forcelist=RETRY_STATUSES,
+                     backoff_factor=self.backoff_factor,
+                     raise_on_redirect=False)
+
+    def session(self, url, retry=True):
+        """Get the :py:class:`requests.Session` for the host of ``url``
+        :param url: URL to be requested
+        :param retry: whether requests are retried by the session
+        :return Session
+        """
+        registry.check_fork()
+        parsed = urlparse.urlparse(url)
+        key = parsed.scheme, parsed.netloc, retry
+        session = self._sessions.get(key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1,
+                                          pool_maxsize=self.pool_size,
+                                          max_retries=self.get_retry_policy(retry))
+                    session.mount('{scheme}://'.format(scheme=parsed.scheme), adapter)
+                    self._sessions[key] = session
+        return session
+
+    def request(self, method, url, retry=True, **kwargs):
+        """Does a request using the pooled session of the host
+        :param method: HTTP method
+        :param url: URL to request
+        :param retry: (optional) False if the caller handles retries itself
+        :param kwargs: passed to :py:meth:`requests.Session.request`
+        :return Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlparse.urlparse(url).hostname or 'unknown'
+        with statsd.timer('core.http.{host}'.format(host=host.replace('.', '_'))):
+            return self.session(url, retry).request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def reset(self):
+        """Close all sessions, new connections will be opened on demand.
+        """
+        with self._lock:
+            sessions, self._sessions = self._sessions, dict()
+        for session in sessions.values():
+            session.close()
+
+    def reset_after_fork(self):
+        """Connections inherited from a parent process must not be shared,
+        drop them without closing the sockets of the parent.
+        """
+        self._lock = threading.Lock()
+        self._sessions = dict()
+
+
+http_client = HTTPClient()
+registry.register_after_fork(http_client.reset_after_fork)
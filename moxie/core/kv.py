@@ -16,10 +16,19 @@ class KVService(Service):
     as the KV store. Currently this is the only fully supported KV store, see:
     :py:data:`moxie.core.kv.SUPPORTED_KV_STORES` for details.
     """
+    shared = True
 
     def __init__(self, backend_uri):
         self._backend = self._get_backend(backend_uri)
 
+    def reset_after_fork(self):
+        """Close connections inherited from the parent process, the pool
+        will open new ones for this process on demand.
+        """
+        pool = getattr(self._backend, 'connection_pool', None)
+        if pool is not None:
+            pool.disconnect()
+
     def __getattr__(self, name):
         """The KV Service proxies all calls through to the underlying backend.
         Since we only have one :py:data:`moxie.core.kv.SUPPORTED_KV_STORES` for
@@ -17,6 +17,8 @@ class SearchService(Service):
 
     All Search requests should be made through this service.
     """
+    shared = True
+
     def __init__(self, backend_uri):
         self._backend = self._get_backend(backend_uri)
 
@@ -71,8 +73,17 @@ class SearchService(Service):
     def index(self, document, **kwargs):
         return self._backend.index(document, **kwargs)
 
-    def commit(self):
-        return self._backend.commit()
+    def writer(self, **kwargs):
+        """Get a writer streaming documents to the index, see
+        :py:class:`moxie.core.search.solr.SolrIndexWriter` for arguments.
+        """
+        return self._backend.writer(**kwargs)
+
+    def delete_by_ids(self, ids, **kwargs):
+        return self._backend.delete_by_ids(ids, **kwargs)
+
+    def commit(self, soft=False):
+        return self._backend.commit(soft=soft)
         
     def healthcheck(self):
         return self._backend.healthcheck()
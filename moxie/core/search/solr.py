@@ -1,13 +1,15 @@
 import logging
-import requests
 import json
 import time
+import threading
 
+from Queue import Queue
 from urllib import urlencode
 from requests.exceptions import RequestException
 
 from moxie.core.search import SearchResponse, SearchServerException
 from moxie.core.metrics import statsd
+from moxie.core.http import http_client
 
 
 logger = logging.getLogger(__name__)
@@ -73,16 +75,13 @@ class SolrSearch(object):
         return SolrSearchResponse(results.json())
 
     def index(self, document, params=None, count_per_page=200):
-        """Index a list of objects, do paging
-        :param document: must be a list of objects to index
+        """Index a list (or any iterable) of objects, do paging
+        :param document: list or iterable of objects to index
         :param params: additional parameters to add
         :param count_per_page: number of items per page to send
         """
-        if len(document) < count_per_page:
-            self.index_all(document, params)
-        else:
-            for i in range(0, len(document), count_per_page):
-                self.index_all(document[i:i+count_per_page], params)
+        with self.writer(page_size=count_per_page, concurrency=1, params=params) as writer:
+            writer.write(document)
 
     def index_all(self, document, params=None):
         """Index a list of objects
@@ -94,10 +93,34 @@ class SolrSearch(object):
         self.connection(self.methods['update'], params=params,
                         data=data, headers=headers, timeout=120)
 
-    def commit(self):
+    def writer(self, **kwargs):
+        """Get a :py:class:`SolrIndexWriter` streaming documents to this core
+        :param kwargs: see :py:class:`SolrIndexWriter`
+        """
+        return SolrIndexWriter(self, **kwargs)
+
+    def commit(self, soft=False):
+        """Commit pending documents
+        :param soft: soft commit, documents are visible to searches but
+                     not flushed to disk
+        """
+        if soft:
+            params = {'softCommit': 'true'}
+        else:
+            params = {'commit': 'true'}
         return self.connection(self.methods['update'],
                                timeout=120,
-                               params={'commit': 'true'})
+                               params=params)
+
+    def delete_by_ids(self, document_ids, count_per_page=500):
+        """Delete documents by their ID, do paging
+        :param document_ids: list of document ids
+        :param count_per_page: number of ids per request
+        """
+        headers = {'Content-Type': self.content_types['json']}
+        for i in range(0, len(document_ids), count_per_page):
+            data = json.dumps({'delete': document_ids[i:i + count_per_page]})
+            self.connection(self.methods['update'], data=data, headers=headers, timeout=120)
 
     def clear_index(self):
         """WARNING: This action will delete *all* documents in your index.
@@ -118,12 +141,14 @@ class SolrSearch(object):
         query_string = {'q': " OR ".join(query)}
         return self.search(query_string, start=0, count=100)
 
-    def connection(self, method, params=None, data=None, headers=None, timeout=None):
+    def connection(self, method, params=None, data=None, headers=None, timeout=None,
+                   retry=True):
         """Does a GET request if there is no data otherwise a POST
         :param params: URL parameters as a dict
         :param data: POST form
         :param headers: custom headers to pass to Solr as a dict
         :param timeout: custom timeout
+        :param retry: False if the caller retries failed requests itself
         """
         headers = headers or dict()
         timeout = timeout or self.DEFAULT_TIMEOUT
@@ -134,11 +159,11 @@ class SolrSearch(object):
         try:
             with statsd.timer('core.search.solr.request'):
                 if data:
-                    response = requests.post(url, data, headers=headers,
-                                             params=params, timeout=timeout)
+                    response = http_client.post(url, data, headers=headers, params=params,
+                                                timeout=timeout, retry=retry)
                 else:
-                    response = requests.get(url, headers=headers,
-                                            params=params, timeout=timeout)
+                    response = http_client.get(url, headers=headers, params=params,
+                                               timeout=timeout, retry=retry)
         except RequestException as re:
             logger.error('Error in request to Solr', exc_info=True,
                          extra={
@@ -171,7 +196,7 @@ class SolrSearch(object):
 
     def healthcheck(self):
         try:
-            response = requests.get('{url}{core}/{method}'.format(url=self.server_url,
+            response = http_client.get('{url}{core}/{method}'.format(url=self.server_url,
                 core=self.core, method=self.methods['healthcheck']), timeout=2)
             return response.ok, response.json()['status']
         except Exception as e:
@@ -183,6 +208,161 @@ class SolrSearch(object):
         return string.replace(':', '\:')
 
 
+class SolrIndexWriter(object):
+    """Stream documents to a Solr core.
+
+    Documents can come from any iterable (e.g. a generator), they are
+    serialised page by page while up to ``concurrency`` update requests are
+    in flight. Producers block when all requests are in flight
+    (backpressure), failed pages are retried ``retries`` times.
+
+    Use as a context manager, pending pages are sent when leaving it::
+
+        with searcher.writer(page_size=500, concurrency=4, commit_within=60000) as writer:
+            writer.write(documents)
+        logger.info(writer.stats)
+
+    :param solr: :py:class:`SolrSearch` to index to
+    :param page_size: number of documents per update request
+    :param concurrency: number of update requests in flight
+    :param commit_within: (optional) milliseconds within which Solr should
+                          commit the documents, instead of an explicit commit
+    :param retries: number of retries of a failed page
+    :param params: (optional) additional parameters of update requests
+    """
+
+    UPDATE_TIMEOUT = 120
+    RETRY_DELAY = 1     # seconds, doubled after each attempt
+
+    def __init__(self, solr, page_size=200, concurrency=2, commit_within=None,
+                 retries=3, params=None):
+        self.solr = solr
+        self.page_size = page_size
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.params = dict(params or {})
+        if commit_within:
+            self.params['commitWithin'] = str(commit_within)
+        self.docs = 0
+        self.pages = 0
+        self.bytes_sent = 0
+        self.retried = 0
+        self.errors = []
+        self._page = []
+        self._queue = None
+        self._workers = []
+        self._lock = threading.Lock()
+        self._started = None
+        self._elapsed = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close(raise_errors=exc_type is None)
+
+    def open(self):
+        # queue is bounded so producers wait for requests in flight
+        self._queue = Queue(maxsize=self.concurrency)
+        self._workers = [threading.Thread(target=self._work) for _ in range(self.concurrency)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+        self._started = time.time()
+
+    def write(self, documents):
+        """Add documents to be indexed
+        :param documents: iterable of documents
+        """
+        if self._queue is None:
+            self.open()
+        for document in documents:
+            self._page.append(json.dumps(document))
+            if len(self._page) >= self.page_size:
+                self._flush()
+
+    def _flush(self):
+        if self._page:
+            data = '[' + ','.join(self._page) + ']'
+            self._queue.put((len(self._page), data))
+            self._page = []
+
+    def _work(self):
+        headers = {'Content-Type': self.solr.content_types['json']}
+        while True:
+            page = self._queue.get()
+            try:
+                if page is None:
+                    return
+                count, data = page
+                self._send(count, data, headers)
+            finally:
+                self._queue.task_done()
+
+    def _send(self, count, data, headers):
+        attempt = 0
+        while True:
+            try:
+                self.solr.connection(self.solr.methods['update'], params=dict(self.params),
+                                     data=data, headers=headers, timeout=self.UPDATE_TIMEOUT,
+                                     retry=False)
+            except Exception as e:
+                # client errors (4xx) would fail again, only retry
+                # server and network errors
+                status_code = getattr(e, 'status_code', None)
+                retriable = isinstance(e, SearchServerException) and (
+                    status_code is None or status_code >= 500)
+                if not retriable or attempt >= self.retries:
+                    logger.error('Failed to index a page of {count} documents'.format(count=count),
+                                 exc_info=True)
+                    with self._lock:
+                        self.errors.append(e)
+                    return
+                attempt += 1
+                with self._lock:
+                    self.retried += 1
+                time.sleep(self.RETRY_DELAY * 2 ** (attempt - 1))
+            else:
+                with self._lock:
+                    self.docs += count
+                    self.pages += 1
+                    self.bytes_sent += len(data)
+                return
+
+    def close(self, raise_errors=True):
+        """Send pending documents and wait for all requests to complete
+        :param raise_errors: raise if a page could not be indexed
+        """
+        if self._queue is None:
+            return
+        self._flush()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._queue = None
+        self._elapsed = time.time() - self._started
+        stats = self.stats
+        logger.info("Indexed {docs} documents ({bytes_sent} bytes) in {elapsed:.1f}s, "
+                    "{docs_per_sec:.0f} docs/s".format(**stats))
+        statsd.gauge('core.search.solr.index.docs_per_sec', int(stats['docs_per_sec']))
+        statsd.gauge('core.search.solr.index.bytes_sent', stats['bytes_sent'])
+        if self.errors and raise_errors:
+            raise SearchServerException("{count} page(s) could not be indexed".format(count=len(self.errors)))
+
+    @property
+    def stats(self):
+        elapsed = self._elapsed or (time.time() - self._started if self._started else 0)
+        return {'docs': self.docs,
+                'pages': self.pages,
+                'bytes_sent': self.bytes_sent,
+                'retried': self.retried,
+                'failed_pages': len(self.errors),
+                'elapsed': elapsed,
+                'docs_per_sec': self.docs / elapsed if elapsed else 0}
+
+
 class SolrSearchResponse(SearchResponse):
 
     def __init__(self, solr_response):
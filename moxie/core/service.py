@@ -1,12 +1,108 @@
+import os
+import json
+import hashlib
+import threading
 import importlib
 
 from flask import _app_ctx_stack, request
 
+from moxie.core.metrics import statsd
+
 
 class NoConfiguredService(Exception):
     pass
 
 
+class ServiceRegistry(object):
+    """Process-wide cache of :class:`Service` objects. Services which declare
+    themselves as :py:attr:`Service.shared` are only constructed once per
+    process for a given blueprint, service name and configuration, instead
+    of once per application context (i.e. once per HTTP request).
+
+    The registry is fork-aware: when it is first accessed from a new process
+    (e.g. a uwsgi or celery prefork worker) every cached service has its
+    :py:meth:`Service.reset_after_fork` called so connections inherited from
+    the parent process are not shared, and the counters start again.
+    """
+
+    def __init__(self):
+        self._services = dict()
+        self._after_fork_callbacks = []
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.constructed = 0
+
+    @staticmethod
+    def make_key(blueprint_name, service_name, config):
+        """Key a service by blueprint, name and a hash of its configuration
+        so that a configuration change never returns a stale service.
+        """
+        serialised = json.dumps(config, sort_keys=True, default=repr)
+        config_hash = hashlib.sha1(serialised).hexdigest()
+        return blueprint_name, service_name, config_hash
+
+    def get_or_create(self, key, factory):
+        """Return the service cached under ``key`` or create it by calling
+        ``factory``.
+        """
+        self.check_fork()
+        service = self._services.get(key)
+        if service is not None:
+            self.hits += 1
+            statsd.incr('core.service.registry.hit')
+            return service
+        with self._lock:
+            service = self._services.get(key)
+            if service is None:
+                self.misses += 1
+                statsd.incr('core.service.registry.miss')
+                service = factory()
+                self.constructed += 1
+                self._services[key] = service
+            else:
+                self.hits += 1
+                statsd.incr('core.service.registry.hit')
+        return service
+
+    def register_after_fork(self, callback):
+        """Register a callable to be run when the registry detects it is
+        running in a forked child process.
+        """
+        self._after_fork_callbacks.append(callback)
+
+    def check_fork(self):
+        """Detect a fork by comparing the current PID to the PID the registry
+        was last used in and reset connection state if they differ.
+        """
+        if self._pid != os.getpid():
+            self._reset_state()
+            for service in self._services.values():
+                service.reset_after_fork()
+            for callback in self._after_fork_callbacks:
+                callback()
+
+    def stats(self):
+        """Counters of the registry for the current process
+        :return dict
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'constructed': self.constructed,
+                'size': len(self._services)}
+
+    def clear(self):
+        with self._lock:
+            self._services.clear()
+
+
+registry = ServiceRegistry()
+
+
 class Service(object):
     """Services are HTTP (transport layer) agnostic instead operating at
     the Application Layer. Services encapsulate all operations made on
@@ -22,8 +118,16 @@ class Service(object):
             service_one = MyService.from_context()
             service_two = MyService.from_context()
             assert(service_one is service_two)
+
+    Services holding expensive, request-independent state (e.g. connection
+    pools) should set :py:attr:`shared` to ``True``, they are then cached
+    process-wide in the :py:class:`ServiceRegistry` and reused across
+    application contexts.
     """
 
+    #: Whether instances can be shared across requests within a process
+    shared = False
+
     @classmethod
     def from_context(cls, blueprint_name=''):
         """Create a :py:class:`Service` from the application and request
@@ -54,10 +158,21 @@ class Service(object):
                 kwargs = ctx.app.config['SERVICES'][blueprint_name][name]
             except KeyError:
                 raise NoConfiguredService('The service: %s is not configured on blueprint: %s' % (name, blueprint_name))
-            service = cls(**kwargs)
+            if cls.shared:
+                key = registry.make_key(blueprint_name, name, kwargs)
+                service = registry.get_or_create(key, lambda: cls(**kwargs))
+            else:
+                service = cls(**kwargs)
             ctx.moxie_services[service_key] = service
             return service
 
+    def reset_after_fork(self):
+        """Called by the :py:class:`ServiceRegistry` in a forked child
+        process, shared services should drop any connection inherited from
+        their parent here.
+        """
+        pass
+
     def _import_provider(self, config):
         """Given a provider config of the form::
 
@@ -91,6 +206,8 @@ class ProviderService(Service):
     Example usage can be found in the
     :class:`~moxie.transport.services.TransportService`
     """
+    shared = True
+
     def __init__(self, providers={}):
         self.providers = map(self._import_provider, providers.items())
 
@@ -1,98 +1,51 @@
-import urlparse
 import logging
-import requests
-import os
 
-from moxie.worker import celery
+from flask import current_app
+
 from moxie.core.kv import kv_store
-from tempfile import NamedTemporaryFile
-from requests.exceptions import RequestException
+from moxie.core.download_cache import (DownloadCache, DEFAULT_DIRECTORY as DEFAULT_DOWNLOAD_CACHE_DIR,
+                                       DEFAULT_CONCURRENCY as DEFAULT_PREFETCH_CONCURRENCY)
 
-ETAG_KEY_FORMAT = "%s_etag_%s"
-LOCATION_KEY_FORMAT = "%s_location_%s"
 logger = logging.getLogger(__name__)
 
 
-def write_resource(response):
-    hostname = urlparse.urlparse(response.url).hostname
-    f = NamedTemporaryFile(suffix=hostname,
-            delete=False)
-    f.write(response.content)
-    location = f.name
-    f.close()
-    return location
+def get_download_cache(kv=kv_store):
+    """Download cache configured by DOWNLOAD_CACHE_DIR and
+    DOWNLOAD_CACHE_BUDGET (in bytes)
+    """
+    config = current_app.config if current_app else {}
+    return DownloadCache(kv, config.get('DOWNLOAD_CACHE_DIR', DEFAULT_DOWNLOAD_CACHE_DIR),
+                         budget=config.get('DOWNLOAD_CACHE_BUDGET'))
 
 
 def get_cached_etag_location(url):
-    resource_etag_key = ETAG_KEY_FORMAT % (__name__, url)
-    resource_location_key = LOCATION_KEY_FORMAT % (__name__, url)
-    etag = kv_store.get(resource_etag_key)
-    location = kv_store.get(resource_location_key)
-    if location:
-        # Check to see if the cached file still exists
-        try:
-            f = open(location)
-            f.close()
-        except IOError:
-            etag, location = None, None
-    return etag, location
-
-
-def cache_etag_location(url, etag, location):
-    resource_etag_key = ETAG_KEY_FORMAT % (__name__, url)
-    resource_location_key = LOCATION_KEY_FORMAT % (__name__, url)
-    success = False
-    if etag and location:
-        kv_store.set(resource_etag_key, etag)
-        kv_store.set(resource_location_key, location)
-        success = True
-    return success
+    """ETag and location of a resource in the download cache
+    :return (etag, location), (None, None) if it is not cached
+    """
+    metadata = get_download_cache().metadata(url)
+    if metadata:
+        return metadata['etag'], metadata['location']
+    return None, None
 
 
 def get_resource(url, force_update=False, media_type=None, timeout=60):
-    etag, location = get_cached_etag_location(url)
-    headers = {}
-    if etag and not force_update:
-        headers['if-none-match'] = etag
-    if media_type:
-        headers['Accept'] = media_type
-    response = requests.get(url, headers=headers, timeout=timeout)
-    etag = response.headers.get('etag', None)
-    if response.status_code == 304:
-        # Unchanged
-        logger.info("ETag's match. No change resource - %s" % url)
-        return location
-    if response.ok:
-        logger.info("Downloaded - %s - Content-length: %s" % (
-            response.url, len(response.content)))
-        location = write_resource(response)
-        if cache_etag_location(url, etag, location):
-            logger.info("Successfully cached etag: %s for url: %s" % (etag, url))
-        return location
-    else:
-        logger.warning("Failed to download: %s Response: %s-%s" % (
-            url, response.status_code, response.reason))
-        return False
+    """Get a resource from the download cache, it is downloaded if it has
+    changed (see :py:class:`~moxie.core.download_cache.DownloadCache`)
+    :return location of the file or False
+    """
+    return get_download_cache().fetch(url, force_update=force_update, media_type=media_type,
+                                      timeout=timeout)
 
 
-@celery.task
-def download_file(url, location):
-    """Download a file and store it at location
-    :param url: URL to download the file from
-    :param location: location where to put the file
+def prefetch_resources(resources, force_update=False):
+    """Fetch resources concurrently (DOWNLOAD_CACHE_PREFETCH_CONCURRENCY
+    at a time) in the download cache
+    :param resources: list of (url, media type or None)
+    :return dict of url -> metadata of the resource (see
+            :py:meth:`~moxie.core.download_cache.DownloadCache.prefetch`)
     """
-    logger.info('Downloading {url} to {location}'.format(url=url,
-                                                         location=location))
-    try:
-        response = requests.get(url)
-    except RequestException as re:
-        # default behaviour is retry 3 times, every 3 minutes
-        #raise self.retry(exc=re)
-        raise download_file.retry(exc=re)
-    else:
-        directory_path = '/'.join(location.split('/')[:-1])
-        if not os.path.exists(directory_path):
-            os.makedirs(directory_path)
-        f = file(location, 'w+')
-        f.write(response.content)
-        f.close()
+    # the KV store is used by threads outside of the app context
+    cache = get_download_cache(kv_store._get_current_object())
+    return cache.prefetch(resources, force_update=force_update,
+                          concurrency=current_app.config.get('DOWNLOAD_CACHE_PREFETCH_CONCURRENCY',
+                                                             DEFAULT_PREFETCH_CONCURRENCY))
@@ -3,6 +3,7 @@ import requests
 import logging
 
 from moxie.core.service import Service
+from moxie.core.http import http_client
 from requests_oauthlib import OAuth1
 from flask import request, session
 
@@ -104,7 +105,7 @@ class OAuth1Service(Service):
         url = urlparse.urljoin(self.oauth_endpoint, self.request_token_path)
         temp_oa = OAuth1(client_key=self.client_identifier,
                 client_secret=self.client_secret, callback_uri=callback_uri)
-        response = requests.get(url, auth=temp_oa)
+        response = http_client.get(url, auth=temp_oa)
         qs = urlparse.parse_qs(response.text)
         self.temporary_credentials = (unicode(qs['oauth_token'][0]),
                 unicode(qs['oauth_token_secret'][0]))
@@ -138,7 +139,7 @@ class OAuth1Service(Service):
                 resource_owner_key=resource_owner_key,
                 resource_owner_secret=resource_owner_secret,
                 verifier=verifier)
-        response = requests.get(url=url, auth=access_oa)
+        response = http_client.get(url, auth=access_oa)
         qs = urlparse.parse_qs(response.text)
         logger.debug(qs)
         self.access_credentials = (unicode(qs['oauth_token'][0]),
@@ -151,7 +152,7 @@ class OAuth1Service(Service):
         http requests bound for protected resources::
 
             oa = OAuth1Service('http://private.foo/oauth', 'private', 'key')
-            requests.get('http://private.foo/private_resource', auth=oa.signer)
+            http_client.get('http://private.foo/private_resource', auth=oa.signer)
         """
         resource_owner_key, resource_owner_secret = self.access_credentials
         return OAuth1(client_key=self.client_identifier,
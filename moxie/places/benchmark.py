@@ -0,0 +1,172 @@
+"""Compare the latency of strategies of searches of POIs against an index,
+e.g.::
+
+    python -m moxie.places.benchmark solr+http://localhost:8080/solr/places rings --rings 1,5,25
+    python -m moxie.places.benchmark solr+http://localhost:8080/solr/places types
+
+Each strategy is a configuration of :py:class:`~moxie.places.services.POIService`,
+the same searches are made with each of them. Results of each strategy are
+compared with the results of the first one (``recall``: fraction of the
+documents of the first strategy also returned).
+"""
+import logging
+import math
+import random
+import time
+
+from moxie.places.geo import METRES_PER_DEGREE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CENTRE = (51.7531, -1.2584)
+DEFAULT_SPREAD = 5      # km
+DEFAULT_SEARCHES = 100
+# most common filters on types
+DEFAULT_TYPES = ['/university', '/university/college', '/university/department', '/university/library',
+                 '/amenities', '/amenities/food-drink', '/transport', '/transport/bus-stop',
+                 '/transport/car-park']
+
+
+class TimedSearcher(object):
+    """Search service recording the number of requests made and the time
+    spent by the search engine (QTime of Solr) to answer them
+    :param searcher: search service
+    """
+
+    def __init__(self, searcher):
+        self.searcher = searcher
+        self.requests = 0
+        self.qtime = 0
+
+    def search(self, query, fq=None, start=0, count=10):
+        response = self.searcher.search(query, fq=fq, start=start, count=count)
+        self.requests += 1
+        try:
+            self.qtime += response._raw_response['responseHeader']['QTime']
+        except (TypeError, KeyError):
+            pass
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.searcher, name)
+
+
+def random_searches(number, centre=DEFAULT_CENTRE, spread=DEFAULT_SPREAD, types=None, seed=0):
+    """Searches from random locations around a centre
+    :param number: number of searches
+    :param centre: lat/lon
+    :param spread: maximum distance in km from the centre
+    :param types: (optional) list of types, searches are made for each of them
+    :return list of dict (arguments of POIService.get_results)
+    """
+    rand = random.Random(seed)
+    searches = []
+    for i in range(number):
+        distance = spread * 1000 * math.sqrt(rand.random()) / METRES_PER_DEGREE
+        bearing = rand.random() * 2 * math.pi
+        lat = centre[0] + distance * math.cos(bearing)
+        lon = centre[1] + distance * math.sin(bearing) / math.cos(math.radians(centre[0]))
+        search = {'original_query': '', 'location': (lat, lon), 'start': 0, 'count': 35}
+        if types:
+            search['pois_type'] = types[i % len(types)]
+        searches.append(search)
+    return searches
+
+
+def type_searches(number, types=DEFAULT_TYPES):
+    """Searches of types (without location nor full-text query), each type
+    is searched for successive pages so that searches aren't answered from
+    the cache of results of the index
+    :param number: number of searches
+    :param types: list of types, searches are made for each of them
+    :return list of dict (arguments of POIService.get_results)
+    """
+    return [{'original_query': '', 'location': None, 'start': (i // len(types)) * 35, 'count': 35,
+             'pois_type': types[i % len(types)]} for i in range(number)]
+
+
+def run(service, searcher, searches):
+    """Make searches
+    :param service: POIService querying ``searcher``
+    :param searcher: TimedSearcher
+    :return dict (latencies in ms, ids of the results of each search,
+            requests, qtime in ms)
+    """
+    latencies = []
+    ids = []
+    for search in searches:
+        started = time.time()
+        results, _, _ = service.get_results(**search)
+        latencies.append((time.time() - started) * 1000)
+        ids.append([poi.id for poi in results])
+    return {'latencies': latencies, 'ids': ids, 'requests': searcher.requests, 'qtime': searcher.qtime}
+
+
+def compare(strategies, searches, warmup=None):
+    """Make the same searches with each strategy
+    :param strategies: list of (name, POIService, TimedSearcher)
+    :param searches: list of searches
+    :param warmup: (optional) list of other searches made before measuring
+                   (the same searches would be answered from caches of the index)
+    :return list of dict (name, median, p95, qtime, requests, recall)
+    """
+    report = []
+    baseline = None
+    for name, service, searcher in strategies:
+        if warmup:
+            run(service, searcher, warmup)
+            searcher.requests = searcher.qtime = 0
+        measures = run(service, searcher, searches)
+        if baseline is None:
+            baseline = measures['ids']
+        recalls = [float(len(set(expected) & set(ids))) / len(expected)
+                   for expected, ids in zip(baseline, measures['ids']) if expected]
+        latencies = sorted(measures['latencies'])
+        report.append({'name': name,
+                       'median': latencies[len(latencies) // 2] if latencies else 0,
+                       'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0,
+                       'qtime': float(measures['qtime']) / max(len(searches), 1),
+                       'requests': float(measures['requests']) / max(len(searches), 1),
+                       'recall': sum(recalls) / len(recalls) if recalls else 1.0})
+    return report
+
+
+def main():
+    import argparse
+    from moxie.core.search import SearchService
+    from moxie.places.services import POIService
+    parser = argparse.ArgumentParser(description='Compare strategies of searches of POIs.')
+    parser.add_argument('backend_uri', help='e.g. solr+http://localhost:8080/solr/places')
+    parser.add_argument('comparison', choices=['rings', 'types'],
+                        help='rings: searches from random locations with and without rings, '
+                             'types: filters on types with wildcards and with terms')
+    parser.add_argument('--searches', type=int, default=DEFAULT_SEARCHES)
+    parser.add_argument('--centre', default='%s,%s' % DEFAULT_CENTRE, help='lat,lon')
+    parser.add_argument('--spread', type=float, default=DEFAULT_SPREAD, help='km around the centre')
+    parser.add_argument('--types', help='comma-separated types to search for')
+    parser.add_argument('--rings', default='1,5,25', help='comma-separated radiuses in km')
+    ns = parser.parse_args()
+
+    centre = map(float, ns.centre.split(','))
+    types = ns.types.split(',') if ns.types else None
+    if ns.comparison == 'rings':
+        searches = random_searches(ns.searches, centre=centre, spread=ns.spread, types=types)
+        warmup = random_searches(ns.searches, centre=centre, spread=ns.spread, types=types, seed=1)
+        configurations = [('global', {}),
+                          ('rings', {'geo_rings': map(float, ns.rings.split(','))})]
+    else:
+        # no warm-up, filters would be cached by Solr
+        searches = type_searches(ns.searches, types=types or DEFAULT_TYPES)
+        warmup = None
+        configurations = [('wildcard', {'type_path_field': None}),
+                          ('terms', {'type_path_field': 'type_path'})]
+    strategies = []
+    for name, kwargs in configurations:
+        searcher = TimedSearcher(SearchService(ns.backend_uri))
+        strategies.append((name, POIService(search_service=searcher, **kwargs), searcher))
+    for result in compare(strategies, searches, warmup=warmup):
+        print ("{name:10} median {median:7.1f}ms  p95 {p95:7.1f}ms  QTime {qtime:7.1f}ms  "
+               "{requests:4.2f} requests  recall {recall:.3f}".format(**result))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import math
+
+EARTH_RADIUS = 6371.0088        # km, mean radius (as used by Solr's geodist)
+METRES_PER_DEGREE = 111320.0    # length of a degree of latitude
+
+
+def haversine(origin, destination):
+    """Great-circle distance between two points
+    :param origin: lat/lon
+    :param destination: lat/lon
+    :return distance in km
+    """
+    lat1, lon1 = map(math.radians, map(float, origin))
+    lat2, lon2 = map(math.radians, map(float, destination))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def quantise_location(location, cell):
+    """Snap a location to the centre of a cell of a grid, so that locations
+    close to each other (e.g. successive GPS fixes) give the same location.
+    Cells are ``cell`` metres high and about ``cell`` metres wide (the width
+    in degrees of longitude depends on the latitude of the row).
+    :param location: lat/lon
+    :param cell: size of a cell in metres
+    :return lat/lon (strings)
+    """
+    lat, lon = map(float, location)
+    lat_step = cell / METRES_PER_DEGREE
+    lat = max(-90.0, min(90.0, (math.floor(lat / lat_step) + 0.5) * lat_step))
+    lon_step = cell / (METRES_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    lon = (math.floor(lon / lon_step) + 0.5) * lon_step
+    lon = (lon + 180.0) % 360.0 - 180.0
+    return '%.6f' % lat, '%.6f' % lon
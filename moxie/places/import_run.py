@@ -0,0 +1,123 @@
+import json
+import logging
+import time
+import uuid
+
+from contextlib import contextmanager
+
+from moxie.core.metrics import statsd
+from moxie.places.importers.pipeline import peak_rss
+
+logger = logging.getLogger(__name__)
+
+RUN_KEY = '%s_last_run' % __name__
+
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+SUCCEEDED = 'succeeded'
+
+
+class ImportRun(object):
+    """Record of the last import run, kept in the KV store as a redis hash:
+    a field with the attributes of the run (id, status, times, ...) and a
+    field per stage, so stages running in different workers are recorded
+    without overwriting each other.
+
+    A stage has a ``status`` (running, completed or failed), ``started``,
+    ``seconds``, ``process_peak_rss`` (kB, peak memory of the process
+    running the stage since it started, workers run many stages),
+    ``peak_rss_increase`` (kB the peak of the process has increased by
+    during the stage, 0 if the stage stayed below an earlier peak) and
+    counters set by the stage itself (e.g. ``docs``, ``bytes``). Durations
+    of stages are sent to statsd as ``places.import.<stage>``.
+
+    :param kv: key-value store (redis)
+    :param attributes: attributes of the run
+    :param stages: (optional) dict of stage name -> stage
+    """
+
+    def __init__(self, kv, attributes, stages=None):
+        self.kv = kv
+        self.attributes = attributes
+        self.stages = stages or dict()
+
+    @classmethod
+    def start(cls, kv, **attributes):
+        """Start a new run, replacing the record of the last run
+        """
+        attributes.update(id=uuid.uuid4().hex, status=RUNNING, started=time.time())
+        kv.delete(RUN_KEY)
+        run = cls(kv, attributes)
+        run.save()
+        return run
+
+    @classmethod
+    def last(cls, kv):
+        """Last run recorded
+        :return ImportRun or None
+        """
+        fields = kv.hgetall(RUN_KEY)
+        if not fields or 'run' not in fields:
+            return None
+        attributes = json.loads(fields.pop('run'))
+        return cls(kv, attributes, dict((name, json.loads(stage)) for name, stage in fields.iteritems()))
+
+    @property
+    def id(self):
+        return self.attributes['id']
+
+    @property
+    def status(self):
+        return self.attributes['status']
+
+    def save(self):
+        self.kv.hset(RUN_KEY, 'run', json.dumps(self.attributes))
+
+    def save_stage(self, name, stage):
+        self.stages[name] = stage
+        self.kv.hset(RUN_KEY, name, json.dumps(stage))
+
+    def completed(self, name):
+        """True if the stage has completed"""
+        return self.stages.get(name, {}).get('status') == COMPLETED
+
+    @contextmanager
+    def stage(self, name, **attributes):
+        """Record a stage, the stage (a dict) is given to the block to set
+        its counters. The stage fails if the block raises or sets its
+        ``status`` to ``FAILED``.
+        :param name: name of the stage
+        :param attributes: initial attributes of the stage
+        """
+        stage = dict(attributes, status=RUNNING, started=time.time())
+        self.save_stage(name, stage)
+        rss_before = peak_rss()
+        try:
+            yield stage
+        except:
+            stage['status'] = FAILED
+            raise
+        finally:
+            if stage['status'] == RUNNING:
+                stage['status'] = COMPLETED
+            stage['seconds'] = time.time() - stage['started']
+            stage['process_peak_rss'] = peak_rss()
+            stage['peak_rss_increase'] = stage['process_peak_rss'] - rss_before
+            self.save_stage(name, stage)
+            statsd.timing('places.import.{name}'.format(name=name), int(stage['seconds'] * 1000))
+            logger.info("Import {id} - stage {name} {status} in {seconds:.1f}s".format(
+                id=self.id, name=name, **stage))
+
+    def finish(self, status):
+        """End the run
+        :param status: SUCCEEDED or FAILED
+        """
+        self.attributes.update(status=status, finished=time.time())
+        self.attributes['seconds'] = self.attributes['finished'] - self.attributes['started']
+        self.save()
+        statsd.timing('places.import', int(self.attributes['seconds'] * 1000))
+        logger.info("Import {id} {status} in {seconds:.1f}s".format(**self.attributes))
+
+    def as_dict(self):
+        return dict(self.attributes, stages=self.stages)
@@ -0,0 +1,168 @@
+import bz2
+import logging
+import re
+
+from moxie.places.importers.pipeline import make_pool, ordered_map
+
+logger = logging.getLogger(__name__)
+
+# Multi-stream bz2 files (e.g. from Geofabrik, pbzip2) are made of
+# independent streams, each one starting with a stream header (BZh and the
+# block size) directly followed by the magic number of its first block.
+STREAM_HEADER = re.compile(r'BZh[1-9]1AY&SY')
+HEADER_SIZE = 10
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+
+def split_streams(f, read_size=DEFAULT_BUFFER_SIZE, max_segment_size=None):
+    """Split a bz2 file on (what looks like) stream boundaries
+    :param f: file object of the bz2 file
+    :param read_size: size of reads from the file
+    :param max_segment_size: segments are cut at this size even if no stream
+                             header has been found (e.g. single-stream files),
+                             16 * read_size by default
+    :return generator of segments of compressed data
+    """
+    max_segment_size = max_segment_size or 16 * read_size
+    buf = ''
+    while True:
+        data = f.read(read_size)
+        # the first header is at the start of the segment, only search
+        # new data (and the end of the previous one for split headers)
+        scan_from = max(1, len(buf) - HEADER_SIZE + 1)
+        buf += data
+        start = 0
+        for match in STREAM_HEADER.finditer(buf, scan_from):
+            yield buf[start:match.start()]
+            start = match.start()
+        buf = buf[start:]
+        if not data:
+            break
+        while len(buf) > max_segment_size + HEADER_SIZE:
+            # keep the end of the buffer, it may be the start of a header
+            yield buf[:max_segment_size]
+            buf = buf[max_segment_size:]
+    if buf:
+        yield buf
+
+
+def decompress_segment(segment):
+    """Decompress a segment, run in a pool of processes
+    :return (data, None) if the segment is exactly one stream,
+            (None, segment) otherwise (stream split on a false stream
+            header or cut, corrupted data...) to be decompressed serially
+    """
+    decompressor = bz2.BZ2Decompressor()
+    try:
+        data = decompressor.decompress(segment)
+        # raises EOFError if the end of the stream has been reached
+        decompressor.decompress('')
+    except EOFError:
+        if not decompressor.unused_data:
+            return data, None
+    except IOError:
+        pass
+    return None, segment
+
+
+class SerialDecompressor(object):
+    """Decompress consecutive segments of one or more streams
+    """
+
+    def __init__(self):
+        self.decompressor = bz2.BZ2Decompressor()
+        # the last stream ended at the end of the last segment
+        self.ended = False
+
+    def decompress(self, data):
+        out = []
+        while data:
+            out.append(self.decompressor.decompress(data))
+            data = ''
+            try:
+                self.decompressor.decompress('')
+                self.ended = False
+            except EOFError:
+                data = self.decompressor.unused_data
+                self.decompressor = bz2.BZ2Decompressor()
+                self.ended = True
+        return ''.join(out)
+
+
+def decompress(f, pool=None, buffer_size=DEFAULT_BUFFER_SIZE, window=8):
+    """Decompress a (multi-stream) bz2 file, streams are decompressed in a
+    pool of processes. Segments which are not exactly one stream are
+    decompressed serially, so single-stream files are still supported
+    (without the speed-up).
+
+    :param f: file object of the bz2 file
+    :param pool: (optional) pool of processes
+    :param buffer_size: size of reads and minimum size of yielded buffers
+    :param window: number of segments decompressed concurrently
+    :return generator of decompressed buffers, in order
+    """
+    serial = None
+    pending, pending_size = [], 0
+    for data, segment in ordered_map(decompress_segment, split_streams(f, buffer_size),
+                                     pool=pool, window=window):
+        if segment is not None:
+            if serial is None:
+                serial = SerialDecompressor()
+            data = serial.decompress(segment)
+            if serial.ended:
+                serial = None
+        elif serial is not None:
+            raise IOError("Compressed file ended unexpectedly")
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= buffer_size:
+            yield ''.join(pending)
+            pending, pending_size = [], 0
+    if serial is not None and not serial.ended:
+        raise IOError("Compressed file ended unexpectedly")
+    if pending:
+        yield ''.join(pending)
+
+
+def main():
+    """Compare throughput of the serial 8KB loop and of parallel decompression
+    """
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('bz2file')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--buffer-size', type=int, default=DEFAULT_BUFFER_SIZE)
+    ns = parser.parse_args()
+
+    def serial():
+        # previous loop, BZ2Decompressor alone stops at the end of the first stream
+        decompressor = SerialDecompressor()
+        with open(ns.bz2file, 'rb') as f:
+            buffer = f.read(8192)
+            while buffer:
+                yield decompressor.decompress(buffer)
+                buffer = f.read(8192)
+
+    def parallel():
+        pool = make_pool(ns.processes)
+        try:
+            with open(ns.bz2file, 'rb') as f:
+                for data in decompress(f, pool=pool, buffer_size=ns.buffer_size):
+                    yield data
+        finally:
+            if pool:
+                pool.terminate()
+
+    for name, chunks in (('serial', serial), ('parallel', parallel)):
+        started = time.time()
+        size = sum(len(chunk) for chunk in chunks())
+        elapsed = time.time() - started
+        print "{name:>8}: {size} bytes in {elapsed:.2f}s ({rate:.1f} MB/s)".format(
+            name=name, size=size, elapsed=elapsed, rate=size / elapsed / (1 << 20))
+
+
+if __name__ == '__main__':
+    main()
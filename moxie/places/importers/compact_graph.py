@@ -0,0 +1,313 @@
+import logging
+import tempfile
+
+from array import array
+
+from rdflib import BNode, Literal
+from rdflib.plugins.parsers.notation3 import RDFSink, SinkParser
+from rdflib.plugins.parsers.ntriples import NTriplesParser
+from rdflib.plugins.serializers.nt import _nt_row
+
+logger = logging.getLogger(__name__)
+
+# serializations which can be converted to N-Triples without loading them
+# in a graph
+TURTLE_FORMATS = ('turtle', 'text/turtle', 'n3', 'text/n3')
+NTRIPLES_FORMATS = ('nt', 'application/n-triples')
+
+# identifiers of terms (less than 2**31 terms)
+ID_TYPECODE = 'i'
+
+
+class NTriplesWriter(object):
+    """Graph-like object writing triples added to a file as N-Triples
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def add(self, triple):
+        self.f.write(_nt_row(triple).encode('ascii', 'replace'))
+        self.count += 1
+
+
+class StreamingSink(RDFSink):
+    """Sink of the N3/Turtle parser adding triples to any object having an
+    ``add`` method rather than to a graph
+    """
+
+    def newBlankNode(self, arg=None, uri=None, why=None):
+        return BNode()
+
+
+def turtle_to_ntriples(source, out):
+    """Convert a Turtle document to N-Triples, triples are written as they
+    are parsed instead of being kept in a graph
+    :param source: file object of the Turtle document
+    :param out: file object where N-Triples are written
+    :return number of triples
+    """
+    writer = NTriplesWriter(out)
+    root = object()
+    parser = SinkParser(StreamingSink(writer), openFormula=root, turtle=True)
+    parser.loadStream(source)
+    return writer.count
+
+
+class CompactGraph(object):
+    """Read-only graph using a fraction of the memory of ``rdflib.Graph``.
+
+    Terms are interned (an identifier per URI or blank node, literals are
+    only referenced), triples are kept in two adjacency tables of
+    ``array``: (predicate, object) pairs by subject and (predicate, subject)
+    pairs by object (for objects which are not literals).
+
+    Only the access patterns used by the OxPoints importers are supported:
+    ``value``, ``objects``, ``subjects``, ``subject_objects`` and
+    ``triples`` with a subject or an object. Triples are added (``add``,
+    :py:meth:`parse_ntriples`) then the graph is frozen on the first lookup,
+    repeated triples are only kept once (as in ``rdflib.Graph``).
+    """
+
+    def __init__(self):
+        self.terms = []
+        self.ids = dict()
+        # triples being loaded
+        self.loading = [array(ID_TYPECODE) for _ in range(3)]
+        self.count = 0
+        self.offsets = self.pairs = None
+        self.inverse_offsets = self.inverse_pairs = None
+
+    def intern(self, term):
+        if isinstance(term, Literal):
+            self.terms.append(term)
+            return len(self.terms) - 1
+        id = self.ids.get(term)
+        if id is None:
+            id = self.ids[term] = len(self.terms)
+            self.terms.append(term)
+        return id
+
+    def add(self, triple):
+        if self.offsets is not None:
+            raise TypeError("Graph is frozen")
+        for values, term in zip(self.loading, triple):
+            values.append(self.intern(term))
+        self.count += 1
+
+    def triple(self, s, p, o):
+        """Sink of :py:class:`NTriplesParser`"""
+        self.add((s, p, o))
+
+    def parse_ntriples(self, f):
+        """Add triples of an N-Triples file
+        """
+        parser = NTriplesParser(sink=self)
+        # identifiers of blank nodes are shared by parsers otherwise
+        parser._bnode_ids = dict()
+        parser.parse(f)
+
+    def freeze(self):
+        """Build the adjacency tables, called on the first lookup
+        """
+        if self.offsets is not None:
+            return
+        subjects, predicates, objects = self.loading
+        self.loading = None
+        self.offsets, self.pairs = self._unique(*self._adjacency(subjects, predicates, objects))
+        # triples without repeats
+        subjects = array(ID_TYPECODE)
+        for key in xrange(len(self.offsets) - 1):
+            subjects.extend(array(ID_TYPECODE, [key]) * (self.offsets[key + 1] - self.offsets[key]))
+        predicates, objects = self.pairs[0::2], self.pairs[1::2]
+        self.count = len(subjects)
+        literals = bytearray(isinstance(term, Literal) for term in self.terms)
+        self.inverse_offsets, self.inverse_pairs = self._adjacency(objects, predicates, subjects,
+                                                                   skip=literals)
+        logger.debug("{count} triples, {terms} terms".format(count=self.count, terms=len(self.terms)))
+
+    def _adjacency(self, keys, predicates, values, skip=None):
+        """Counting sort of (predicate, value) pairs by key
+        :return (offsets, pairs), pairs of the key k are between
+                2 * offsets[k] and 2 * offsets[k + 1]
+        """
+        offsets = array(ID_TYPECODE, [0]) * (len(self.terms) + 1)
+        for key in keys:
+            if not (skip and skip[key]):
+                offsets[key + 1] += 1
+        for i in xrange(1, len(offsets)):
+            offsets[i] += offsets[i - 1]
+        positions = array(ID_TYPECODE, offsets)
+        pairs = array(ID_TYPECODE, [0]) * (2 * offsets[-1])
+        for i in xrange(len(keys)):
+            key = keys[i]
+            if skip and skip[key]:
+                continue
+            position = 2 * positions[key]
+            positions[key] += 1
+            pairs[position] = predicates[i]
+            pairs[position + 1] = values[i]
+        return offsets, pairs
+
+    def _unique(self, offsets, pairs):
+        """Remove repeated (predicate, value) pairs of each key, in place.
+        Literals are not interned so values are compared by term.
+        :return (offsets, pairs)
+        """
+        terms = self.terms
+        unique = array(ID_TYPECODE, [0]) * len(offsets)
+        position = 0
+        for key in xrange(len(offsets) - 1):
+            start, end = 2 * offsets[key], 2 * offsets[key + 1]
+            seen = set()
+            for i in xrange(start, end, 2):
+                if end - start > 2:
+                    pair = pairs[i], terms[pairs[i + 1]]
+                    if pair in seen:
+                        continue
+                    seen.add(pair)
+                pairs[position] = pairs[i]
+                pairs[position + 1] = pairs[i + 1]
+                position += 2
+            unique[key + 1] = position // 2
+        del pairs[position:]
+        return unique, pairs
+
+    def _pairs(self, offsets, pairs, id, predicate_id=None):
+        for i in xrange(2 * offsets[id], 2 * offsets[id + 1], 2):
+            if predicate_id is None or pairs[i] == predicate_id:
+                yield pairs[i], pairs[i + 1]
+
+    def triples(self, (s, p, o)):
+        self.freeze()
+        terms = self.terms
+        if p is None:
+            predicate_id = None
+        else:
+            predicate_id = self.ids.get(p)
+            if predicate_id is None:
+                return
+        if s is not None:
+            subject_id = self.ids.get(s)
+            if subject_id is None:
+                return
+            for pid, oid in self._pairs(self.offsets, self.pairs, subject_id, predicate_id):
+                if o is None or terms[oid] == o:
+                    yield s, terms[pid], terms[oid]
+        elif o is not None:
+            object_id = None if isinstance(o, Literal) else self.ids.get(o)
+            if object_id is not None:
+                for pid, sid in self._pairs(self.inverse_offsets, self.inverse_pairs, object_id,
+                                            predicate_id):
+                    yield terms[sid], terms[pid], o
+            else:
+                # literal objects are not indexed
+                for triple in self.triples((None, p, None)):
+                    if triple[2] == o:
+                        yield triple
+        else:
+            for subject_id in xrange(len(terms)):
+                for pid, oid in self._pairs(self.offsets, self.pairs, subject_id, predicate_id):
+                    yield terms[subject_id], terms[pid], terms[oid]
+
+    def value(self, subject=None, predicate=None, object=None, default=None, any=True):
+        """Object (or subject if ``object`` is given) of the first triple
+        matching, as ``rdflib.Graph.value`` with ``any=True``
+        """
+        for s, p, o in self.triples((subject, predicate, object)):
+            return s if subject is None else o
+        return default
+
+    def objects(self, subject=None, predicate=None):
+        for _, _, o in self.triples((subject, predicate, None)):
+            yield o
+
+    def subjects(self, predicate=None, object=None):
+        for s, _, _ in self.triples((None, predicate, object)):
+            yield s
+
+    def subject_objects(self, predicate=None):
+        for s, _, o in self.triples((None, predicate, None)):
+            yield s, o
+
+    def __contains__(self, triple):
+        for _ in self.triples(triple):
+            return True
+        return False
+
+    def __iter__(self):
+        return self.triples((None, None, None))
+
+    def __len__(self):
+        self.freeze()
+        return self.count
+
+
+def load_compact_graph(locations, rdf_media_type='text/turtle', directory=None):
+    """Load documents in a :py:class:`CompactGraph`, Turtle documents are
+    converted to N-Triples in a temporary file, other serializations are
+    parsed by rdflib.
+    :param locations: paths of the documents
+    :param rdf_media_type: serialization of the documents
+    :param directory: (optional) directory of temporary files
+    :return CompactGraph
+    """
+    graph = CompactGraph()
+    for location in locations:
+        with open(location, 'rb') as f:
+            if rdf_media_type in NTRIPLES_FORMATS:
+                graph.parse_ntriples(f)
+            elif rdf_media_type in TURTLE_FORMATS:
+                with tempfile.TemporaryFile(dir=directory) as ntriples:
+                    turtle_to_ntriples(f, ntriples)
+                    ntriples.seek(0)
+                    graph.parse_ntriples(ntriples)
+            else:
+                import rdflib
+                logger.warning("Loading {location} in memory, {media_type} can't be streamed".format(
+                    location=location, media_type=rdf_media_type))
+                for triple in rdflib.Graph().parse(f, format=rdf_media_type):
+                    graph.add(triple)
+    graph.freeze()
+    return graph
+
+
+def main():
+    """Compare peak memory used to load documents in a ``rdflib.Graph`` and
+    in a :py:class:`CompactGraph`
+    """
+    import argparse
+    import time
+    from multiprocessing import Process, Queue
+    from moxie.places.importers.pipeline import peak_rss
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('rdf_files', nargs='+')
+    parser.add_argument('--format', default='text/turtle')
+    ns = parser.parse_args()
+
+    def load(kind, queue):
+        before = peak_rss()
+        started = time.time()
+        if kind == 'rdflib':
+            import rdflib
+            graph = rdflib.Graph()
+            for path in ns.rdf_files:
+                graph.parse(path, format=ns.format)
+        else:
+            graph = load_compact_graph(ns.rdf_files, ns.format)
+        queue.put((kind, len(graph), peak_rss() - before, time.time() - started))
+
+    queue = Queue()
+    for kind in ('rdflib', 'compact'):
+        process = Process(target=load, args=(kind, queue))
+        process.start()
+        process.join()
+        kind, count, rss, elapsed = queue.get()
+        print "{kind:>7}: {count} triples, peak RSS +{mb:.1f} MB ({per:.0f} bytes per triple), {elapsed:.2f}s".format(
+            kind=kind, count=count, mb=rss / 1024.0, per=rss * 1024.0 / max(count, 1), elapsed=elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def document_hash(doc):
+    """Hash of the content of a document, keys set by the index
+    (``_version_``) are ignored
+    :param doc: document
+    :return string
+    """
+    content = dict((key, value) for key, value in doc.iteritems() if key != '_version_')
+    return hashlib.sha1(json.dumps(content, sort_keys=True)).hexdigest()[:16]
+
+
+class DocumentDelta(object):
+    """Changes between the documents of an import and the documents of the
+    previous import, using a content hash per document id kept in the KV
+    store (as JSON).
+
+    Typical usage::
+
+        delta = DocumentDelta(kv_store, key)
+        writer.write(delta.changed(documents))
+        delete(delta.deleted())
+        delta.save()
+
+    :param kv: key-value store of the hashes
+    :param key: key of the hashes in the KV store
+    """
+
+    def __init__(self, kv, key):
+        self.kv = kv
+        self.key = key
+        self.hashes = dict()
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self._previous = None
+
+    def exists(self):
+        """True if hashes of a previous import are stored"""
+        return bool(self.kv.get(self.key))
+
+    @property
+    def previous(self):
+        if self._previous is None:
+            hashes = self.kv.get(self.key)
+            self._previous = json.loads(hashes) if hashes else dict()
+        return self._previous
+
+    def changed(self, documents):
+        """Generator of documents added or changed since the previous import
+        :param documents: iterable of all the documents of this import
+        """
+        previous = self.previous
+        for doc in documents:
+            digest = document_hash(doc)
+            self.hashes[doc['id']] = digest
+            current = previous.get(doc['id'])
+            if current == digest:
+                self.unchanged += 1
+                continue
+            if current is None:
+                self.added += 1
+            else:
+                self.updated += 1
+            yield doc
+
+    def record(self, documents):
+        """Generator of all the documents, recording their hashes (e.g. for
+        a full rebuild)
+        :param documents: iterable of all the documents of this import
+        """
+        for doc in documents:
+            self.hashes[doc['id']] = document_hash(doc)
+            yield doc
+
+    def deleted(self):
+        """Ids of documents of the previous import which are not part of
+        this import, documents must have been consumed first
+        :return list of ids
+        """
+        return sorted(set(self.previous) - set(self.hashes))
+
+    def save(self):
+        """Store the hashes of this import
+        """
+        self.kv.set(self.key, json.dumps(self.hashes))
+
+    def __repr__(self):
+        return ('<DocumentDelta {added} added, {updated} updated, {unchanged} unchanged, '
+                '{deleted} deleted>').format(added=self.added, updated=self.updated,
+                                             unchanged=self.unchanged,
+                                             deleted=len(self.deleted()))
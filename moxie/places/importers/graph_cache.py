@@ -0,0 +1,150 @@
+import cPickle
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import time
+
+import rdflib
+
+from moxie.core.metrics import statsd
+from moxie.core.tasks import get_cached_etag_location
+from moxie.places.importers.compact_graph import load_compact_graph
+
+logger = logging.getLogger(__name__)
+
+CACHE_SUFFIX = '.graph'
+
+
+def private_directory(directory):
+    """Create the directory (mode 0700) if it doesn't exist, graphs are
+    pickled so the directory must only be writable by the current user
+    :raise ValueError: if the directory is not owned by the current user or
+                       is accessible by other users
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0700)
+    status = os.stat(directory)
+    if status.st_uid != os.getuid() or status.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise ValueError("Graph cache directory {directory} must be owned by the current user "
+                         "and not accessible by others (mode 0700)".format(directory=directory))
+    return directory
+
+
+def fingerprint(resources):
+    """Key of a graph made of resources, uses the ETag of each resource
+    (or the size and modification time of the file if there is no ETag)
+    :param resources: list of (url, location of the downloaded file)
+    :return string
+    """
+    parts = []
+    for url, location in resources:
+        etag, _ = get_cached_etag_location(url)
+        if not etag:
+            stat = os.stat(location)
+            etag = '{size}-{mtime}'.format(size=stat.st_size, mtime=stat.st_mtime)
+        parts.append((url, etag))
+    return hashlib.sha1(json.dumps(parts)).hexdigest()
+
+
+class GraphCache(object):
+    """Parsed RDF graphs pickled on disk, keyed by the fingerprint of the
+    resources they have been parsed from. Only the ``keep`` most recent
+    graphs are kept.
+
+    Unpickling runs code, the directory must be private to the user of
+    the process (see :py:func:`private_directory`), graphs not owned by
+    the user are ignored.
+
+    :param directory: private directory of the cache
+    :param keep: number of graphs kept
+    :raise ValueError: if the directory isn't private
+    """
+
+    def __init__(self, directory, keep=2):
+        self.directory = private_directory(directory)
+        self.keep = keep
+
+    def path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def get(self, key):
+        """Get a graph
+        :return Graph or None
+        """
+        try:
+            with open(self.path(key), 'rb') as f:
+                if os.fstat(f.fileno()).st_uid != os.getuid():
+                    logger.warning("Cached graph {key} not owned by the current user, ignored".format(key=key))
+                    return None
+                return cPickle.load(f)
+        except IOError:
+            return None
+        except Exception:
+            logger.warning("Couldn't load cached graph {key}".format(key=key), exc_info=True)
+            return None
+
+    def set(self, key, graph):
+        private_directory(self.directory)
+        # write to a temporary file and rename so readers never see a
+        # partial file
+        f = tempfile.NamedTemporaryFile(dir=self.directory, delete=False)
+        try:
+            cPickle.dump(graph, f, cPickle.HIGHEST_PROTOCOL)
+            f.close()
+            os.rename(f.name, self.path(key))
+        except Exception:
+            f.close()
+            os.unlink(f.name)
+            raise
+        self.prune(key)
+
+    def prune(self, current):
+        """Remove oldest graphs, the current graph is always kept
+        """
+        current = self.path(current)
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                 if name.endswith(CACHE_SUFFIX)]
+        paths.sort(key=lambda path: (path == current, os.path.getmtime(path)), reverse=True)
+        for path in paths[self.keep:]:
+            os.unlink(path)
+
+
+def load_graph(resources, rdf_media_type='text/turtle', cache=None, compact=False):
+    """Get the graph made of resources, from the cache if none of the
+    resources has changed, parsing them otherwise. Time to get the graph
+    is sent to statsd as ``places.importers.oxpoints.graph``.
+
+    :param resources: list of (url, location of the downloaded file)
+    :param rdf_media_type: serialization of resources
+    :param cache: (optional) :py:class:`GraphCache`
+    :param compact: load resources in a read-only
+                    :py:class:`~moxie.places.importers.compact_graph.CompactGraph`
+                    instead of a ``rdflib.Graph``
+    :return Graph
+    """
+    started = time.time()
+    key = None
+    if cache:
+        key = fingerprint(resources) + ('-compact' if compact else '')
+    graph = cache.get(key) if cache else None
+    if graph is None:
+        if compact:
+            graph = load_compact_graph([location for _, location in resources], rdf_media_type)
+        else:
+            graph = rdflib.Graph()
+            for _, location in resources:
+                with open(location) as f:
+                    graph.parse(f, format=rdf_media_type)
+        if cache:
+            cache.set(key, graph)
+        source = 'parsed'
+    else:
+        source = 'cache'
+    elapsed = time.time() - started
+    statsd.timing('places.importers.oxpoints.graph', int(elapsed * 1000))
+    logger.info("Graph of {count} triples loaded from {source} in {elapsed:.2f}s".format(
+        count=len(graph), source=source, elapsed=elapsed))
+    return graph
@@ -19,9 +19,14 @@ SPECIAL_KEYS = ['id', '_version_']
 MANAGED_KEYS = ['name', 'name_sort', 'location']
 MERGABLE_KEYS = ['identifiers', 'tags', 'type', 'type_name']
 PRECEDENCE_KEY = 'meta_precedence'
+TYPE_PATH_KEY = 'type_path'
+REGIONS_KEY = 'regions'
+
+# Keys computed from the merged doc
+DERIVED_KEYS = [TYPE_PATH_KEY, REGIONS_KEY]
 
 # Keys we don't want to copy over to the merged doc
-PROTECTED_KEYS = MANAGED_KEYS + MERGABLE_KEYS + SPECIAL_KEYS
+PROTECTED_KEYS = MANAGED_KEYS + MERGABLE_KEYS + SPECIAL_KEYS + DERIVED_KEYS
 
 
 class ACIDException(Exception):
@@ -47,23 +52,53 @@ def prepare_document(doc, results, precedence):
     @return: document updated to fill
     """
     # TODO this function shouldn't be called by importers but should be part of the import process at a lower level
-
-    # Add the "friendly" name of the type to the full-text search field
-    try:
-        doc['type_name'] = find_type_name(doc["type"])
-    except KeyError:
-        logger.warning("Couldn't find name for type '{0}'.".format(doc["type"]))
+    add_type_name(doc)
 
     # Attempt to merge documents
     if len(results.results) == 0:
         doc[PRECEDENCE_KEY] = precedence
-        return doc
+        return add_type_path(doc)
     elif len(results.results) == 1:
-        return merge_docs(results.results[0], doc, precedence)
+        return add_type_path(merge_docs(results.results[0], doc, precedence))
     else:
         raise ACIDException()
 
 
+def add_type_name(doc):
+    """Add the "friendly" name of the type to the full-text search field
+    @param doc: document having a type
+    @return: document
+    """
+    try:
+        doc['type_name'] = find_type_name(doc["type"])
+    except KeyError:
+        logger.warning("Couldn't find name for type '{0}'.".format(doc.get("type")))
+    return doc
+
+
+def add_type_path(doc):
+    """Add every ancestor of the types of the document (and the types
+    themselves) as exact tokens, so that documents of a type and its
+    sub-types are filtered with a term rather than a wildcard, e.g.
+    "/university/college" gives ["/university", "/university/college"]
+    @param doc: document
+    @return: document
+    """
+    types = doc.get('type', [])
+    if not isinstance(types, list):
+        types = [types]
+    paths = set()
+    for type_path in types:
+        parts = type_path.strip('/').split('/')
+        for i in range(1, len(parts) + 1):
+            paths.add('/' + '/'.join(parts[:i]))
+    if paths:
+        doc[TYPE_PATH_KEY] = sorted(paths)
+    else:
+        doc.pop(TYPE_PATH_KEY, None)
+    return doc
+
+
 def find_type_name(type_paths, singular=True):
     """
     Find the name of the type from its path
@@ -0,0 +1,235 @@
+import json
+import logging
+import os
+
+from collections import defaultdict
+
+from moxie.places.importers.helpers import (prepare_document, merge_docs, add_type_name, add_type_path,
+                                            MERGABLE_KEYS, PRECEDENCE_KEY)
+from moxie.places.regions import add_regions
+
+logger = logging.getLogger(__name__)
+
+
+class StagingIndexMerger(object):
+    """Merge documents against documents already in the index, one search
+    per document. Documents are only sent to the index (and soft committed)
+    at the end of each source (importer), so the result depends on the order
+    of importers. :py:meth:`commit` makes them durable.
+
+    Keys derived from the merged document (``type_path``, ``regions``) are
+    computed again after each merge.
+
+    :param indexer: searcher of the index
+    :param identifier_key: key of the identifiers of documents
+    :param regions: (optional) list of :py:class:`~moxie.places.regions.Region`
+    """
+
+    def __init__(self, indexer, identifier_key='identifiers', regions=None):
+        self.indexer = indexer
+        self.identifier_key = identifier_key
+        self.regions = regions or []
+        self.documents = []
+
+    def add(self, doc, precedence, enrich_only=False):
+        """Merge a document with the matching document in the index
+        :param doc: document to merge
+        :param precedence: precedence of the source of the document
+        :param enrich_only: only merge the document if a matching document
+                            exists, do not index it on its own
+        :return merged document or None
+        """
+        search_results = self.indexer.search_for_ids(self.identifier_key,
+                                                     doc[self.identifier_key])
+        if enrich_only:
+            if not search_results.results:
+                logger.info('No results for {idents}'.format(idents=doc[self.identifier_key]))
+                return None
+            merged = merge_docs(search_results.results[0], doc, precedence)
+        else:
+            merged = prepare_document(doc, search_results, precedence)
+        merged = add_regions(add_type_path(merged), self.regions)
+        self.documents.append(merged)
+        return merged
+
+    def end_source(self):
+        """Index documents of the source and (soft) commit so the next
+        source can search for them.
+        """
+        self.indexer.index(self.documents)
+        self.indexer.commit(soft=True)
+        self.documents = []
+
+    def commit(self):
+        """Hard commit once the last source has ended, documents are only
+        visible after a soft commit but not durable
+        """
+        self.indexer.commit()
+
+
+class SpillWriter(object):
+    """Write documents of a source to a spill file, one JSON list
+    ``[precedence, enrich_only, document]`` per line, to be merged later by
+    :py:meth:`MergeEngine.add_spill` (e.g. when importers run in separate
+    processes). The file only appears at ``path`` once the source has ended.
+
+    :param path: path of the spill file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open(path + '.part', 'wb')
+
+    def add(self, doc, precedence, enrich_only=False):
+        self._file.write(json.dumps([precedence, enrich_only, doc]))
+        self._file.write('\n')
+        self.count += 1
+        return doc
+
+    def end_source(self):
+        if not self._file.closed:
+            self._file.close()
+            os.rename(self._file.name, self.path)
+            logger.info('{count} documents written to {path}'.format(count=self.count, path=self.path))
+
+
+class MergeEngine(object):
+    """In-memory merge of documents from all sources.
+
+    Documents of different sources sharing (transitively) any identifier
+    are grouped using a union-find, documents of the same source are not
+    merged on their own (as with the index, where documents of a source are
+    only searched by the next sources). Each group is merged with the usual
+    rules (see :py:func:`~moxie.places.importers.helpers.merge_docs`),
+    folding documents by increasing precedence:
+
+    - ``MERGABLE_KEYS`` are the union of all documents
+    - ``MANAGED_KEYS`` come from the document with the highest precedence
+      (ties are broken on the ``id``)
+    - other keys are overwritten by documents of higher precedence
+    - the ``id`` is the one of the first document of the first source, as
+      if sources had been indexed one after the other
+
+    Sources are added in order, :py:meth:`end_source` starts a new source.
+    Documents added with ``enrich_only`` are merged last and only if their
+    group contains at least one other document.
+
+    Keys derived from the merged document (``type_path``, ``regions``) are
+    computed once it has been merged.
+
+    All documents are held in memory until they are merged, the memory used
+    grows with the number of documents of all sources.
+
+    :param identifier_key: key of the identifiers of documents
+    :param regions: (optional) list of :py:class:`~moxie.places.regions.Region`
+    """
+
+    def __init__(self, identifier_key='identifiers', regions=None):
+        self.identifier_key = identifier_key
+        self.regions = regions or []
+        self._parents = []
+        # identifier -> {source: first document of the source having it}
+        self._owners = dict()
+        self._entries = []
+        self._source = 0
+
+    def _find(self, index):
+        parents = self._parents
+        while parents[index] != index:
+            # path halving
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    def _union(self, first, second):
+        first, second = self._find(first), self._find(second)
+        if first != second:
+            # the first document added is the root
+            if second < first:
+                first, second = second, first
+            self._parents[second] = first
+
+    def add(self, doc, precedence, enrich_only=False):
+        """Add a document of the current source to be merged
+        :param doc: document to merge
+        :param precedence: precedence of the source of the document
+        :param enrich_only: only merge the document in an existing group
+        """
+        identifiers = doc.get(self.identifier_key) or [doc['id']]
+        index = len(self._entries)
+        self._parents.append(index)
+        for ident in identifiers:
+            owners = self._owners.setdefault(ident, dict())
+            for source, other in owners.items():
+                if source != self._source:
+                    self._union(other, index)
+            owners.setdefault(self._source, index)
+        self._entries.append((enrich_only, precedence, doc.get('id', ''), self._source, index, doc))
+        return doc
+
+    def end_source(self):
+        self._source += 1
+
+    def add_spill(self, path):
+        """Add documents of a spill file written by :py:class:`SpillWriter`
+        as a source
+        """
+        with open(path, 'rb') as f:
+            for line in f:
+                precedence, enrich_only, doc = json.loads(line)
+                self.add(doc, precedence, enrich_only=enrich_only)
+        self.end_source()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def groups(self):
+        """Group documents sharing identifiers
+        :return list of list of entries, ordered by the id of their first
+                document
+        """
+        groups = defaultdict(list)
+        for entry in self._entries:
+            groups[self._find(entry[4])].append(entry)
+        return sorted(groups.values(), key=lambda group: (group[0][2], group[0][4]))
+
+    def documents(self):
+        """Generator of merged documents, each document is emitted once
+        """
+        for group in self.groups():
+            doc = self.merge_group(group)
+            if doc:
+                yield doc
+
+    def merge_group(self, entries):
+        """Merge a group of entries
+        :param entries: list of entries sharing identifiers
+        :return merged document or None if there is no primary document
+        """
+        primaries = [e for e in entries if not e[0]]
+        if not primaries:
+            logger.info('No results for {idents}'.format(idents=[e[5].get(self.identifier_key) for e in entries]))
+            return None
+        # first document indexed, entries are in the order they were added
+        main_id = primaries[0][2]
+        sources = [e[3] for e in primaries]
+        if len(set(sources)) < len(sources):
+            logger.info('Documents of the same source merged through another source: {ids}'.format(
+                ids=[e[2] for e in primaries]))
+
+        merged = None
+        for enrich_only, precedence, _, _, _, doc in sorted(entries, key=lambda e: e[:5]):
+            if not enrich_only:
+                add_type_name(doc)
+            if merged is None:
+                merged = doc
+                merged[PRECEDENCE_KEY] = precedence
+                # multi-valued as if they had been read back from the index
+                for key in MERGABLE_KEYS:
+                    if key in merged and not isinstance(merged[key], list):
+                        merged[key] = [merged[key]]
+            else:
+                merged = merge_docs(merged, doc, precedence)
+        merged['id'] = main_id
+        return add_regions(add_type_path(merged), self.regions)
@@ -1,9 +1,9 @@
 import logging
 
-from xml.sax import ContentHandler, make_parser
 from collections import defaultdict
+from lxml import etree
 
-from moxie.places.importers.helpers import prepare_document
+from moxie.places.importers.pipeline import ImportPipeline, Reader
 
 logger = logging.getLogger(__name__)
 
@@ -25,227 +25,241 @@ CRS_KEY = 'StopClassification_OffStreet_Rail_AnnotatedRailRef_CrsRef'
 ## referring to rail and metro stations
 
 
-def tag_handler(tag):
-    def wrapper(f):
-        tags = getattr(f, 'tags', [])
-        tags.append(tag)
-        tags = setattr(f, 'tags', tags)
-        return f
-    return wrapper
+def get_indicator_name(indicator):
+    """
+    Get a "friendly" name for the indicator
+    @param indicator: indicator's name in Naptan format
+    @return: "friendly" name
+    """
+    parts = []
+    for part in indicator.split():
+        # TODO plan i18n for this
+        parts.append({
+            'op': 'Opposite',
+            'opp': 'Opposite',
+            'opposite': 'Opposite',
+            'adj': 'Adjacent',
+            'outside': 'Outside',
+            'o/s': 'Outside',
+            'nr': 'Near',
+            'inside': 'Inside',
+            'stp': 'Stop',
+        }.get(part.lower(), part))
+    indicator = ' '.join(parts)
+    return indicator
+
+
+def naptan_dial(c):
+    """
+    Convert a alphabetical NaPTAN code in the database to the numerical code
+    used on bus stops
+    """
+    if c.isdigit():
+        return c
+    return unicode(min(9, (ord(c)-91)//3))
+
+
+def stop_area_document(sa, areas, identifier_key):
+    """Document of a StopArea if its code is within areas
+    :param sa: dict of values of the StopArea (keys are paths of elements)
+    :return dict or None
+    """
+    area_code = sa['StopAreaCode'][:3]
+    if area_code in areas:
+        data = dict([('raw_naptan_%s' % k, v) for k, v in sa.items()])
+        data['id'] = "stoparea:%s" % sa['StopAreaCode']
+        data[identifier_key] = [data['id']]
+        data['location'] = "%s,%s" % (sa.pop('Location_Translation_Latitude'),
+                                      sa.pop('Location_Translation_Longitude'))
+        data['name'] = sa['Name']
+        data['name_sort'] = data['name']
+        data['type'] = "/transport/stop-area"
+        return data
+
+
+def stop_point_document(sp, areas, identifier_key):
+    """Format the StopPoint for insertion into our indexer.
+    - Set location as lat,lon string
+    - Formats name
+
+    We insert any Stops which have AtcoCodes within areas for example,
+    everything within Oxfordshire. We also import any StopPoints which have
+    a CRS key. This is the identifier used for the rail network.
+
+    Meaning we import all rail stations (at time of writing ~2500).
+
+    :param sp: dict of values of the StopPoint (keys are paths of elements)
+    :return dict or None
+    """
+    area_code = sp['AtcoCode'][:3]
+    if area_code in areas or CRS_KEY in sp:
+        data = dict([('raw_naptan_%s' % k, v) for k, v in sp.items()])
+        data['id'] = "atco:%s" % sp['AtcoCode']
+        identifiers = []
+        identifiers.append(data['id'])
+        if 'NaptanCode' in sp:
+            naptan_id = ''.join(map(naptan_dial, sp['NaptanCode']))
+            identifiers.append("naptan:%s" % naptan_id)
+        if CRS_KEY in sp:
+            crs = 'crs:%s' % sp[CRS_KEY]
+            identifiers.append(crs)
+            data['id'] = crs  # CRS code should be primary ID for rail
+        data[identifier_key] = identifiers
+
+        # TODO: should add a test for this
+        if 'StopClassification_StopType' in sp and sp['StopClassification_StopType'] in NAPTAN_MAPPING:
+            data['type'] = NAPTAN_MAPPING[sp['StopClassification_StopType']]
+        else:
+            return None
+
+        data['location'] = "%s,%s" % (sp.pop('Place_Location_Translation_Latitude'),
+                                      sp.pop('Place_Location_Translation_Longitude'))
+
+        if 'Descriptor_Indicator' in sp:
+            indicator = get_indicator_name(str(sp['Descriptor_Indicator']))
+            data['name'] = "%s %s" % (indicator, sp['Descriptor_CommonName'])
+        else:
+            data['name'] = sp['Descriptor_CommonName']
+        data['name_sort'] = data['name']
+        return data
+
+
+def annotate_stop_area_ancestry(stop_areas):
+    for stop_area_code, area in stop_areas.items():
+        if 'raw_naptan_ParentStopAreaRef' in area:
+            try:
+                parent = stop_areas[area['raw_naptan_ParentStopAreaRef']]
+            except KeyError:
+                continue
+            if 'child_of' in area:
+                area['child_of'].append(parent['id'])
+            else:
+                area['child_of'] = [parent['id']]
+            if 'parent_of' in parent:
+                parent['parent_of'].append(area['id'])
+            else:
+                parent['parent_of'] = [area['id']]
+    return stop_areas
+
+
+def local_name(tag):
+    """Tag without namespace"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def is_active(element):
+    return element.get('Status', 'active') == 'active'
+
 
+def flatten(element, prefix='', values=None):
+    """Values of an element as a dict, keys are paths of sub-elements
+    joined with '_' (e.g. Place_Location_Translation_Latitude), inactive
+    sub-elements are skipped
+    """
+    if values is None:
+        values = dict()
+    for child in element:
+        if not isinstance(child.tag, basestring) or not is_active(child):
+            # comments, processing instructions
+            continue
+        key = prefix + local_name(child.tag)
+        if len(child):
+            flatten(child, key + '_', values)
+        elif child.text and child.text.strip():
+            values[key] = values.get(key, '') + child.text.strip()
+    return values
 
-class NaptanXMLHandler(ContentHandler):
 
-    def __init__(self, areas, identifier_key):
+class NaptanIterParser(object):
+    """Stream documents from a NaPTAN file using ``lxml.etree.iterparse``.
+
+    StopPoints are checked (AtcoCode within areas or CRS code) before their
+    values are read, matched StopPoints are emitted as soon as they are
+    read and elements are cleared as the file is read. StopAreas (within
+    areas) are kept to be annotated with their ancestry and are emitted at
+    the end of the file.
+
+    StopPoints are linked to their StopArea if its code is within areas,
+    as StopAreas come after StopPoints in NaPTAN files.
+    """
+
+    def __init__(self, areas, identifier_key='identifiers'):
         self.areas = areas
         self.identifier_key = identifier_key
-        self.tag_stack = []
-        self.element_data = None
-        self.capture_data = False
-        self.flexible_zone = False
-        self.stop_points = dict()
         self.stop_areas = dict()
-        self.tag_handlers = dict()
-        self.namespaced = None
-        for attr in dir(self):
-            attr = getattr(self, attr)
-            tags = getattr(attr, 'tags', [])
-            for tag in tags:
-                self.tag_handlers[tag] = attr
-
-    def startElement(self, tag, attrib):
-        self.skip_element = False
-        if attrib.get('Status', 'active') != 'active':
-            self.skip_element = True
-            return
-        self.tag_stack.append(tag)
-        if tag in ['StopArea', 'StopPoint']:
-            self.element_data = defaultdict(str)
-            self.tag_stack = []
-            self.capture_data = True
-
-    def endElement(self, tag):
-        if self.capture_data and not self.skip_element:
-            if tag in self.tag_handlers:
-                th = self.tag_handlers[tag]
-                th(self.element_data)
-                self.element_data = None
-                self.capture_data = False
-                self.flexible_zone = False
-            else:
-                self.tag_stack.pop()
-
-    def characters(self, data):
-        if self.capture_data and not self.skip_element:
-            tag = '_'.join(self.tag_stack)
-            self.element_data[tag] += data
-            self.element_data[tag] = self.element_data[tag].strip()
-
-    @tag_handler('StopArea')
-    def add_stop_area(self, sa):
-        sa.default_factory = None
-        area_code = sa['StopAreaCode'][:3]
-        if area_code in self.areas:
-            data = dict([('raw_naptan_%s' % k, v) for k, v in sa.items()])
-            data['id'] = "stoparea:%s" % sa['StopAreaCode']
-            data[self.identifier_key] = [data['id']]
-            data['location'] = "%s,%s" % (sa.pop('Location_Translation_Latitude'),
-                                          sa.pop('Location_Translation_Longitude'))
-            data['name'] = sa['Name']
-            data['name_sort'] = data['name']
-            data['type'] = "/transport/stop-area"
-            self.stop_areas[sa['StopAreaCode']] = data
-
-    @tag_handler('StopPoint')
-    def add_stop(self, sp):
-        """Format the StopPoint for insertion into our indexer.
-        - Set location as lat,lon string
-        - Formats name
-
-        We insert any Stops which have AtcoCodes within self.areas for example,
-        everything within Oxfordshire. We also import any StopPoints which have
-        a CRS key. This is the identifier used for the rail network.
-
-        Meaning we import all rail stations (at time of writing ~2500).
-        """
-        sp.default_factory = None
-        area_code = sp['AtcoCode'][:3]
-        if area_code in self.areas or CRS_KEY in sp:
-            data = dict([('raw_naptan_%s' % k, v) for k, v in sp.items()])
-            data['id'] = "atco:%s" % sp['AtcoCode']
-            identifiers = []
-            identifiers.append(data['id'])
-            if 'NaptanCode' in sp:
-                naptan_id = ''.join(map(self.naptan_dial, sp['NaptanCode']))
-                identifiers.append("naptan:%s" % naptan_id)
-            if CRS_KEY in sp:
-                crs = 'crs:%s' % sp[CRS_KEY]
-                identifiers.append(crs)
-                data['id'] = crs  # CRS code should be primary ID for rail
-            data[self.identifier_key] = identifiers
-
-            # TODO: should add a test for this
-            if 'StopClassification_StopType' in sp and sp['StopClassification_StopType'] in NAPTAN_MAPPING:
-                data['type'] = NAPTAN_MAPPING[sp['StopClassification_StopType']]
-            else:
-                return
-
-            data['location'] = "%s,%s" % (sp.pop('Place_Location_Translation_Latitude'),
-                                          sp.pop('Place_Location_Translation_Longitude'))
 
-            if 'Descriptor_Indicator' in sp:
-                indicator = self.get_indicator_name(str(sp['Descriptor_Indicator']))
-                data['name'] = "%s %s" % (indicator, sp['Descriptor_CommonName'])
-            else:
-                data['name'] = sp['Descriptor_CommonName']
-            data['name_sort'] = data['name']
-            self.stop_points[sp['AtcoCode']] = data
-
-    def annotate_stop_area_ancestry(self, stop_areas):
-        for stop_area_code, area in stop_areas.items():
-            if 'raw_naptan_ParentStopAreaRef' in area:
-                try:
-                    parent = stop_areas[area['raw_naptan_ParentStopAreaRef']]
-                except KeyError:
-                    continue
-                if 'child_of' in area:
-                    area['child_of'].append(parent['id'])
-                else:
-                    area['child_of'] = [parent['id']]
-                if 'parent_of' in parent:
-                    parent['parent_of'].append(area['id'])
-                else:
-                    parent['parent_of'] = [area['id']]
-        return stop_areas
-
-    def annotate_stop_point_ancestry(self, stop_points, stop_areas):
-        for atco_code, sp in stop_points.items():
-            if 'raw_naptan_StopAreas_StopAreaRef' in sp:
-                try:
-                    parent_area = stop_areas[sp['raw_naptan_StopAreas_StopAreaRef']]
-                except KeyError:
-                    continue
-                if 'child_of' in sp:
-                    sp['child_of'].append(parent_area['id'])
-                else:
-                    sp['child_of'] = [parent_area['id']]
-                if 'parent_of' in parent_area:
-                    parent_area['parent_of'].append(sp['id'])
+    def parse(self, f):
+        """Generator of documents
+        :param f: file object of the NaPTAN XML file
+        """
+        self.stop_areas = dict()
+        children = defaultdict(list)
+        namespace = None
+        for _, element in etree.iterparse(Reader(f), events=('end',)):
+            if not isinstance(element.tag, basestring):
+                continue
+            name = local_name(element.tag)
+            if name not in ('StopPoint', 'StopArea'):
+                continue
+            if namespace is None:
+                namespace = element.tag[:-len(name)]
+            if is_active(element):
+                if name == 'StopPoint':
+                    doc = self.stop_point(element, namespace)
+                    if doc:
+                        if 'raw_naptan_StopAreas_StopAreaRef' in doc:
+                            area_code = doc['raw_naptan_StopAreas_StopAreaRef']
+                            if area_code[:3] in self.areas:
+                                doc['child_of'] = ["stoparea:%s" % area_code]
+                                children[area_code].append(doc['id'])
+                        yield doc
                 else:
-                    parent_area['parent_of'] = [sp['id']]
-        return stop_points, stop_areas
+                    sa = flatten(element)
+                    doc = stop_area_document(sa, self.areas, self.identifier_key)
+                    if doc:
+                        self.stop_areas[sa['StopAreaCode']] = doc
+            # free memory used by the element and previous ones
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+        annotate_stop_area_ancestry(self.stop_areas)
+        for area_code, stop_ids in children.iteritems():
+            area = self.stop_areas.get(area_code)
+            if area:
+                area.setdefault('parent_of', []).extend(stop_ids)
+        for area in self.stop_areas.itervalues():
+            yield area
+
+    def stop_point(self, element, namespace):
+        """Document of a StopPoint, the AtcoCode and CRS code are checked
+        before reading other values
+        """
+        atco_code = element.findtext(namespace + 'AtcoCode') or ''
+        if atco_code[:3] not in self.areas:
+            path = '/'.join(namespace + part for part in CRS_KEY.split('_'))
+            crs = element.find(path)
+            if crs is None or not is_active(crs):
+                return None
+        return stop_point_document(flatten(element), self.areas, self.identifier_key)
 
-    def endDocument(self):
-        areas = self.annotate_stop_area_ancestry(self.stop_areas)
-        self.stop_points, self.stop_areas = self.annotate_stop_point_ancestry(self.stop_points, areas)
 
-    @staticmethod
-    def get_indicator_name(indicator):
-        """
-        Get a "friendly" name for the indicator
-        @param indicator: indicator's name in Naptan format
-        @return: "friendly" name
-        """
-        parts = []
-        for part in indicator.split():
-            # TODO plan i18n for this
-            parts.append({
-                'op': 'Opposite',
-                'opp': 'Opposite',
-                'opposite': 'Opposite',
-                'adj': 'Adjacent',
-                'outside': 'Outside',
-                'o/s': 'Outside',
-                'nr': 'Near',
-                'inside': 'Inside',
-                'stp': 'Stop',
-            }.get(part.lower(), part))
-        indicator = ' '.join(parts)
-        return indicator
-
-    @staticmethod
-    def naptan_dial(c):
-        """
-        Convert a alphabetical NaPTAN code in the database to the numerical code
-        used on bus stops
-        """
-        if c.isdigit():
-            return c
-        return unicode(min(9, (ord(c)-91)//3))
+class NaPTANImporter(ImportPipeline):
+    """Import stop points and stop areas from NaPTAN, stop points are
+    emitted as the file is read, stop areas at the end of the file.
+    """
 
+    name = 'naptan'
 
-class NaPTANImporter(object):
     def __init__(self, indexer, precedence, naptan_file, areas,
-            identifier_key='identifiers', buffer_size=8192,
-            handler=NaptanXMLHandler):
-        self.indexer = indexer
-        self.precedence = precedence
+            identifier_key='identifiers', parser=NaptanIterParser, merger=None):
+        super(NaPTANImporter, self).__init__(indexer, precedence, identifier_key, merger)
         self.naptan_file = naptan_file
         self.areas = areas
-        self.identifier_key = identifier_key
-        self.buffer_size = buffer_size
-        self.handler = handler(self.areas, self.identifier_key)
-
-    def run(self):
-        parser = make_parser(['xml.sax.IncrementalParser'])
-        parser.setContentHandler(self.handler)
-        buffered_data = self.naptan_file.read(self.buffer_size)
-        while buffered_data:
-            parser.feed(buffered_data)
-            buffered_data = self.naptan_file.read(self.buffer_size)
-        parser.close()
-        if self.indexer:
-            docs = []
-            for stop_area_code, data in self.handler.stop_areas.items():
-                search_results = self.indexer.search_for_ids(
-                    self.identifier_key, data[self.identifier_key])
-                docs.append(prepare_document(data, search_results, self.precedence))
-            for atco_code, sp in self.handler.stop_points.items():
-                search_results = self.indexer.search_for_ids(
-                    self.identifier_key, sp[self.identifier_key])
-                docs.append(prepare_document(sp, search_results, self.precedence))
-            self.indexer.index(docs)
-            self.indexer.commit()
+        self.parser = parser(self.areas, self.identifier_key)
+
+    def parse(self):
+        return self.parser.parse(self.naptan_file)
 
 
 def main():
@@ -254,10 +268,9 @@ def main():
     args.add_argument('naptanfile', type=argparse.FileType('r'))
     ns = args.parse_args()
     naptan_importer = NaPTANImporter(None, 10, ns.naptanfile, ['340'], 'identifiers')
-    naptan_importer.run()
     import pprint
-    pprint.pprint(naptan_importer.handler.stop_points)
-    pprint.pprint(naptan_importer.handler.stop_areas)
+    for doc in naptan_importer.documents():
+        pprint.pprint(doc)
 
 
 if __name__ == '__main__':
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 import logging
 
-from xml.sax import handler
-from moxie.places.importers.helpers import prepare_document, format_uk_telephone
+from array import array
+from collections import deque
+from xml.sax import handler, make_parser
+from moxie.places.importers import bz2_streams
+from moxie.places.importers.helpers import format_uk_telephone
+from moxie.places.importers.osm_nodes import NodeLocationStore, sorted_ids, ID_TYPECODE
+from moxie.places.importers.pipeline import ImportPipeline, feed_parser, read_chunks, make_pool
 
 logger = logging.getLogger(__name__)
 
@@ -48,26 +53,156 @@ AMENITIES = {'atm': '/amenities/atm',
 
 PARK_AND_RIDE = '/transport/car-park/park-and-ride'
 
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+
+# k/v from OSM that we want to import in our "tags"
+INDEXED_TAGS = ['cuisine', 'brand', 'brewery', 'operator']
+# We only import element that have one of these key
+ELEMENT_TAGS = ['amenity', 'shop', 'naptan:AtcoCode']
+
+
+def element_to_document(element_type, id, tags, location, identifier_key='identifiers'):
+    """Transform an OSM element in a document
+    :param element_type: 'node' or 'way'
+    :param id: OSM identifier of the element
+    :param tags: dict of tags of the element
+    :param location: (lat, lon) of the node or centre of the way
+    :param identifier_key: key of the identifiers in the document
+    :return document or None if the element is not imported
+    """
+    if tags.get('life_cycle', 'in_use') != 'in_use':
+        return None
+
+    for key in tags.iterkeys():
+        if 'disused' in key:
+            # e.g. disused:amenity=restaurant
+            # http://wiki.openstreetmap.org/wiki/Key:disused
+            return None
+
+    if element_type not in ['way', 'node'] or not any([x in tags for x in ELEMENT_TAGS]):
+        return None
+
+    result = {}
+    osm_id = 'osm:%s' % id
+    atco_id = tags.get('naptan:AtcoCode', None)
+    result[identifier_key] = [osm_id]
+    # if it has an ATCO ID, we set the ATCO ID as the main ID for this document
+    # instead of the OSM ID
+    if atco_id:
+        result['id'] = atco_id
+        result[identifier_key].append('atco:%s' % atco_id)
+    else:
+        result['id'] = osm_id
+
+    result['tags'] = []
+    for it in INDEXED_TAGS:
+        doc_tags = [t.replace('_', ' ').strip() for t in tags.get(it, '').split(';')]
+        if doc_tags and doc_tags != ['']:
+            result['tags'].extend(doc_tags)
+
+    # Filter elements depending on amenity / shop tags
+    if 'amenity' in tags:
+        if tags['amenity'] in AMENITIES:
+            # special case for Park and Rides where amenity=parking and park_ride=bus/yes/... except no
+            # TODO we should be able to handle this kind of case in a better way
+            if tags['amenity'] == "parking" and tags.get('park_ride', 'no') != 'no':
+                result['type'] = PARK_AND_RIDE
+            else:
+                result['type'] = AMENITIES[tags['amenity']]
+        else:
+            return None
+    elif 'shop' in tags:
+        if tags['shop'] in SHOPS:
+            result['type'] = SHOPS[tags['shop']]
+        else:
+            return None
+    else:
+        return None
+
+    # if the element doesn't have a name, it will be an empty string
+    result['name'] = tags.get('name', tags.get('operator', ''))
+    result['name_sort'] = result['name']
+
+    address = "{0} {1} {2} {3}".format(tags.get("addr:housename", ""), tags.get("addr:housenumber", ""),
+            tags.get("addr:street", ""), tags.get("addr:postcode", ""))
+    result['address'] = " ".join(address.split())
+
+    if 'phone' in tags:
+        result['phone'] = format_uk_telephone(tags['phone'])
+
+    if 'url' in tags:
+        result['website'] = tags['url']
+
+    if 'website' in tags:
+        result['website'] = tags['website']
+
+    if 'opening_hours' in tags:
+        result['opening_hours'] = tags['opening_hours']
+
+    if 'collection_times' in tags:
+        result['collection_times'] = tags['collection_times']
+
+    result['location'] = "%s,%s" % location
+    return result
+
+
+def way_location(node_locations, nodes):
+    """Centre of the bounding box of the nodes of a way
+    :param node_locations: mapping of node identifiers to (lat, lon)
+    :param nodes: identifiers of nodes of the way
+    :return (lat, lon)
+    :raise KeyError: location of a node is unknown
+    """
+    min_, max_ = (float('inf'), float('inf')), (float('-inf'), float('-inf'))
+    for lat, lon in [node_locations[n] for n in nodes]:
+        min_ = min(min_[0], lat), min(min_[1], lon)
+        max_ = max(max_[0], lat), max(max_[1], lon)
+    return (min_[0] + max_[0]) / 2, (min_[1] + max_[1]) / 2
+
+
+class WayNodesHandler(handler.ContentHandler):
+    """Collect identifiers of nodes referenced by ways having one of
+    ``ELEMENT_TAGS``, the only nodes whose location is needed.
+    """
+
+    def __init__(self):
+        self.refs = array(ID_TYPECODE)
+        self.nodes = None
+
+    def startElement(self, name, attrs):
+        if name == 'way':
+            self.nodes = array(ID_TYPECODE)
+            self.candidate = False
+        elif self.nodes is None:
+            return
+        elif name == 'nd':
+            self.nodes.append(int(attrs['ref']))
+        elif name == 'tag' and attrs['k'] in ELEMENT_TAGS:
+            self.candidate = True
+
+    def endElement(self, name):
+        if name == 'way':
+            if self.candidate:
+                self.refs.extend(self.nodes)
+            self.nodes = None
+
 
 class OSMHandler(handler.ContentHandler):
+    """Read nodes and ways from an OSM XML file, elements having one of
+    ``ELEMENT_TAGS`` are appended to ``elements`` as
+    (element_type, id, tags, location) to be transformed by the consumer.
+
+    :param elements: (optional) deque receiving elements
+    :param node_locations: (optional) :py:class:`NodeLocationStore`
+    """
 
-    def __init__(self, indexer, precedence, identifier_key='identifiers'):
-        self.indexer = indexer
-        self.precedence = precedence
-        self.identifier_key = identifier_key
-        # k/v from OSM that we want to import in our "tags"
-        self.indexed_tags = ['cuisine', 'brand', 'brewery', 'operator']
-        # We only import element that have one of these key
-        self.element_tags = ['amenity', 'shop', 'naptan:AtcoCode']
-        self.pois = []
+    def __init__(self, elements=None, node_locations=None):
+        self.elements = elements if elements is not None else deque()
+        self.node_locations = node_locations if node_locations is not None else NodeLocationStore()
 
     def startDocument(self):
         self.tags = {}
-        self.valid_node = True
-        self.create_count, self.modify_count = 0, 0
-        self.delete_count, self.unchanged_count = 0, 0
-        self.ignore_count = 0
-        self.node_locations = {}
 
     def startElement(self, name, attrs):
         if name == 'node':
@@ -78,7 +213,7 @@ class OSMHandler(handler.ContentHandler):
             self.attrs = attrs
             self.id = id
             self.tags = {}
-            self.node_locations[id] = lat, lon
+            self.node_locations.add(int(id), lat, lon)
         elif name == 'tag':
             self.tags[attrs['k']] = attrs['v']
         elif name == 'way':
@@ -87,119 +222,113 @@ class OSMHandler(handler.ContentHandler):
             self.attrs = attrs
             self.id = attrs['id']
         elif name == 'nd':
-            self.nodes.append(attrs['ref'])
+            self.nodes.append(int(attrs['ref']))
+        elif name == 'relation':
+            # tags of relations must not be added to the last element queued
+            self.tags = {}
 
     def endElement(self, element_type):
+        if element_type not in ['way', 'node'] or not any([x in self.tags for x in ELEMENT_TAGS]):
+            return
         if element_type == 'node':
             location = self.node_location
-        elif element_type == 'way':
-            min_, max_ = (float('inf'), float('inf')), (float('-inf'), float('-inf'))
-            for lat, lon in [self.node_locations[n] for n in self.nodes]:
-                min_ = min(min_[0], lat), min(min_[1], lon)
-                max_ = max(max_[0], lat), max(max_[1], lon)
-            location = (min_[0] + max_[0]) / 2, (min_[1] + max_[1]) / 2
-        try:
-            if self.tags.get('life_cycle', 'in_use') != 'in_use':
+        else:
+            try:
+                location = way_location(self.node_locations, self.nodes)
+            except KeyError:
+                logger.warning("Couldn't find nodes of way {id}".format(id=self.id))
                 return
+        self.elements.append((element_type, self.id, self.tags, location))
+
+
+class OSMImporter(ImportPipeline):
+    """Import amenities and shops from an OSM XML file, elements are
+    transformed and merged as the file is read.
+
+    :param osm_file: file object of the OSM XML file
+    :param compression: 'bz2' if the file is compressed with bzip2
+    :param buffer_size: size of chunks read from the file and fed to the parser
+    :param processes: number of processes decompressing multi-stream bz2
+                      files (None for the number of CPUs, 1 to decompress
+                      in the current process)
+    :param prefilter_nodes: read the file twice to only keep locations of
+                            nodes referenced by ways (file must be seekable)
+    :param node_store_dir: (optional) directory to keep node locations on
+                           disk instead of in memory
+    """
+
+    name = 'osm'
+
+    def __init__(self, indexer, precedence, osm_file, identifier_key='identifiers',
+                 compression=None, buffer_size=DEFAULT_BUFFER_SIZE, processes=None,
+                 prefilter_nodes=False, node_store_dir=None, merger=None):
+        super(OSMImporter, self).__init__(indexer, precedence, identifier_key, merger)
+        self.osm_file = osm_file
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.processes = processes
+        self.prefilter_nodes = prefilter_nodes
+        self.node_store_dir = node_store_dir
+
+    def read(self):
+        if self.compression != 'bz2':
+            for chunk in read_chunks(self.osm_file, self.buffer_size):
+                yield chunk
+            return
+        pool = make_pool(self.processes)
+        try:
+            for chunk in bz2_streams.decompress(self.osm_file, pool=pool, buffer_size=self.buffer_size):
+                yield chunk
+        finally:
+            if pool:
+                pool.terminate()
+
+    def wanted_nodes(self):
+        """Read the file a first time to find nodes referenced by ways
+        :return sorted array of node identifiers
+        """
+        handler = WayNodesHandler()
+        parser = make_parser(['xml.sax.xmlreader.IncrementalParser'])
+        parser.setContentHandler(handler)
+        for chunk in self.read():
+            parser.feed(chunk)
+        parser.close()
+        self.osm_file.seek(0)
+        wanted = sorted_ids(handler.refs)
+        logger.info("{count} nodes referenced by ways".format(count=len(wanted)))
+        return wanted
+
+    def parse(self):
+        wanted = self.wanted_nodes() if self.prefilter_nodes else None
+        node_locations = NodeLocationStore(wanted=wanted, directory=self.node_store_dir)
+        handler = OSMHandler(node_locations=node_locations)
+        parser = make_parser(['xml.sax.xmlreader.IncrementalParser'])
+        parser.setContentHandler(handler)
+        try:
+            for element in feed_parser(parser, self.read(), handler.elements):
+                yield element
+        finally:
+            node_locations.close()
 
-            for key in self.tags.iterkeys():
-                if 'disused' in key:
-                    # e.g. disused:amenity=restaurant
-                    # http://wiki.openstreetmap.org/wiki/Key:disused
-                    return
-
-            if element_type in ['way', 'node'] and any([x in self.tags for x in self.element_tags]):
-                result = {}
-                osm_id = 'osm:%s' % self.id
-                atco_id = self.tags.get('naptan:AtcoCode', None)
-                result[self.identifier_key] = [osm_id]
-                # if it has an ATCO ID, we set the ATCO ID as the main ID for this document
-                # instead of the OSM ID
-                if atco_id:
-                    result['id'] = atco_id
-                    result[self.identifier_key].append('atco:%s' % atco_id)
-                else:
-                    result['id'] = osm_id
-
-                result['tags'] = []
-                for it in self.indexed_tags:
-                    doc_tags = [t.replace('_', ' ').strip() for t in self.tags.get(it, '').split(';')]
-                    if doc_tags and doc_tags != ['']:
-                        result['tags'].extend(doc_tags)
-
-                # Filter elements depending on amenity / shop tags
-                if 'amenity' in self.tags:
-                    if self.tags['amenity'] in AMENITIES:
-                        # special case for Park and Rides where amenity=parking and park_ride=bus/yes/... except no
-                        # TODO we should be able to handle this kind of case in a better way
-                        if self.tags['amenity'] == "parking" and self.tags.get('park_ride', 'no') != 'no':
-                            result['type'] = PARK_AND_RIDE
-                        else:
-                            result['type'] = AMENITIES[self.tags['amenity']]
-                    else:
-                        return
-                elif 'shop' in self.tags:
-                    if self.tags['shop'] in SHOPS:
-                        result['type'] = SHOPS[self.tags['shop']]
-                    else:
-                        return
-                else:
-                    return
-
-                # if the element doesn't have a name, it will be an empty string
-                result['name'] = self.tags.get('name', self.tags.get('operator', ''))
-                result['name_sort'] = result['name']
-
-                address = "{0} {1} {2} {3}".format(self.tags.get("addr:housename", ""), self.tags.get("addr:housenumber", ""),
-                        self.tags.get("addr:street", ""), self.tags.get("addr:postcode", ""))
-                result['address'] = " ".join(address.split())
-
-                if 'phone' in self.tags:
-                    result['phone'] = format_uk_telephone(self.tags['phone'])
-
-                if 'url' in self.tags:
-                    result['website'] = self.tags['url']
-
-                if 'website' in self.tags:
-                    result['website'] = self.tags['website']
-
-                if 'opening_hours' in self.tags:
-                    result['opening_hours'] = self.tags['opening_hours']
-
-                if 'collection_times' in self.tags:
-                    result['collection_times'] = self.tags['collection_times']
-
-                result['location'] = "%s,%s" % location
-                search_results = self.indexer.search_for_ids(
-                        self.identifier_key, result[self.identifier_key])
-                self.pois.append(prepare_document(result, search_results, self.precedence))
-        except Exception as e:
-            logger.warning("Couldn't index a POI.", exc_info=True)
-
-    def endDocument(self):
-        self.indexer.index(self.pois)
-        self.indexer.commit()
+    def transform_record(self, record):
+        element_type, id, tags, location = record
+        return element_to_document(element_type, id, tags, location, self.identifier_key)
 
 
 def main():
     import argparse
-    from xml.sax import make_parser
     parser = argparse.ArgumentParser()
     parser.add_argument('osmfile', type=argparse.FileType('r'))
     ns = parser.parse_args()
     from moxie.core.search.solr import SolrSearch
     solr = SolrSearch('collection1')
-    handler = OSMHandler(solr, 5)
-
-    parser = make_parser(['xml.sax.xmlreader.IncrementalParser'])
-    parser.setContentHandler(handler)
-    # Parse in 8k chunks
-    osm = ns.osmfile
-    buffer = osm.read(8192)
-    while buffer:
-        parser.feed(buffer)
-        buffer = osm.read(8192)
-    parser.close()
+    if ns.osmfile.name.endswith('.pbf'):
+        from moxie.places.importers.osm_pbf import OSMPBFImporter
+        importer = OSMPBFImporter(solr, 5, ns.osmfile)
+    else:
+        compression = 'bz2' if ns.osmfile.name.endswith('.bz2') else None
+        importer = OSMImporter(solr, 5, ns.osmfile, compression=compression)
+    importer.run()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,236 @@
+import bisect
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# array('q') is not available in Python 2, C long is 64 bits on LP64
+# platforms, doubles represent integers exactly up to 2**53 otherwise
+ID_TYPECODE = 'l' if array('l').itemsize >= 8 else 'd'
+TYPECODES = ID_TYPECODE + 'dd'
+
+
+class MappedArray(object):
+    """Read-only sequence of fixed-size numbers in a memory-mapped file,
+    supports ``len`` and indexing so it can be searched with :py:mod:`bisect`
+    """
+
+    def __init__(self, f, typecode):
+        self.format = typecode
+        self.itemsize = struct.calcsize(self.format)
+        f.flush()
+        size = os.fstat(f.fileno()).st_size
+        self.length = size // self.itemsize
+        self.mmap = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else None
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        return struct.unpack_from(self.format, self.mmap, index * self.itemsize)[0]
+
+    def close(self):
+        if self.mmap:
+            self.mmap.close()
+
+
+def sorted_ids(ids):
+    """Sorted array of unique identifiers
+    :param ids: iterable of integers
+    :return array of ID_TYPECODE
+    """
+    return array(ID_TYPECODE, sorted(set(ids)))
+
+
+class NodeLocationStore(object):
+    """Locations of OSM nodes, used to compute the centre of ways.
+
+    Identifiers, latitudes and longitudes are kept in three ``array``
+    (24 bytes per node, against about 200 bytes for a dict of tuples),
+    sorted by identifier and searched with :py:mod:`bisect`. Nodes are
+    appended while the file is read (OSM files are sorted by identifier)
+    and the arrays are sorted on the first lookup if needed.
+
+    With a ``directory``, arrays are written to temporary files in that
+    directory and memory-mapped, so memory used by the store is managed by
+    the OS page cache (for large extracts).
+
+    :param wanted: (optional) sorted array of identifiers of nodes to keep
+                   (e.g. nodes referenced by ways), other nodes are ignored
+    :param directory: (optional) directory of the on-disk store
+    """
+
+    #: nodes kept in memory before being written to disk
+    flush_size = 65536
+
+    def __init__(self, wanted=None, directory=None):
+        self.wanted = wanted
+        self.directory = directory
+        self.ids, self.lats, self.lons = array(ID_TYPECODE), array('d'), array('d')
+        self.count = 0
+        self.last_id = None
+        self.sorted = True
+        self.frozen = False
+        # nodes added after the first lookup (unusual in OSM files)
+        self.overflow = dict()
+        self.files = None
+        if directory:
+            self.files = [tempfile.TemporaryFile(dir=directory) for _ in range(3)]
+
+    def is_wanted(self, id):
+        if self.wanted is None:
+            return True
+        i = bisect.bisect_left(self.wanted, id)
+        return i < len(self.wanted) and self.wanted[i] == id
+
+    def add(self, id, lat, lon):
+        """Store the location of a node if wanted
+        :param id: identifier of the node (int)
+        """
+        if not self.is_wanted(id):
+            return
+        if self.frozen:
+            self.overflow[id] = lat, lon
+            return
+        if self.last_id is not None and id < self.last_id:
+            self.sorted = False
+        self.last_id = id
+        self.ids.append(id)
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.count += 1
+        if self.files and len(self.ids) >= self.flush_size:
+            self._flush()
+
+    def _flush(self):
+        for f, values in zip(self.files, (self.ids, self.lats, self.lons)):
+            values.tofile(f)
+        self.ids, self.lats, self.lons = array(ID_TYPECODE), array('d'), array('d')
+
+    def _load(self):
+        arrays = []
+        for f, typecode in zip(self.files, TYPECODES):
+            values = array(typecode)
+            f.seek(0)
+            values.fromfile(f, self.count)
+            f.seek(0)
+            f.truncate()
+            arrays.append(values)
+        self.ids, self.lats, self.lons = arrays
+
+    def freeze(self):
+        """Sort arrays (and map them from disk), called on the first lookup
+        """
+        if self.frozen:
+            return
+        if self.files:
+            self._flush()
+        if not self.sorted:
+            logger.warning("Nodes are not sorted by identifier, sorting {count} nodes".format(count=self.count))
+            if self.files:
+                self._load()
+            order = sorted(xrange(len(self.ids)), key=self.ids.__getitem__)
+            self.ids = array(ID_TYPECODE, (self.ids[i] for i in order))
+            self.lats = array('d', (self.lats[i] for i in order))
+            self.lons = array('d', (self.lons[i] for i in order))
+            self.sorted = True
+            if self.files:
+                self._flush()
+        if self.files:
+            self.ids, self.lats, self.lons = [MappedArray(f, typecode)
+                                              for f, typecode in zip(self.files, TYPECODES)]
+        self.frozen = True
+        logger.debug("Stored {count} node locations ({size} bytes)".format(count=len(self),
+                                                                          size=self.nbytes))
+
+    def get(self, id):
+        """Location of a node
+        :param id: identifier of the node (int)
+        :return (lat, lon)
+        :raise KeyError: node not stored
+        """
+        self.freeze()
+        i = bisect.bisect_left(self.ids, id)
+        if i < len(self.ids) and self.ids[i] == id:
+            return self.lats[i], self.lons[i]
+        return self.overflow[id]
+
+    __getitem__ = get
+
+    def __contains__(self, id):
+        try:
+            self.get(id)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return self.count + len(self.overflow)
+
+    @property
+    def nbytes(self):
+        """Size of the arrays in bytes (on disk or in memory)
+        """
+        return self.count * sum(array(typecode).itemsize for typecode in TYPECODES)
+
+    def close(self):
+        for values in (self.ids, self.lats, self.lons):
+            if isinstance(values, MappedArray):
+                values.close()
+        for f in self.files or []:
+            f.close()
+        self.files = None
+
+
+def main():
+    """Compare memory used per million nodes by a dict and by the store
+    """
+    import argparse
+    import random
+    import time
+    from multiprocessing import Process, Queue
+    from moxie.places.importers.pipeline import peak_rss
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=1000000)
+    parser.add_argument('--directory', default=tempfile.gettempdir())
+    ns = parser.parse_args()
+
+    def fill(kind, queue):
+        before = peak_rss()
+        started = time.time()
+        if kind == 'dict':
+            store = dict()
+            for i in xrange(ns.nodes):
+                store[str(i * 3)] = random.uniform(-90, 90), random.uniform(-180, 180)
+            lookup = lambda i: store[str(i)]
+        else:
+            store = NodeLocationStore(directory=ns.directory if kind == 'mmap' else None)
+            for i in xrange(ns.nodes):
+                store.add(i * 3, random.uniform(-90, 90), random.uniform(-180, 180))
+            store.freeze()
+            lookup = store.get
+        filled = time.time()
+        for i in xrange(100000):
+            lookup(random.randrange(ns.nodes) * 3)
+        queue.put((kind, peak_rss() - before, filled - started, time.time() - filled))
+
+    queue = Queue()
+    for kind in ('dict', 'array', 'mmap'):
+        process = Process(target=fill, args=(kind, queue))
+        process.start()
+        process.join()
+        kind, rss, fill_time, lookup_time = queue.get()
+        print "{kind:>6}: {mb:8.1f} MB per million nodes, fill {fill:.2f}s, 100k lookups {lookup:.2f}s".format(
+            kind=kind, mb=rss / 1024.0 * 1000000 / ns.nodes, fill=fill_time, lookup=lookup_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+import logging
+import struct
+import zlib
+
+from array import array
+
+from moxie.places.importers.osm import OSMImporter, ELEMENT_TAGS, way_location
+from moxie.places.importers.osm_nodes import NodeLocationStore, sorted_ids, ID_TYPECODE
+from moxie.places.importers.pipeline import make_pool, ordered_map
+
+logger = logging.getLogger(__name__)
+
+# Minimal decoder of the OSM PBF format, see
+# http://wiki.openstreetmap.org/wiki/PBF_Format
+# only fields needed to extract locations of nodes, tags of nodes and ways
+# and references of ways are read.
+
+VARINT, FIXED64, LENGTH_DELIMITED, FIXED32 = 0, 1, 2, 5
+
+
+class PBFError(Exception):
+    pass
+
+
+def read_varint(data, pos):
+    """Read a varint
+    :param data: buffer
+    :param pos: position of the varint
+    :return (value, position after the varint)
+    """
+    result = shift = 0
+    while True:
+        b = ord(data[pos])
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def signed(value):
+    """int64 encoded as a varint (two's complement)"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def zigzag(value):
+    """sint64 encoded as a varint"""
+    return (value >> 1) ^ -(value & 1)
+
+
+def iter_fields(data):
+    """Generator of (field number, value) of a message, values of length
+    delimited fields are buffers to be decoded by the caller
+    """
+    pos, end = 0, len(data)
+    while pos < end:
+        key, pos = read_varint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == VARINT:
+            value, pos = read_varint(data, pos)
+        elif wire_type == LENGTH_DELIMITED:
+            length, pos = read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == FIXED64:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == FIXED32:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise PBFError("Unsupported wire type {wire_type}".format(wire_type=wire_type))
+        yield number, value
+
+
+def packed_varints(data):
+    values = []
+    pos, end = 0, len(data)
+    while pos < end:
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def packed_deltas(data):
+    """Packed sint64 delta-encoded (ids, lat, lon of dense nodes, refs of ways)
+    """
+    values = []
+    current = 0
+    for value in packed_varints(data):
+        current += zigzag(value)
+        values.append(current)
+    return values
+
+
+def read_blobs(f):
+    """Generator of the content of OSMData blobs of a PBF file, the header
+    blob (OSMHeader) is skipped
+    """
+    while True:
+        size = f.read(4)
+        if len(size) < 4:
+            return
+        header = f.read(struct.unpack('!I', size)[0])
+        blob_type, datasize = None, 0
+        for number, value in iter_fields(header):
+            if number == 1:
+                blob_type = value
+            elif number == 3:
+                datasize = value
+        blob = f.read(datasize)
+        if blob_type == 'OSMData':
+            yield blob
+
+
+def decompress_blob(blob):
+    for number, value in iter_fields(blob):
+        if number == 1:     # raw
+            return value
+        elif number == 3:   # zlib_data
+            return zlib.decompress(value)
+        elif number in (4, 5):
+            raise PBFError("Unsupported compression of blob (lzma/bzip2)")
+    return ''
+
+
+class DecodedBlock(object):
+    """Elements of a PrimitiveBlock needed by the importer:
+
+    - locations of all nodes (``node_ids``, ``lats``, ``lons`` arrays)
+    - nodes having one of ``ELEMENT_TAGS`` as (id, tags, (lat, lon))
+    - ways having one of ``ELEMENT_TAGS`` as (id, tags, refs)
+    """
+
+    def __init__(self):
+        self.node_ids, self.lats, self.lons = array(ID_TYPECODE), array('d'), array('d')
+        self.nodes = []
+        self.ways = []
+
+
+def decode_block(blob):
+    """Decode an OSMData blob, run in a pool of processes
+    :param blob: content of the blob (compressed)
+    :return DecodedBlock
+    """
+    data = decompress_blob(blob)
+    strings = []
+    groups = []
+    granularity, lat_offset, lon_offset = 100, 0, 0
+    for number, value in iter_fields(data):
+        if number == 1:
+            strings = [s.decode('utf-8') for n, s in iter_fields(value) if n == 1]
+        elif number == 2:
+            groups.append(value)
+        elif number == 17:
+            granularity = value
+        elif number == 19:
+            lat_offset = signed(value)
+        elif number == 20:
+            lon_offset = signed(value)
+    wanted_keys = set(i for i, s in enumerate(strings) if s in ELEMENT_TAGS)
+
+    def coordinate(value, offset):
+        return .000000001 * (offset + granularity * value)
+
+    def tags(keys, vals):
+        return dict((strings[k], strings[v]) for k, v in zip(keys, vals))
+
+    block = DecodedBlock()
+    for group in groups:
+        for number, value in iter_fields(group):
+            if number == 1:
+                _decode_node(block, value, wanted_keys, tags, coordinate, lat_offset, lon_offset)
+            elif number == 2:
+                _decode_dense(block, value, wanted_keys, strings, coordinate, lat_offset, lon_offset)
+            elif number == 3:
+                _decode_way(block, value, wanted_keys, tags)
+    return block
+
+
+def _decode_node(block, data, wanted_keys, tags, coordinate, lat_offset, lon_offset):
+    id, keys, vals, lat, lon = 0, [], [], 0, 0
+    for number, value in iter_fields(data):
+        if number == 1:
+            id = zigzag(value)
+        elif number == 2:
+            keys = packed_varints(value)
+        elif number == 3:
+            vals = packed_varints(value)
+        elif number == 8:
+            lat = coordinate(zigzag(value), lat_offset)
+        elif number == 9:
+            lon = coordinate(zigzag(value), lon_offset)
+    block.node_ids.append(id)
+    block.lats.append(lat)
+    block.lons.append(lon)
+    if wanted_keys.intersection(keys):
+        block.nodes.append((id, tags(keys, vals), (lat, lon)))
+
+
+def _decode_dense(block, data, wanted_keys, strings, coordinate, lat_offset, lon_offset):
+    ids, lats, lons, keys_vals = [], [], [], []
+    for number, value in iter_fields(data):
+        if number == 1:
+            ids = packed_deltas(value)
+        elif number == 8:
+            lats = [coordinate(lat, lat_offset) for lat in packed_deltas(value)]
+        elif number == 9:
+            lons = [coordinate(lon, lon_offset) for lon in packed_deltas(value)]
+        elif number == 10:
+            keys_vals = packed_varints(value)
+    block.node_ids.extend(ids)
+    block.lats.extend(lats)
+    block.lons.extend(lons)
+    if not keys_vals or not wanted_keys:
+        return
+    # keys_vals: k1 v1 k2 v2 0 (tags of node 1), k1 v1 0 (tags of node 2)...
+    pos = 0
+    for i in xrange(len(ids)):
+        start = pos
+        while keys_vals[pos] != 0:
+            pos += 2
+        indexes = keys_vals[start:pos]
+        pos += 1
+        if wanted_keys.intersection(indexes[::2]):
+            node_tags = dict((strings[indexes[j]], strings[indexes[j + 1]])
+                             for j in xrange(0, len(indexes), 2))
+            block.nodes.append((ids[i], node_tags, (lats[i], lons[i])))
+
+
+def _decode_way(block, data, wanted_keys, tags):
+    id, keys, vals, refs = 0, [], [], []
+    for number, value in iter_fields(data):
+        if number == 1:
+            id = signed(value)
+        elif number == 2:
+            keys = packed_varints(value)
+        elif number == 3:
+            vals = packed_varints(value)
+        elif number == 8:
+            refs = packed_deltas(value)
+    if wanted_keys.intersection(keys):
+        block.ways.append((id, tags(keys, vals), array(ID_TYPECODE, refs)))
+
+
+class OSMPBFImporter(OSMImporter):
+    """Import amenities and shops from an OSM PBF file, produces the same
+    documents as :py:class:`~moxie.places.importers.osm.OSMImporter`.
+    Blocks are decompressed and decoded in a pool of processes.
+
+    :param processes: number of processes decoding blocks (None for the
+                      number of CPUs, 1 to decode in the current process)
+    """
+
+    def __init__(self, indexer, precedence, osm_file, identifier_key='identifiers',
+                 processes=None, prefilter_nodes=False, node_store_dir=None, merger=None):
+        super(OSMPBFImporter, self).__init__(indexer, precedence, osm_file, identifier_key,
+                                             processes=processes, prefilter_nodes=prefilter_nodes,
+                                             node_store_dir=node_store_dir, merger=merger)
+
+    def blocks(self, pool):
+        return ordered_map(decode_block, read_blobs(self.osm_file), pool=pool,
+                           window=2 * (self.processes or 4))
+
+    def wanted_nodes(self, pool=None):
+        refs = array(ID_TYPECODE)
+        for block in self.blocks(pool):
+            for _, _, way_refs in block.ways:
+                refs.extend(way_refs)
+        self.osm_file.seek(0)
+        wanted = sorted_ids(refs)
+        logger.info("{count} nodes referenced by ways".format(count=len(wanted)))
+        return wanted
+
+    def parse(self):
+        pool = make_pool(self.processes)
+        try:
+            wanted = self.wanted_nodes(pool) if self.prefilter_nodes else None
+            node_locations = NodeLocationStore(wanted=wanted, directory=self.node_store_dir)
+            try:
+                for block in self.blocks(pool):
+                    for id, lat, lon in zip(block.node_ids, block.lats, block.lons):
+                        node_locations.add(id, lat, lon)
+                    for id, tags, location in block.nodes:
+                        yield 'node', id, tags, location
+                    for id, tags, refs in block.ways:
+                        try:
+                            location = way_location(node_locations, refs)
+                        except KeyError:
+                            logger.warning("Couldn't find nodes of way {id}".format(id=id))
+                            continue
+                        yield 'way', id, tags, location
+            finally:
+                node_locations.close()
+        finally:
+            if pool:
+                pool.terminate()
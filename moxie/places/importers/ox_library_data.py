@@ -3,7 +3,7 @@ import re
 import unicodedata
 from lxml import etree
 
-from moxie.places.importers.helpers import prepare_document
+from moxie.places.importers.pipeline import ImportPipeline, Reader
 
 logger = logging.getLogger(__name__)
 
@@ -77,71 +77,54 @@ def string_cleanup(s):
         return None
 
 
-class OxLibraryDataImporter(object):
+class OxLibraryDataImporter(ImportPipeline):
+    """Enrich documents having a library identifier with data from
+    librarydata, libraries are never indexed on their own. Libraries are
+    read one by one and discarded once transformed.
+    """
+
+    name = 'ox_library_data'
+    enrich_only = True
 
     def __init__(self, indexer, precedence, file, identifier_key='identifiers',
                  lib_data_identifier='librarydata',
-                 prefix_index_key='_library_'):
-        self.indexer = indexer
-        self.precedence = precedence
+                 prefix_index_key='_library_', merger=None):
+        super(OxLibraryDataImporter, self).__init__(indexer, precedence, identifier_key, merger)
         self.file = file
-        self.identifier_key = identifier_key
         self.lib_data_identifier = lib_data_identifier
         self.prefix_index_key = prefix_index_key
 
-    def run(self):
-        self.parse_libs()
-        if self.indexer:
-            self.index_all()
-
-    def parse_libs(self):
-        xml = etree.parse(self.file)
-        libraries = xml.xpath('.//library')
-        self.libs = [{'id': text(l, 'id'),
-                      'opening_hours_termtime': text(l, 'hours/termtime'),
-                      'opening_hours_vacation': text(l, 'hours/vacation'),
-                      'opening_hours_closed': text(l, 'hours/closed'),
-                      'subjects': subjects(l, 'subjects/subject'),
-                      'policies': policies(l, 'policies/policy')
-                     } for l in libraries]
-
-    def index_all(self):
-        docs = []
-        for lib in self.libs:
-            try:
-                doc = self.index_library(lib)
-                if doc:
-                    docs.append(doc)
-            except Exception as e:
-                logger.warning('Could not index library {ident}'.format(ident=lib['id']),
-                               exc_info=True)
-
-        self.indexer.index(docs)
-        self.indexer.commit()
-
-    def index_library(self, lib):
+    def parse(self):
+        for _, l in etree.iterparse(Reader(self.file), tag='library'):
+            yield {'id': text(l, 'id'),
+                   'opening_hours_termtime': text(l, 'hours/termtime'),
+                   'opening_hours_vacation': text(l, 'hours/vacation'),
+                   'opening_hours_closed': text(l, 'hours/closed'),
+                   'subjects': subjects(l, 'subjects/subject'),
+                   'policies': policies(l, 'policies/policy')
+                   }
+            # free the memory used by libraries already read
+            l.clear()
+            while l.getprevious() is not None:
+                del l.getparent()[0]
+
+    def transform_record(self, lib):
         ident = "{key}:{value}".format(key=self.lib_data_identifier,
                                        value=lib['id'])
-        search_results = self.indexer.search_for_ids(self.identifier_key,
-                                                     [ident])
-        if search_results.results:
-            doc = search_results.results[0]
-            doc[self.prefix_index_key+'opening_hours_termtime'] = lib['opening_hours_termtime']
-            doc[self.prefix_index_key+'opening_hours_vacation'] = lib['opening_hours_vacation']
-            doc[self.prefix_index_key+'opening_hours_closed'] = lib['opening_hours_closed']
-            doc[self.prefix_index_key+'subject'] = lib['subjects']
-            if 'academic' in lib['policies']:
-                doc[self.prefix_index_key+'policy_academic'] = lib['policies']['academic']
-            if 'other' in lib['policies']:
-                doc[self.prefix_index_key+'policy_other'] = lib['policies']['other']
-            if 'postgraduate' in lib['policies']:
-                doc[self.prefix_index_key+'policy_postgraduate'] = lib['policies']['postgraduate']
-            if 'undergraduate' in lib['policies']:
-                doc[self.prefix_index_key+'policy_undergraduate'] = lib['policies']['undergraduate']
-            return prepare_document(doc, search_results, self.precedence)
-        else:
-            logger.info('No results for {ident}'.format(ident=ident))
-            return None
+        doc = {self.identifier_key: [ident]}
+        doc[self.prefix_index_key+'opening_hours_termtime'] = lib['opening_hours_termtime']
+        doc[self.prefix_index_key+'opening_hours_vacation'] = lib['opening_hours_vacation']
+        doc[self.prefix_index_key+'opening_hours_closed'] = lib['opening_hours_closed']
+        doc[self.prefix_index_key+'subject'] = lib['subjects']
+        if 'academic' in lib['policies']:
+            doc[self.prefix_index_key+'policy_academic'] = lib['policies']['academic']
+        if 'other' in lib['policies']:
+            doc[self.prefix_index_key+'policy_other'] = lib['policies']['other']
+        if 'postgraduate' in lib['policies']:
+            doc[self.prefix_index_key+'policy_postgraduate'] = lib['policies']['postgraduate']
+        if 'undergraduate' in lib['policies']:
+            doc[self.prefix_index_key+'policy_undergraduate'] = lib['policies']['undergraduate']
+        return doc
 
 
 def main():
@@ -150,9 +133,9 @@ def main():
     args.add_argument('file', type=argparse.FileType('r'))
     ns = args.parse_args()
     importer = OxLibraryDataImporter(None, 10, ns.file)
-    importer.run()
     import pprint
-    pprint.pprint(importer.libs)
+    for doc in importer.documents():
+        pprint.pprint(doc)
 
 
 if __name__ == '__main__':
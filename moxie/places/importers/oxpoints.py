@@ -1,17 +1,17 @@
 import logging
+import multiprocessing
 
 import rdflib
 import json
 from rdflib import RDF
 from rdflib.namespace import DC, SKOS, FOAF, DCTERMS, RDFS
 
-from moxie.core.tasks import download_file
 from moxie.places.domain import File
 from moxie.places.importers.rdf_namespaces import (
     OxPoints, VCard, Org, OpenVocab, LinkingYou, Accessibility,
     AdHocDataOx, EntranceOpeningType, ParkingType, Rooms, Levelness, ContactMethod)
-from moxie.places.importers.helpers import prepare_document
-from moxie.places.importers.oxpoints_helpers import find_location, find_shape
+from moxie.places.importers.pipeline import ImportPipeline, make_pool, ordered_map
+from moxie.places.importers.oxpoints_helpers import AncestorResolver
 
 logger = logging.getLogger(__name__)
 
@@ -93,33 +93,111 @@ OXPOINTS_IDENTIFIERS = {
 }
 
 
-class OxpointsImporter(object):
+# importer using a pool of processes, inherited by the processes (fork)
+# with its (read-only) graph
+_importer = None
+
+
+def _process_record(record):
+    """Transform a record in a process of the pool
+    :return (document or None, list of (url, location) of files to download)
+    """
+    # subjects to skip have been removed by OxpointsImporter.plan
+    del _importer.merged_things[:]
+    _importer.downloads = []
+    doc = next(ImportPipeline.transform(_importer, [record]), None)
+    return doc, _importer.downloads
+
+
+class OxpointsImporter(ImportPipeline):
+
+    name = 'oxpoints'
 
     def __init__(self, indexer, precedence, oxpoints_file, shapes_file, accessibility_file, courses_file,
-                 static_files_dir, identifier_key='identifiers', rdf_media_type='text/turtle'):
+                 static_files_dir, identifier_key='identifiers', rdf_media_type='text/turtle',
+                 merger=None, graph=None, processes=1):
         """Import OxPoints and extensions graph
+        :param graph: (optional) graph already parsed (see
+                      :py:mod:`moxie.places.importers.graph_cache`), files
+                      are not read if given
+        :param processes: number of processes transforming subjects (None
+                          for the number of CPUs, 1 to transform them in
+                          the current process)
         """
-        self.indexer = indexer
-        self.precedence = precedence
-        self.identifier_key = identifier_key
-        graph = rdflib.Graph()
-        graph.parse(oxpoints_file, format=rdf_media_type)
-        graph.parse(shapes_file, format=rdf_media_type)
-        graph.parse(accessibility_file, format=rdf_media_type)
-        if courses_file:
-            graph.parse(courses_file, format=rdf_media_type)
+        super(OxpointsImporter, self).__init__(indexer, precedence, identifier_key, merger)
+        if graph is None:
+            graph = rdflib.Graph()
+            graph.parse(oxpoints_file, format=rdf_media_type)
+            graph.parse(shapes_file, format=rdf_media_type)
+            graph.parse(accessibility_file, format=rdf_media_type)
+            if courses_file:
+                graph.parse(courses_file, format=rdf_media_type)
         self.graph = graph
+        self.resolver = AncestorResolver(graph)
         self.merged_things = []     # list of building/sites merged into departments
         if not static_files_dir:
             logger.warning('STATIC_FILES_IMPORT_DIRECTORY not set, images will not be imported')
         self.static_files_dir = static_files_dir
+        self.processes = processes
+        # (url, location) of files referenced by documents, to be synced
+        # by the caller (see moxie.core.file_sync)
+        self.downloads = []
 
     def import_data(self):
-        documents = []
+        self.run()
+
+    def parse(self):
+        """Subjects of the graph in the order of MAPPED_TYPES, as subjects
+        merged into departments are not imported on their own
+        """
         for oxpoints_type, mapped_type in MAPPED_TYPES:
-            documents.extend(self.process_type(oxpoints_type, mapped_type))
-        self.indexer.index(documents)
-        self.indexer.commit()
+            for subject in self.graph.subjects(RDF.type, oxpoints_type):
+                yield subject, mapped_type
+
+    def transform_record(self, record):
+        subject, mapped_type = record
+        return self.process_subject(subject, mapped_type)
+
+    def transform(self, records):
+        """Transform records in a pool of processes if ``processes`` is not
+        1, documents are in the same order as records
+        """
+        global _importer
+        pool = None
+        if self.processes != 1:
+            _importer = self
+            pool = make_pool(self.processes)
+        if pool is None:
+            _importer = None
+            for doc in super(OxpointsImporter, self).transform(records):
+                yield doc
+            return
+        try:
+            window = 16 * (self.processes or multiprocessing.cpu_count())
+            for doc, downloads in ordered_map(_process_record, self.plan(records),
+                                              pool=pool, window=window):
+                self.downloads.extend(downloads)
+                if doc:
+                    yield doc
+        finally:
+            pool.terminate()
+            _importer = None
+
+    def plan(self, records):
+        """Records to process, in order. Sites merged into a Thing (see
+        :py:meth:`process_subject`) are skipped if the Thing comes first,
+        as when processing subjects one by one, ``merged_things`` is
+        updated accordingly.
+        """
+        for record in records:
+            subject = record[0]
+            title = self.graph.value(subject, DC.title)
+            if not title or subject in self.merged_things:
+                continue
+            main_site = self._merged_site(subject, title.toPython())
+            if main_site:
+                self.merged_things.append(main_site)
+            yield record
 
     def process_type(self, rdf_type, defined_type):
         """Browse the graph for a certain type and process found subjects
@@ -127,18 +205,8 @@ class OxpointsImporter(object):
         :param defined_type: type defining subjects found
         :return list of documents
         """
-        objects = []
-        for subject in self.graph.subjects(RDF.type, rdf_type):
-            try:
-                doc = self.process_subject(subject, defined_type)
-                if doc:
-                    search_results = self.indexer.search_for_ids(self.identifier_key, doc[self.identifier_key])
-                    result = prepare_document(doc, search_results, self.precedence)
-                    objects.append(result)
-            except Exception:
-                logger.warning('Could not process subject', exc_info=True,
-                               extra={'data': {'subject': subject.toPython()}})
-        return objects
+        subjects = ((subject, defined_type) for subject in self.graph.subjects(RDF.type, rdf_type))
+        return list(self.merge(self.transform(subjects)))
 
     def process_subject(self, subject, mapped_type):
         """Prepare a document from a Subject by browsing the RDF graph
@@ -183,52 +251,47 @@ class OxpointsImporter(object):
         main_site_id = None
 
         # attempt to merge a Thing and its Site if it has one
-        if main_site:
-            site_title = self.graph.value(main_site, DC.title)
-            if site_title:
-                site_title = site_title.toPython()
-
-                # if the main_site has the same name that the Thing, then merge
-                # them and do not import the Site by itself
-                if site_title == title:
-                    main_site_id = self._get_formatted_oxpoints_id(main_site)
-                    ids.add(main_site_id)
-                    ids.update(self._get_identifiers_for_subject(main_site))
-
-                    # try to add the type of the site to the Thing
-                    # e.g. Sheldonian is both a Department and a Building after merge
-                    main_site_type = self.graph.value(main_site, RDF.type)
-                    if main_site_type in INDEXED_TYPES:
-                        main_site_mapped_types = INDEXED_TYPES.get(main_site_type)
-                        if type(main_site_mapped_types) is list:
-                            types.extend(main_site_mapped_types)
-                        else:
-                            types.append(main_site_mapped_types)
-
-                    self.merged_things.append(main_site)
-                    # adding accessibility data of the site to the doc
-                    # this happens when a building == an organisation
-                    # e.g. Sackler Library -- makes sense to merge accessibility data
-                    doc.update(self._handle_accessibility_data(main_site))
-                    doc.update(self._handle_mapped_properties(main_site))
-                    if self.static_files_dir:
-                        doc['files'] = self._handle_files(main_site)
-
-                    # primary place is itself
-                    doc['primary_place'] = doc['id']
-
-            if not main_site_id:
-                # Thing and its main site haven't been merged
-                # adding a relation between the site and the thing
-                parent_of.add(self._get_formatted_oxpoints_id(main_site))
-                doc['primary_place'] = self._get_formatted_oxpoints_id(main_site)
-
-        location = find_location(self.graph, subject)
+        # if the main_site has the same name that the Thing, then merge
+        # them and do not import the Site by itself
+        if self._merged_site(subject, title):
+            main_site_id = self._get_formatted_oxpoints_id(main_site)
+            ids.add(main_site_id)
+            ids.update(self._get_identifiers_for_subject(main_site))
+
+            # try to add the type of the site to the Thing
+            # e.g. Sheldonian is both a Department and a Building after merge
+            main_site_type = self.graph.value(main_site, RDF.type)
+            if main_site_type in INDEXED_TYPES:
+                main_site_mapped_types = INDEXED_TYPES.get(main_site_type)
+                if type(main_site_mapped_types) is list:
+                    types.extend(main_site_mapped_types)
+                else:
+                    types.append(main_site_mapped_types)
+
+            self.merged_things.append(main_site)
+            # adding accessibility data of the site to the doc
+            # this happens when a building == an organisation
+            # e.g. Sackler Library -- makes sense to merge accessibility data
+            doc.update(self._handle_accessibility_data(main_site))
+            doc.update(self._handle_mapped_properties(main_site))
+            if self.static_files_dir:
+                doc['files'] = self._handle_files(main_site)
+
+            # primary place is itself
+            doc['primary_place'] = doc['id']
+
+        elif main_site:
+            # Thing and its main site haven't been merged
+            # adding a relation between the site and the thing
+            parent_of.add(self._get_formatted_oxpoints_id(main_site))
+            doc['primary_place'] = self._get_formatted_oxpoints_id(main_site)
+
+        location = self.resolver.location(subject)
         if location:
             lat, lon = location
             doc['location'] = "{lat},{lon}".format(lat=lat, lon=lon)
 
-        shape = find_shape(self.graph, subject)
+        shape = self.resolver.shape(subject)
         if shape:
             doc['shape'] = shape
 
@@ -274,6 +337,19 @@ class OxpointsImporter(object):
 
         return doc
 
+    def _merged_site(self, subject, title):
+        """Main site of a Thing having the same title, merged with the Thing
+        :param subject: subject of the Thing
+        :param title: title of the Thing
+        :return main site or None
+        """
+        main_site = self.graph.value(subject, OxPoints.primaryPlace)
+        if main_site:
+            site_title = self.graph.value(main_site, DC.title)
+            if site_title and site_title.toPython() == title:
+                return main_site
+        return None
+
     def _get_identifiers_for_subject(self, subject):
         """Find all identifiers for a given subject and
         return them as a list of identifier_type:identifier_value
@@ -527,7 +603,7 @@ class OxpointsImporter(object):
 
     def _get_files(self, subject, rdf_prop, file_type, primary=False):
         """Get files for given subject and predicate
-        Will download the file and store it
+        Files are added to the files to download
         :param subject: subject
         :param rdf_prop: predicate
         :param file_type: type of file (string), used in description and URL
@@ -544,7 +620,7 @@ class OxpointsImporter(object):
             download_location = '{base}{location}'.format(base=self.static_files_dir,
                                                           location=location)
 
-            download_file.delay(val.toPython(), download_location)
+            self.downloads.append((url, download_location))
             image_description = {'location': location,
                                  'file_name': file_name,
                                  'file_type': file_type,
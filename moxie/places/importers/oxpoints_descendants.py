@@ -12,7 +12,7 @@ UNIVERSITY_OF_OXFORD = URIRef("http://oxpoints.oucs.ox.ac.uk/id/00000000")
 
 class OxpointsDescendantsImporter(object):
 
-    def __init__(self, kv, oxpoints_file, relation, rdf_media_type='text/turtle'):
+    def __init__(self, kv, oxpoints_file, relation, rdf_media_type='text/turtle', graph=None):
         """From a given start point follow all edges through the specified ``relation``
         and collect a set of all descendants recursively.
 
@@ -20,11 +20,13 @@ class OxpointsDescendantsImporter(object):
         :param oxpoints_file: path to the oxpoints representation
         :param relation: the predicate we are following through the graph
         :param rdf_media_type: file format of oxpoints_file
+        :param graph: (optional) graph already parsed, oxpoints_file is not read if given
         """
         self.kv = kv
         self.relation = relation
-        graph = Graph()
-        graph.parse(oxpoints_file, format=rdf_media_type)
+        if graph is None:
+            graph = Graph()
+            graph.parse(oxpoints_file, format=rdf_media_type)
         self.graph = graph
 
     def import_data(self):
@@ -81,3 +81,156 @@ def find_shape(graph, subject, depth=1, max_depth=10):
             org = graph.value(subject, Org.subOrganizationOf)
             return find_shape(graph, org, depth=depth)
     return None
+
+
+class AncestorResolver(object):
+    """Resolve location and shape of subjects from their ancestors
+    (``primaryPlace``, ``within``, ``subOrganizationOf``), giving the same
+    results as :py:func:`find_location` and :py:func:`find_shape`.
+
+    Triples needed are read in one pass over the graph into dicts, and
+    results are memoised for every node of the chains walked, so subjects
+    sharing ancestors (e.g. rooms of a building) do not walk the chain
+    again and each WKT shape is validated only once.
+
+    :param graph: graph to browse
+    :param max_depth: maximum depth
+    """
+
+    def __init__(self, graph, max_depth=10):
+        self.max_depth = max_depth
+        self.parents = self._index(graph, OxPoints.primaryPlace, SpatialRelations.within,
+                                   Org.subOrganizationOf)
+        self.lats = self._index(graph, Geo.lat)
+        self.longs = self._index(graph, Geo.long)
+        self.extents = self._index(graph, Geometry.extent)
+        self.wkts = self._index(graph, Geometry.asWKT)
+        self.types = self._index(graph, RDF.type)
+        # node -> (value, number of hops to the node giving the value)
+        self.locations = dict()
+        self.shapes = dict()
+
+    @staticmethod
+    def _index(graph, *predicates):
+        """Object of the first predicate found for each subject
+        """
+        index = dict()
+        for predicate in predicates:
+            values = dict()
+            for subject, value in graph.subject_objects(predicate):
+                values.setdefault(subject, value)
+            for subject, value in values.iteritems():
+                index.setdefault(subject, value)
+        return index
+
+    def location(self, subject):
+        """Find Geo.lat and Geo.lon for a given subject
+        :param subject: subject to search
+        :return tuple (lat, lon) or None
+        """
+        return self._resolve(subject, self.locations, self._location_step)
+
+    def shape(self, subject):
+        """Find shape for a given subject
+        :param subject: subject to be used
+        :return string or None
+        """
+        return self._resolve(subject, self.shapes, self._shape_step)
+
+    def _resolve(self, subject, memo, step):
+        chain = []
+        node = subject
+        while True:
+            if node in memo:
+                value, distance = memo[node]
+                break
+            if len(chain) == self.max_depth:
+                # too deep (or cycle), not memoised
+                return None
+            chain.append(node)
+            parent, value = step(node)
+            if parent is None:
+                chain.pop()
+                memo[node] = value, 0
+                distance = 0
+                break
+            node = parent
+        for hops, node in enumerate(reversed(chain), 1):
+            memo[node] = value, distance + hops
+        if value is not None and len(chain) + distance >= self.max_depth:
+            return None
+        return value
+
+    def _location_step(self, subject):
+        """:return (parent, None) to continue with the parent,
+                   (None, value) if resolved
+        """
+        if subject in self.lats and subject in self.longs:
+            return None, (self.lats[subject].toPython(), self.longs[subject].toPython())
+        return self.parents.get(subject), None
+
+    def _shape_step(self, subject):
+        shape = self.extents.get(subject)
+        if shape:
+            wkt = self.wkts.get(shape)
+            if wkt:
+                return None, self._valid_wkt(subject, wkt.toPython())
+        # if we're at a Building level, do not try to go further
+        if self.types.get(subject) == OxPoints.Building:
+            return None, None
+        return self.parents.get(subject), None
+
+    def _valid_wkt(self, subject, wkt):
+        try:
+            # make sure that it is a correct WKT shape
+            result = wkt_loads(wkt)
+            if not result:
+                raise ValueError("No WKT shape")
+            return wkt
+        except:
+            logger.warning("Unable to detect a valid WKT shape", exc_info=True, extra={
+                'data': {
+                    'oxpoints_subject': subject.toPython()
+                }
+            })
+            return None
+
+
+def main():
+    """Compare time to find location and shape of OxPoints subjects by
+    walking the graph for each subject and with :py:class:`AncestorResolver`
+    """
+    import argparse
+    import time
+    import rdflib
+    from moxie.places.importers.oxpoints import MAPPED_TYPES
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('rdf_files', nargs='+')
+    parser.add_argument('--format', default='text/turtle')
+    ns = parser.parse_args()
+
+    graph = rdflib.Graph()
+    for path in ns.rdf_files:
+        graph.parse(path, format=ns.format)
+    subjects = [subject for oxpoints_type, _ in MAPPED_TYPES
+                for subject in graph.subjects(RDF.type, oxpoints_type)]
+
+    def walk():
+        return [(find_location(graph, s), find_shape(graph, s)) for s in subjects]
+
+    def resolver():
+        resolver = AncestorResolver(graph)
+        return [(resolver.location(s), resolver.shape(s)) for s in subjects]
+
+    results = []
+    for name, func in (('walk', walk), ('resolver', resolver)):
+        started = time.time()
+        results.append(func())
+        print "{name:>9}: {count} subjects in {elapsed:.2f}s".format(
+            name=name, count=len(subjects), elapsed=time.time() - started)
+    print "Same results: {same}".format(same=results[0] == results[1])
+
+
+if __name__ == '__main__':
+    main()
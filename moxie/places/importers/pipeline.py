@@ -0,0 +1,248 @@
+import logging
+import multiprocessing
+import resource
+import time
+
+from collections import deque
+
+from moxie.core.metrics import statsd
+from moxie.places.importers.merge import StagingIndexMerger
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss():
+    """Peak resident set size of the current process
+    :return size in kilobytes
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def feed_parser(parser, chunks, pending):
+    """Turn a push (SAX) parser into a generator: feed ``chunks`` to the
+    parser and yield items its handler appended to ``pending`` after each
+    chunk, so at most one chunk worth of items is buffered.
+
+    :param parser: incremental parser (e.g. ``xml.sax.make_parser``)
+    :param chunks: iterable of data to feed to the parser
+    :param pending: deque filled by the content handler of the parser
+    """
+    for chunk in chunks:
+        parser.feed(chunk)
+        while pending:
+            yield pending.popleft()
+    parser.close()
+    while pending:
+        yield pending.popleft()
+
+
+def read_chunks(f, size=8192):
+    """Generator of chunks of ``size`` bytes from a file object
+    """
+    chunk = f.read(size)
+    while chunk:
+        yield chunk
+        chunk = f.read(size)
+
+
+def make_pool(processes):
+    """Pool of processes to run CPU-bound work of a stage
+    :param processes: number of processes, None for the number of CPUs
+    :return Pool or None to run the work in the current process
+    """
+    if processes is not None and processes <= 1:
+        return None
+    try:
+        return multiprocessing.Pool(processes)
+    except (AssertionError, OSError):
+        # e.g. daemonic processes are not allowed to have children
+        logger.warning("Couldn't create a pool of processes, running in process", exc_info=True)
+        return None
+
+
+def ordered_map(func, iterable, pool=None, window=8):
+    """Apply ``func`` to items of ``iterable`` in a pool of processes, results
+    are yielded in the order of ``iterable``. Unlike ``Pool.imap``, at most
+    ``window`` items are read ahead so memory stays bounded.
+
+    :param func: function (must be picklable, i.e. defined at module level)
+    :param iterable: items to process
+    :param pool: (optional) Pool, the work is done in process if None
+    :param window: number of items processed concurrently
+    """
+    if pool is None:
+        for item in iterable:
+            yield func(item)
+        return
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+class Reader(object):
+    """File-like object only exposing ``read``, lxml (2.3) iterparse fails to
+    read from native file objects with recent versions of libxml2
+    """
+
+    def __init__(self, f):
+        self.read = f.read
+
+
+class StageMetrics(object):
+    """Counters of a stage of a :py:class:`ImportPipeline`
+
+    ``seconds`` is the time spent in the stage itself (excluding previous
+    stages), ``peak_rss`` the peak memory (kB) of the process when the stage
+    produced its last item.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.inclusive_seconds = 0
+        self.seconds = 0
+        self.peak_rss = 0
+
+    def as_dict(self):
+        return {'name': self.name, 'items': self.items,
+                'seconds': self.seconds, 'peak_rss': self.peak_rss}
+
+    def __repr__(self):
+        return '<StageMetrics {name}: {items} items, {seconds:.2f}s, {peak_rss}kB>'.format(**self.as_dict())
+
+
+class ImportPipeline(object):
+    """Base class of importers, documents flow lazily through stages::
+
+        parse -> transform -> merge -> write
+
+    Subclasses implement :py:meth:`parse`, a generator of records read from
+    the source, and :py:meth:`transform_record` returning a document (or
+    ``None``) from a record. Each stage is a generator consuming the
+    previous one so only a bounded number of records is in memory whatever
+    the size of the source. Records failing to transform are logged and
+    skipped. Extra stages can be added by overriding :py:meth:`stages`.
+
+    The merge stage hands documents to the ``merger`` (see
+    :py:mod:`moxie.places.importers.merge`), which writes them at the end of
+    the source.
+
+    :param indexer: searcher used when no merger is given
+    :param precedence: precedence of the documents of this source
+    :param identifier_key: key of the identifiers in documents
+    :param merger: (optional) merger of documents
+    """
+
+    #: name used in logs and metrics
+    name = 'importer'
+    #: documents from this source only enrich documents from other sources
+    enrich_only = False
+
+    def __init__(self, indexer, precedence, identifier_key='identifiers', merger=None):
+        self.indexer = indexer
+        self.precedence = precedence
+        self.identifier_key = identifier_key
+        if merger is None and indexer:
+            merger = StagingIndexMerger(indexer, identifier_key)
+        self.merger = merger
+        self.metrics = []
+
+    def parse(self):
+        """Generator of records read from the source
+        """
+        raise NotImplementedError()
+
+    def transform_record(self, record):
+        """Transform a record in a document
+        :return document or None to skip the record
+        """
+        return record
+
+    def transform(self, records):
+        for record in records:
+            try:
+                doc = self.transform_record(record)
+            except Exception:
+                logger.warning('{importer} - could not transform record'.format(importer=self.name),
+                               exc_info=True, extra={'data': {'record': repr(record)}})
+                continue
+            if doc:
+                yield doc
+
+    def merge(self, documents):
+        for doc in documents:
+            yield self.merger.add(doc, self.precedence, enrich_only=self.enrich_only)
+
+    def stages(self):
+        """List of (name, function) where function takes the iterator of
+        the previous stage and returns an iterator
+        """
+        return [('parse', lambda _: self.parse()),
+                ('transform', self.transform)]
+
+    def documents(self):
+        """Generator of documents going through all stages but the merge
+        """
+        self.metrics = []
+        items = iter(())
+        for name, stage in self.stages():
+            metrics = StageMetrics(name)
+            items = self._measure(stage(items), metrics, list(self.metrics))
+            self.metrics.append(metrics)
+        return items
+
+    def _measure(self, items, metrics, previous):
+        """Wrap a stage to count items, time spent and peak memory
+        """
+        upstream = previous[-1] if previous else None
+        items = iter(items)
+        while True:
+            started = time.time()
+            try:
+                item = next(items)
+            except StopIteration:
+                self._update(metrics, upstream, started)
+                metrics.peak_rss = peak_rss()
+                return
+            self._update(metrics, upstream, started)
+            metrics.items += 1
+            yield item
+
+    @staticmethod
+    def _update(metrics, upstream, started):
+        metrics.inclusive_seconds += time.time() - started
+        metrics.seconds = metrics.inclusive_seconds
+        if upstream:
+            metrics.seconds -= upstream.inclusive_seconds
+        if not metrics.items % 1000:
+            metrics.peak_rss = peak_rss()
+
+    def run(self):
+        """Run all the stages, documents are merged then written
+        """
+        merged = self.merge(self.documents())
+        merge_metrics = StageMetrics('merge')
+        for _ in self._measure(merged, merge_metrics, self.metrics):
+            pass
+        self.metrics.append(merge_metrics)
+        write_metrics = StageMetrics('write')
+        started = time.time()
+        self.merger.end_source()
+        write_metrics.seconds = write_metrics.inclusive_seconds = time.time() - started
+        write_metrics.peak_rss = peak_rss()
+        self.metrics.append(write_metrics)
+        self.report()
+
+    def report(self):
+        """Log metrics of stages and send timings to statsd
+        """
+        for metrics in self.metrics:
+            statsd.timing('places.importers.{importer}.{stage}'.format(importer=self.name,
+                                                                        stage=metrics.name),
+                          int(metrics.seconds * 1000))
+            logger.info('{importer} - {metrics}'.format(importer=self.name, metrics=metrics))
+
@@ -0,0 +1,110 @@
+import logging
+import re
+
+from moxie.places.geo import haversine
+from moxie.places.importers.helpers import REGIONS_KEY
+
+logger = logging.getLogger(__name__)
+
+OXFORD = 'oxford'
+DEFAULT_CENTRE = [51.7531, -1.2584]
+DEFAULT_DISTANCE = 10       # km
+
+RING_PATTERN = re.compile(r'\(([^()]+)\)')
+
+
+def parse_wkt_polygon(wkt):
+    """Rings of a WKT ``POLYGON`` or ``MULTIPOLYGON`` (outer rings and holes)
+    :param wkt: WKT, coordinates are "lon lat"
+    :return list of rings (lists of lat/lon)
+    """
+    if not wkt.strip().upper().startswith(('POLYGON', 'MULTIPOLYGON')):
+        raise ValueError("Only POLYGON and MULTIPOLYGON are supported: {wkt}".format(wkt=wkt[:50]))
+    rings = []
+    for ring in RING_PATTERN.findall(wkt):
+        points = []
+        for point in ring.split(','):
+            lon, lat = point.split()[:2]
+            points.append((float(lat), float(lon)))
+        rings.append(points)
+    if not rings:
+        raise ValueError("No ring in {wkt}".format(wkt=wkt[:50]))
+    return rings
+
+
+class Region(object):
+    """Named area, either a circle (``centre`` and ``distance``) or a WKT
+    polygon (``polygon``)
+    :param name: name of the region
+    :param centre: lat/lon of the centre of the circle
+    :param distance: radius of the circle in km
+    :param polygon: WKT polygon (or multi-polygon)
+    """
+
+    def __init__(self, name, centre=None, distance=None, polygon=None):
+        if not ((centre and distance) or polygon):
+            raise ValueError("Region {name} needs a centre and a distance or a polygon".format(name=name))
+        self.name = name
+        self.centre = centre
+        self.distance = distance
+        self.rings = parse_wkt_polygon(polygon) if polygon else None
+
+    def contains(self, location):
+        """True if the location is part of the region
+        :param location: lat/lon
+        """
+        if self.rings is None:
+            return haversine(self.centre, location) <= self.distance
+        lat, lon = map(float, location)
+        inside = False
+        # even-odd rule across all the rings, holes are excluded
+        for ring in self.rings:
+            for (lat1, lon1), (lat2, lon2) in zip(ring, ring[1:] + ring[:1]):
+                if (lat1 > lat) != (lat2 > lat) and lon < lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1):
+                    inside = not inside
+        return inside
+
+    def __repr__(self):
+        return '<Region {name}>'.format(name=self.name)
+
+
+def regions_from_config(config):
+    """Regions of the configuration (``PLACES_REGIONS``, name -> definition
+    of the region), by default the "oxford" region from
+    ``PLACES_GEOFILTER_CENTRE`` and ``PLACES_GEOFILTER_DISTANCE``
+    :param config: configuration of the app
+    :return list of Region
+    """
+    definitions = config.get('PLACES_REGIONS')
+    if definitions is None:
+        definitions = {OXFORD: {'centre': config.get('PLACES_GEOFILTER_CENTRE', DEFAULT_CENTRE),
+                                'distance': config.get('PLACES_GEOFILTER_DISTANCE', DEFAULT_DISTANCE)}}
+    return [Region(name, **definition) for name, definition in sorted(definitions.iteritems())]
+
+
+def region_names(config):
+    """Names of the regions of the configuration, see :py:func:`regions_from_config`
+    :param config: configuration of the app
+    :return list of names
+    """
+    definitions = config.get('PLACES_REGIONS')
+    if definitions is None:
+        return [OXFORD]
+    return sorted(definitions)
+
+
+def add_regions(doc, regions):
+    """Add the names of the regions the location of the document is part of
+    :param doc: document
+    :param regions: list of Region
+    :return document
+    """
+    names = []
+    if 'location' in doc:
+        location = doc['location'].split(',')
+        names = [region.name for region in regions if region.contains(location)]
+    if names:
+        doc[REGIONS_KEY] = names
+    else:
+        doc.pop(REGIONS_KEY, None)
+    return doc
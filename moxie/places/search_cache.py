@@ -0,0 +1,123 @@
+import hashlib
+import json
+import logging
+
+from moxie.core.metrics import statsd
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = '%s_generation' % __name__
+ENTRY_KEY_FORMAT = '%s_%s_%s'           # module, generation, hash of the search
+COUNT_KEY_FORMAT = '%s_count_%s'        # module, generation
+DEFAULT_TTL = 600                       # seconds
+DEFAULT_MAX_ENTRIES = 10000             # entries stored per TTL
+DEFAULT_MAX_BYTES = 256 * 1024          # size of an entry
+
+
+def canonical_search(query, location, start, count, pois_type=None, types_exact=None,
+                     filter_queries=None, facets=None, geofilter_centre=None, geofilter_distance=None,
+                     regions=None):
+    """Canonical form of the parameters of a search, searches differing only
+    by the order of filters, exact types, facets or regions (or by whitespace
+    in the query) have the same form
+    :return string
+    """
+    return json.dumps({'q': ' '.join((query or '').split()),
+                       'location': [str(value) for value in location] if location else None,
+                       'start': int(start),
+                       'count': int(count),
+                       'type': pois_type or None,
+                       'types_exact': sorted(types_exact or []),
+                       'fq': sorted(filter_queries or []),
+                       'facets': sorted(facets or []),
+                       'regions': sorted(regions or []),
+                       'geofilter': [str(value) for value in geofilter_centre] + [str(geofilter_distance)]
+                       if geofilter_centre and geofilter_distance else None},
+                      sort_keys=True)
+
+
+class SearchCache(object):
+    """Cache of search results in the KV store (redis).
+
+    Keys include a generation number, :py:meth:`invalidate` (e.g. when a
+    new index is swapped in production) increments it so all the entries
+    are ignored at once and expire with their TTL. At most ``max_entries``
+    entries of ``max_bytes`` are stored per generation and TTL.
+
+    Hits and misses are counted in statsd (``places.search_cache.hit``,
+    ``places.search_cache.miss``) as well as the time the search engine
+    took to compute the results of hits (``places.search_cache.saved_ms``).
+
+    Errors of the KV store are logged, the cache then behaves as empty.
+
+    :param kv: key-value store
+    :param ttl: time to live of entries in seconds
+    :param max_entries: maximum number of entries per generation and TTL
+    :param max_bytes: maximum size of an entry
+    """
+
+    def __init__(self, kv, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.kv = kv
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def generation(self):
+        return int(self.kv.get(GENERATION_KEY) or 0)
+
+    def key(self, generation, search):
+        return ENTRY_KEY_FORMAT % (__name__, generation, hashlib.sha1(search).hexdigest())
+
+    def get(self, search):
+        """Cached value of a search
+        :param search: canonical search, see :py:func:`canonical_search`
+        :return (value or None, generation)
+        """
+        try:
+            generation = self.generation()
+            entry = self.kv.get(self.key(generation, search))
+        except Exception:
+            logger.warning("Couldn't read the search cache", exc_info=True)
+            return None, None
+        if entry is not None:
+            try:
+                entry = json.loads(entry)
+                value, elapsed_ms = entry['value'], entry['elapsed_ms']
+            except (ValueError, TypeError, KeyError):
+                logger.warning("Couldn't decode an entry of the search cache", exc_info=True)
+            else:
+                statsd.incr('places.search_cache.hit')
+                statsd.incr('places.search_cache.saved_ms', elapsed_ms)
+                return value, generation
+        statsd.incr('places.search_cache.miss')
+        return None, generation
+
+    def set(self, search, generation, value, elapsed):
+        """Cache the value of a search
+        :param search: canonical search
+        :param generation: generation returned by :py:meth:`get`
+        :param value: JSON-serialisable value
+        :param elapsed: seconds taken to compute the value
+        """
+        if generation is None:
+            return
+        entry = json.dumps({'value': value, 'elapsed_ms': int(elapsed * 1000)})
+        if len(entry) > self.max_bytes:
+            return
+        try:
+            count_key = COUNT_KEY_FORMAT % (__name__, generation)
+            count = self.kv.incr(count_key)
+            if count == 1:
+                self.kv.expire(count_key, self.ttl)
+            if count > self.max_entries:
+                statsd.incr('places.search_cache.full')
+                return
+            self.kv.setex(self.key(generation, search), self.ttl, entry)
+        except Exception:
+            logger.warning("Couldn't write to the search cache", exc_info=True)
+
+    def invalidate(self):
+        """Invalidate all the entries
+        :return new generation
+        """
+        return self.kv.incr(GENERATION_KEY)
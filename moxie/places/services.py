@@ -1,6 +1,7 @@
 import logging
 import urllib
 import json
+import time
 
 from itertools import izip
 from functools import partial
@@ -8,14 +9,20 @@ from functools import partial
 from moxie.core.service import Service
 from moxie.core.kv import kv_store
 from moxie.core.search import searcher
+from moxie.core.metrics import statsd
 from moxie.places.importers.helpers import get_types_dict
 from moxie.places.solr import doc_to_poi
+from moxie.places.geo import haversine, quantise_location
+from moxie.places.search_cache import (SearchCache, canonical_search, DEFAULT_MAX_ENTRIES as CACHE_MAX_ENTRIES,
+                                       DEFAULT_MAX_BYTES as CACHE_MAX_BYTES)
 
 
 logger = logging.getLogger(__name__)
 
 
 TYPE_FACET = 'type'
+RING_TAG = 'ring'
+RING_SIZE_QUERY = '{!ex=%s}*:*' % RING_TAG     # number of results ignoring the ring
 
 
 class POIService(Service):
@@ -30,12 +37,45 @@ class POIService(Service):
     INBOUND = 1
     OUTBOUND = 2
 
-    def __init__(self, prefix_keys="_", identifiers_field='identifiers'):
+    def __init__(self, prefix_keys="_", identifiers_field='identifiers', search_service=None,
+                 cache_ttl=0, cache_max_entries=CACHE_MAX_ENTRIES, cache_max_bytes=CACHE_MAX_BYTES,
+                 location_cell=0, geo_rings=None, type_path_field=None, regions_field=None):
         """POI service
         :param prefix_keys: prefix used for keys not being in the schema of the search engine
+        :param search_service: (optional) search service to query instead of the
+                               one of the context (e.g. to warm up another index)
+        :param cache_ttl: time to live in seconds of results of searches cached in
+                          the KV store, 0 to disable the cache (see
+                          :py:class:`~moxie.places.search_cache.SearchCache`)
+        :param cache_max_entries: maximum number of searches cached per TTL
+        :param cache_max_bytes: maximum size of the results of a search cached
+        :param location_cell: (optional) size in metres of the cells of the grid
+                              locations are snapped to before ranking results by
+                              distance, so that searches from close locations are
+                              the same (and can be cached), 0 to rank by the exact
+                              location
+        :param geo_rings: (optional) list of radiuses in km, searches with a location
+                          but no full-text query are first made within rings of
+                          these radiuses around the location (see :py:meth:`_search_rings`)
+        :param type_path_field: field of the exact types and their ancestors (see
+                                :py:func:`~moxie.places.importers.helpers.add_type_path`)
+                                to filter types with terms (once the index has been rebuilt
+                                with it), None to filter with wildcards
+        :param regions_field: field of the names of the regions a place is part of (see
+                              :py:mod:`moxie.places.regions`), None if the index has no such field
+                              (``inoxford`` searches then use a geofilter)
         """
         self.prefix_keys = prefix_keys
         self.identifiers_field = identifiers_field
+        self.searcher = search_service or searcher
+        self.location_cell = location_cell
+        self.geo_rings = geo_rings or []
+        self.type_path_field = type_path_field
+        self.regions_field = regions_field
+        self.cache = None
+        if cache_ttl and not search_service:
+            self.cache = SearchCache(kv_store, ttl=cache_ttl, max_entries=cache_max_entries,
+                                     max_bytes=cache_max_bytes)
 
     def _transform_arg(self, arg, direction=1):
         for transform in self.key_transforms:
@@ -56,7 +96,7 @@ class POIService(Service):
 
     def get_results(self, original_query, location, start, count,
                     pois_type=None, types_exact=None, filter_queries=None,
-                    facets=(TYPE_FACET,), geofilter_centre=None, geofilter_distance=None):
+                    facets=(TYPE_FACET,), geofilter_centre=None, geofilter_distance=None, regions=None):
         """Search POIs
         :param original_query: fts query
         :param location: latitude,longitude
@@ -67,8 +107,54 @@ class POIService(Service):
         :param facets: (optional) list of fields to be returned as facets defaults to the `type` facet.
         :param geofilter_centre: (optional) lat/lon of the centre to start geofiltering
         :param geofilter_distance: (optional) distance in km to geofilter
+        :param regions: (optional) names of regions (computed when importing) places must be part of
         :return list of domain objects (POIs), total size of results and facets on type
         """
+        ranking_location = location
+        if location and self.location_cell:
+            ranking_location = quantise_location(location, self.location_cell)
+        search = generation = cached = None
+        if self.cache:
+            search = canonical_search(original_query, ranking_location, start, count, pois_type=pois_type,
+                                      types_exact=types_exact, filter_queries=filter_queries,
+                                      facets=facets, geofilter_centre=geofilter_centre,
+                                      geofilter_distance=geofilter_distance, regions=regions)
+            cached, generation = self.cache.get(search)
+        if cached is not None:
+            results, size, facet_values = cached
+        else:
+            started = time.time()
+            results, size, facet_values = self._search(original_query, ranking_location, start, count,
+                                                       pois_type=pois_type, types_exact=types_exact,
+                                                       filter_queries=filter_queries, facets=facets,
+                                                       geofilter_centre=geofilter_centre,
+                                                       geofilter_distance=geofilter_distance, regions=regions)
+            if self.cache:
+                self.cache.set(search, generation, (results, size, facet_values), time.time() - started)
+        if ranking_location is not location:
+            results = self._exact_distances(results, location)
+        return [doc_to_poi(r, self.prefix_keys) for r in results], size, facet_values
+
+    def _exact_distances(self, results, location):
+        """Distances of documents from the exact location, the search engine
+        computed them from the quantised location
+        :param results: list of documents
+        :param location: latitude,longitude
+        :return list of documents
+        """
+        docs = []
+        for doc in results:
+            if 'location' in doc:
+                doc = dict(doc, _dist_=haversine(location, doc['location'].split(',')))
+            docs.append(doc)
+        return docs
+
+    def _search(self, original_query, location, start, count,
+                pois_type=None, types_exact=None, filter_queries=None,
+                facets=(TYPE_FACET,), geofilter_centre=None, geofilter_distance=None, regions=None):
+        """Search documents, see :py:meth:`get_results`
+        :return list of documents, total size of results and facets
+        """
         filter_queries = filter_queries or []
         filter_queries = self._args_to_internal(filter_queries)
         query = original_query or ''
@@ -131,30 +217,39 @@ class POIService(Service):
             filter_queries.append("{{!geofilt sfield=location pt={lat},{lon} d={distance}}}".format(lat=geofilter_centre[0],
                                                                                                     lon=geofilter_centre[1],
                                                                                                     distance=geofilter_distance))
+        if regions and not self.regions_field:
+            raise ValueError("Regions are not indexed (no regions_field)")
+        for region in regions or []:
+            filter_queries.append(self.region_filter(region))
 
         # TODO make a better filter query to handle having type and types_exact at the same time
         if pois_type:
             # filter on one specific type (and its subtypes)
             q['f.type.facet.prefix'] = pois_type + "/"  # we only want to display sub-types as the facet
-            filter_queries.append('type_exact:{pois_type}*'.format(pois_type=pois_type.replace('/', '\/')))
+            filter_queries.append(self.type_filter(pois_type))
         elif types_exact:
             # filter by a list of specific types (exact match)
             filter_queries.append('type_exact:({types})'.format(types=" OR ".join('"{t}"'.format(t=t)
                                                                                   for t in types_exact)))
 
-        response = searcher.search(q, fq=filter_queries, start=start, count=count)
+        response = size = None
+        if location and not original_query and self.geo_rings:
+            response, size = self._search_rings(q, filter_queries, start, count)
+        if not response:
+            response = self.searcher.search(q, fq=filter_queries, start=start, count=count)
+            size = response.size
 
         # if no results, try to use spellcheck suggestion to make a new request
         if not response.results:
             if response.query_suggestion:
                 suggestion = response.query_suggestion
-                return self.get_results(suggestion, location, start, count,
-                                        pois_type=pois_type, types_exact=types_exact,
-                                        facets=facets,
-                                        filter_queries=filter_queries)
+                return self._search(suggestion, location, start, count,
+                                    pois_type=pois_type, types_exact=types_exact,
+                                    facets=facets,
+                                    filter_queries=filter_queries)
             else:
                 return [], 0, None
-        if response.facets:
+        if response.facets and internal_facets:
             facet_values = {}
             for internal_name, friendly_name in zip(internal_facets, facets):
                 vals = response.facets['facet_fields'].get(internal_name, None)
@@ -165,7 +260,53 @@ class POIService(Service):
                     facet_values[friendly_name] = vals
         else:
             facet_values = None
-        return [doc_to_poi(r, self.prefix_keys) for r in response.results], response.size, facet_values
+        return response.results, size, facet_values
+
+    def type_filter(self, pois_type):
+        """Filter query of documents of a type and its sub-types
+        :param pois_type: type from the hierarchy of types
+        :return filter query
+        """
+        if self.type_path_field:
+            return '{field}:"{pois_type}"'.format(field=self.type_path_field, pois_type=pois_type.rstrip('/'))
+        return 'type_exact:{pois_type}*'.format(pois_type=pois_type.replace('/', '\/'))
+
+    def region_filter(self, region):
+        """Filter query of places part of a region
+        :param region: name of the region
+        :return filter query
+        """
+        return '{field}:"{region}"'.format(field=self.regions_field, region=region)
+
+    def _search_rings(self, q, filter_queries, start, count):
+        """Search documents within rings of increasing radius around the
+        location, until a ring has enough documents for the page. Results
+        are only ranked by distance (no full-text query) so the documents
+        of the page are the same as the ones of a search without a ring,
+        but only documents of the ring are scored. Facets and the total
+        number of results ignore the ring (tagged filter excluded).
+        :param q: query with a location (``pt`` and ``sfield``)
+        :param filter_queries: list of filter queries
+        :return (response, total number of results) or (None, None) if no
+                ring has enough documents
+        """
+        q = dict(q)
+        q['facet'] = 'true'
+        q['facet.query'] = RING_SIZE_QUERY
+        q['facet.field'] = ['{{!ex={tag}}}{field}'.format(tag=RING_TAG, field=field)
+                            for field in q.get('facet.field', [])]
+        for radius in self.geo_rings:
+            ring = '{{!geofilt tag={tag} d={radius}}}'.format(tag=RING_TAG, radius=radius)
+            response = self.searcher.search(dict(q), fq=filter_queries + [ring], start=start, count=count)
+            try:
+                size = response.facets['facet_queries'][RING_SIZE_QUERY]
+            except (TypeError, KeyError):
+                break
+            if response.size >= min(start + count, size):
+                statsd.incr('places.search.geo_ring.{radius}'.format(radius=radius))
+                return response, size
+        statsd.incr('places.search.geo_ring.global')
+        return None, None
 
     def get_place_by_identifier(self, ident):
         """Get place by identifier
@@ -184,7 +325,7 @@ class POIService(Service):
         :param idents: identifiers to lookup
         :return list of POI or None if no result
         """
-        response = searcher.get_by_ids(idents)
+        response = self.searcher.get_by_ids(idents)
         # First do a GET request by IDs
         if response.results:
             return [doc_to_poi(result, self.prefix_keys) for result in response.results]
@@ -208,7 +349,7 @@ class POIService(Service):
         :param ident: identifier to lookup
         :return POI or None if no result
         """
-        response = searcher.search_for_ids(self.identifiers_field, idents)
+        response = self.searcher.search_for_ids(self.identifiers_field, idents)
         if response.results:
             return [doc_to_poi(result, self.prefix_keys) for result in response.results]
         else:
@@ -240,7 +381,7 @@ class POIService(Service):
         if types_exact:
             filter_queries.append('type_exact:({types})'.format(types=" OR ".join('"{t}"'.format(t=t)
                                                                               for t in types_exact)))
-        response = searcher.suggest(q, fq=filter_queries, start=start, count=count)
+        response = self.searcher.suggest(q, fq=filter_queries, start=start, count=count)
         return [doc_to_poi(r) for r in response.results]
 
     def _build_parameter_value(self, d):
@@ -1,63 +1,427 @@
+import hashlib
+import json
 import logging
-import bz2
+import os
+import shutil
+import tempfile
 import zipfile
-import requests
 
-from celery import chain
-from xml.sax import make_parser
+from celery import chord, group
 
 from moxie import create_app
 from moxie.worker import celery
-from moxie.core.tasks import get_resource
-from moxie.core.search import searcher
+from moxie.core.tasks import get_resource, prefetch_resources
+from moxie.core.http import http_client
+from moxie.core.search import searcher, SearchService, SearchServerException
 from moxie.core.kv import kv_store
-from moxie.places.importers.osm import OSMHandler
+from moxie.core.file_sync import FileSync, DEFAULT_CONCURRENCY as SYNC_CONCURRENCY, DEFAULT_PER_HOST as SYNC_PER_HOST
+from moxie.places.importers.osm import OSMImporter, DEFAULT_BUFFER_SIZE as OSM_DEFAULT_BUFFER_SIZE
+from moxie.places.importers.osm_pbf import OSMPBFImporter
 from moxie.places.importers.oxpoints import OxpointsImporter
 from moxie.places.importers.oxpoints_descendants import OxpointsDescendantsImporter
 from moxie.places.importers.naptan import NaPTANImporter
 from moxie.places.importers.ox_library_data import OxLibraryDataImporter
 from moxie.places.importers.rdf_namespaces import Org
+from moxie.places.importers.merge import MergeEngine, SpillWriter, StagingIndexMerger
+from moxie.places.regions import regions_from_config
+from moxie.places.importers.delta import DocumentDelta
+from moxie.places.services import POIService
+from moxie.places.search_cache import SearchCache
+from moxie.places.import_run import ImportRun, COMPLETED, FAILED, RUNNING, SUCCEEDED
+from moxie.places.warmup import (IndexWarmer, recorded_searches, DEFAULT_SEARCHES as DEFAULT_WARMUP_SEARCHES,
+                                 DEFAULT_THRESHOLD as WARMUP_THRESHOLD, DEFAULT_MAX_ROUNDS as WARMUP_MAX_ROUNDS,
+                                 DEFAULT_RECORDED as WARMUP_RECORDED)
+from moxie.places.importers.graph_cache import GraphCache, load_graph
 
 logger = logging.getLogger(__name__)
 BLUEPRINT_NAME = 'places'
+# fingerprint of the resources of the last import swapped in production
+IMPORTED_RESOURCES_KEY = '%s_imported_resources' % __name__
+# content hashes of the documents in production
+DOCUMENT_HASHES_KEY = '%s_document_hashes' % __name__
+# content hashes of the documents of the "staging" index, before the swap
+PENDING_DOCUMENT_HASHES_KEY = '%s_pending_document_hashes' % __name__
+# id of the import run in progress
+IMPORT_LOCK_KEY = '%s_import_lock' % __name__
+DEFAULT_IMPORT_TIMEOUT = 12 * 3600      # seconds
 
 
 @celery.task
-def import_all(force_update_all=False):
-    """Start all the importers sequentially and attempt
-    to move the result index to production
+def import_all(force_update_all=False, full_rebuild=False):
+    """Run all the importers in parallel (a celery chord), each importer
+    writes its documents to a spill file in PLACES_IMPORT_SPILL_DIR. Once
+    all of them are done, :py:func:`merge_and_index` merges the documents,
+    indexes them in the "staging" index and attempts to move the result
+    index to production.
+
+    Resources of all importers are fetched concurrently first, nothing is
+    imported if none of them has changed since the last import (unless
+    ``force_update_all``).
+
+    If PLACES_IMPORT_INCREMENTAL is set, only documents added, changed or
+    deleted since the previous import are sent to the production index
+    (no rebuild of the "staging" index nor swap), unless ``full_rebuild``.
+
+    Runs are recorded in the KV store (see
+    :py:class:`~moxie.places.import_run.ImportRun`). If the last run has
+    failed, stages it has completed are not run again (importers whose
+    resources haven't changed, indexing of the "staging" index), unless
+    ``full_rebuild``.
+
+    Only one import runs at a time: a lock is held in the KV store until
+    the run finishes or for PLACES_IMPORT_TIMEOUT seconds.
+    :return True if the import has been started (or there is nothing to
+            import), False otherwise
     """
     app = create_app()
     with app.blueprint_context(BLUEPRINT_NAME):
-        solr_server = app.config['PLACES_SOLR_SERVER']
-        staging_core = app.config['PLACES_SOLR_CORE_STAGING']
-        staging_core_url = '{server}/{core}/update'.format(server=solr_server, core=staging_core)
-
-        # make sure the "staging" index is empty
-        delete_response = requests.post(staging_core_url, '<delete><query>*:*</query></delete>', headers={'Content-type': 'text/xml'})
-        commit_response = requests.post(staging_core_url, '<commit/>', headers={'Content-type': 'text/xml'})
-
-        if delete_response.ok and commit_response.ok:
-            logger.info("Deleted all documents from staging, launching importers")
-            # Using a chain (seq) so tasks execute in order
-            chain(import_oxpoints.s(force_update=force_update_all),
-                  import_osm.s(force_update=force_update_all),
-                  import_naptan.s(force_update=force_update_all),
-                  import_ox_library_data.s(force_update=force_update_all),
-                  swap_places_cores.s())()
-            return True
+        if not kv_store.setnx(IMPORT_LOCK_KEY, 'starting'):
+            logger.warning("Import {id} is still running, not starting another import".format(
+                id=kv_store.get(IMPORT_LOCK_KEY)))
+            return False
+        timeout = app.config.get('PLACES_IMPORT_TIMEOUT', DEFAULT_IMPORT_TIMEOUT)
+        kv_store.expire(IMPORT_LOCK_KEY, timeout)
+        run = None
+        try:
+            last_run = ImportRun.last(kv_store)
+            run = ImportRun.start(kv_store, force_update=force_update_all, full_rebuild=full_rebuild)
+            kv_store.setex(IMPORT_LOCK_KEY, timeout, run.id)
+            if start_import(app, run, last_run, force_update_all, full_rebuild):
+                return True
+        except:
+            logger.error("Error starting import", exc_info=True)
+            if run:
+                run.finish(FAILED)
+        release_import_lock(run.id if run else 'starting')
+        return run is not None and run.status == SUCCEEDED
+
+
+def start_import(app, run, last_run, force_update_all, full_rebuild):
+    """Start the importers of a run, see :py:func:`import_all`
+    :return True if the importers have been launched, False if the run has
+            finished (nothing to import)
+    """
+    with run.stage('prefetch') as stage:
+        resources = prefetch_resources(import_resources(app), force_update=force_update_all)
+        stage['bytes'] = sum(metadata['size'] for metadata in resources.values() if metadata)
+        stage['failed'] = len([metadata for metadata in resources.values() if not metadata])
+    fingerprint = resources_fingerprint(resources)
+
+    # a run still recorded as running (no lock) has timed out, its
+    # importers may still be writing to its spill directory
+    if last_run and last_run.status == RUNNING:
+        logger.warning("Import {id} timed out, its spill directory {spill_dir} is left as is".format(
+            id=last_run.id, spill_dir=last_run.attributes.get('spill_dir')))
+    resume = (last_run is not None and last_run.status == FAILED and not full_rebuild
+              and app.config.get('PLACES_IMPORT_RESUME', True)
+              and os.path.isdir(last_run.attributes.get('spill_dir') or ''))
+    if last_run and not resume and last_run.status != RUNNING and last_run.attributes.get('spill_dir'):
+        shutil.rmtree(last_run.attributes['spill_dir'], ignore_errors=True)
+
+    if not force_update_all and fingerprint and fingerprint == kv_store.get(IMPORTED_RESOURCES_KEY):
+        logger.info("None of the {count} resources has changed since the last import, "
+                    "nothing to import".format(count=len(resources)))
+        if resume:
+            shutil.rmtree(last_run.attributes['spill_dir'], ignore_errors=True)
+        run.attributes['skipped'] = True
+        run.finish(SUCCEEDED)
+        return False
+    prefetched = dict((url, metadata['location']) for url, metadata in resources.iteritems()
+                      if metadata)
+
+    if resume:
+        spill_dir = last_run.attributes['spill_dir']
+        incremental = last_run.attributes['incremental']
+        run.attributes['resumed'] = last_run.id
+    else:
+        spill_dir = tempfile.mkdtemp(prefix='moxie-import-', dir=app.config.get('PLACES_IMPORT_SPILL_DIR'))
+        # incremental imports need the hashes of the documents in production
+        incremental = bool(app.config.get('PLACES_IMPORT_INCREMENTAL', False) and not full_rebuild
+                           and DocumentDelta(kv_store, DOCUMENT_HASHES_KEY).exists())
+    run.attributes.update(spill_dir=spill_dir, fingerprint=fingerprint, incremental=incremental)
+    run.save()
+
+    importers, reused = [], []
+    for name, _ in IMPORTERS:
+        stage_name = importer_stage(name)
+        inputs = dict((url, resources[url]['sha1'] if resources.get(url) else None)
+                      for url in importer_urls(app, name))
+        previous = last_run.stages.get(stage_name) if resume else None
+        if (previous and previous['status'] == COMPLETED and previous.get('inputs') == inputs
+                and os.path.exists(previous['spill_file'])):
+            run.save_stage(stage_name, dict(previous, reused=True))
+            reused.append((name, previous['spill_file']))
         else:
-            logger.warning("Staging core not deleted correctly, aborting", extra={
-                'delete_response': delete_response.status_code,
-                'commit_response': commit_response.status_code
-            })
+            importers.append(import_source.s(name, spill_dir, force_update=force_update_all,
+                                             prefetched=prefetched, run_id=run.id, inputs=inputs,
+                                             bytes_read=sum(resources[url]['size'] for url in inputs
+                                                            if resources.get(url))))
+    # unless Solr refused the swap, it may have been applied (e.g. timed
+    # out) and the "staging" core may hold the previous index
+    previous_swap = last_run.stages.get('swap') if resume else None
+    skip_index = (resume and not importers and not incremental and last_run.completed('index')
+                  and (previous_swap is None or previous_swap.get('refused')))
+    if skip_index:
+        run.save_stage('index', dict(last_run.stages['index'], reused=True))
+    logger.info("Import {id} - launching {count} importers ({mode}{resumed})".format(
+        id=run.id, count=len(importers), mode='incremental' if incremental else 'full rebuild',
+        resumed=', resuming {id}'.format(id=last_run.id) if resume else ''))
+    callback = merge_and_index.s(run_id=run.id, reused=reused, skip_index=skip_index)
+    if importers:
+        chord(group(importers))(callback)
+    else:
+        callback.delay([])
+    return True
+
+
+def release_import_lock(run_id):
+    """Allow another import to start, if the lock is still held by the run
+    """
+    if kv_store.get(IMPORT_LOCK_KEY) == run_id:
+        kv_store.delete(IMPORT_LOCK_KEY)
+
+
+def empty_staging_core(app):
+    """Delete all the documents of the "staging" index
+    :return True if the index has been emptied
+    """
+    solr_server = app.config['PLACES_SOLR_SERVER']
+    staging_core = app.config['PLACES_SOLR_CORE_STAGING']
+    staging_core_url = '{server}/{core}/update'.format(server=solr_server, core=staging_core)
+
+    delete_response = http_client.post(staging_core_url, '<delete><query>*:*</query></delete>',
+                                       headers={'Content-type': 'text/xml'}, timeout=120)
+    commit_response = http_client.post(staging_core_url, '<commit/>',
+                                       headers={'Content-type': 'text/xml'}, timeout=120)
+    if delete_response.ok and commit_response.ok:
+        logger.info("Deleted all documents from staging")
+        return True
+    logger.warning("Staging core not deleted correctly, aborting", extra={
+        'delete_response': delete_response.status_code,
+        'commit_response': commit_response.status_code
+    })
+    return False
+
+
+def importer_stage(name):
+    """Name of the stage of an importer in the run record"""
+    return 'import_{name}'.format(name=name.lower())
+
+
+@celery.task
+def import_source(name, spill_dir, force_update=False, prefetched=None, run_id=None, inputs=None,
+                  bytes_read=None):
+    """Run an importer of :py:data:`IMPORTERS`, its documents are written
+    to a spill file (see :py:class:`~moxie.places.importers.merge.SpillWriter`)
+    :param name: name of the importer
+    :param spill_dir: directory of the spill file
+    :param run_id: (optional) id of the import run recording the stage
+    :param inputs: (optional) dict of url -> SHA-1 of the resources of the
+                   importer, recorded to know if the stage can be reused
+    :param bytes_read: (optional) size of the resources of the importer
+    :return (name, path of the spill file or None if the import failed)
+    """
+    path = os.path.join(spill_dir, '{name}.jsonl'.format(name=name))
+    run = ImportRun(kv_store, {'id': run_id})
+    try:
+        with run.stage(importer_stage(name), inputs=inputs, bytes=bytes_read, spill_file=path) as stage:
+            app = create_app()
+            with app.blueprint_context(BLUEPRINT_NAME):
+                run_importer = dict(IMPORTERS)[name]
+                spill = SpillWriter(path)
+                if run_importer(app, spill, force_update=force_update, prefetched=prefetched):
+                    spill.end_source()
+                    stage['docs'] = spill.count
+                    return name, path
+                logger.warning("{name} resource not loaded".format(name=name))
+                stage['status'] = FAILED
+    except:
+        logger.error("Error running {name} importer".format(name=name), exc_info=True)
+    return name, None
+
+
+@celery.task
+def merge_and_index(spill_files, run_id=None, reused=(), skip_index=False):
+    """Merge the documents of all importers (in memory, by precedence so
+    the result does not depend on the order importers have finished),
+    index the merged documents once in the "staging" index and attempt to
+    move the result index to production.
+
+    The spill directory is removed once the import has succeeded, it is
+    kept for the next run to resume otherwise.
+    :param spill_files: list of (name of the importer, path of its spill
+                        file or None if it failed)
+    :param run_id: id of the import run (see :py:func:`import_all`)
+    :param reused: list of (name, path of the spill file) of importers
+                   which have completed in the run resumed
+    :param skip_index: the "staging" index has been indexed by the run
+                       resumed, only warm it up and swap it
+    """
+    run = ImportRun.last(kv_store)
+    if run is None or run.id != run_id:
+        logger.warning("Import {id} is not the last import run, aborting".format(id=run_id))
         return False
+    spill_files = list(spill_files) + list(reused)
+    try:
+        failed = [name for name, path in spill_files if not path]
+        if failed:
+            logger.warning("Import aborted, {names} not imported".format(names=', '.join(failed)))
+            run.finish(FAILED)
+            return False
+        app = create_app()
+        with app.blueprint_context(BLUEPRINT_NAME):
+            incremental = run.attributes['incremental']
+            # hashes of documents of a full rebuild are only used once the
+            # index is in production
+            delta = DocumentDelta(kv_store, DOCUMENT_HASHES_KEY if incremental else PENDING_DOCUMENT_HASHES_KEY)
+            if not skip_index:
+                with run.stage('index') as stage:
+                    merger = MergeEngine(regions=regions_from_config(app.config))
+                    # sources in the order of IMPORTERS, the first gives its id
+                    order = [name for name, _ in IMPORTERS]
+                    for name, path in sorted(spill_files, key=lambda (name, path): order.index(name)):
+                        merger.add_spill(path)
+                    if incremental:
+                        index = production_searcher(app)
+                        documents = delta.changed(merger.documents())
+                    elif empty_staging_core(app):
+                        index = searcher
+                        documents = delta.record(merger.documents())
+                    else:
+                        raise SearchServerException("Staging core not deleted correctly")
+                    logger.info("Indexing {count} documents from all importers".format(count=len(merger)))
+                    with index.writer(page_size=app.config.get('PLACES_INDEX_PAGE_SIZE', 500),
+                                      concurrency=app.config.get('PLACES_INDEX_CONCURRENCY', 2),
+                                      commit_within=app.config.get('PLACES_INDEX_COMMIT_WITHIN')) as writer:
+                        writer.write(documents)
+                    stage['docs'] = writer.docs
+                    stage['bytes'] = writer.bytes_sent
+                    if incremental:
+                        deleted = delta.deleted()
+                        index.delete_by_ids(deleted)
+                        stage['deleted'] = len(deleted)
+                        logger.info(repr(delta))
+                    index.commit()
+                    delta.save()
+                    if incremental:
+                        invalidate_search_cache()
+            if not incremental:
+                with run.stage('warmup'):
+                    warm_up_places_core()
+                with run.stage('swap') as stage:
+                    if not swap_places_cores():
+                        stage['status'] = FAILED
+                        stage['refused'] = True
+                if run.stages['swap']['status'] == FAILED:
+                    run.finish(FAILED)
+                    return False
+            # documents are in production, the run can't fail anymore
+            run.finish(SUCCEEDED)
+        record_import(run)
+        return True
+    except:
+        logger.error("Error merging documents, import aborted", exc_info=True)
+        run.finish(FAILED)
+        return False
+    finally:
+        release_import_lock(run_id)
+
+
+def record_import(run):
+    """Bookkeeping once the documents of a run are in production: hashes
+    of the documents, fingerprint of the resources imported and spill
+    directory. Errors are logged, they do not fail the run.
+    :param run: import run which has succeeded
+    """
+    try:
+        if not run.attributes['incremental']:
+            if DocumentDelta(kv_store, PENDING_DOCUMENT_HASHES_KEY).exists():
+                kv_store.rename(PENDING_DOCUMENT_HASHES_KEY, DOCUMENT_HASHES_KEY)
+            else:
+                logger.warning("No hashes of the documents of import {id}".format(id=run.id))
+    except Exception:
+        logger.error("Couldn't save hashes of the documents of import {id}".format(id=run.id),
+                     exc_info=True)
+    try:
+        if run.attributes.get('fingerprint'):
+            kv_store.set(IMPORTED_RESOURCES_KEY, run.attributes['fingerprint'])
+    except Exception:
+        logger.error("Couldn't save resources imported by import {id}".format(id=run.id),
+                     exc_info=True)
+    shutil.rmtree(run.attributes['spill_dir'], ignore_errors=True)
+
+
+def production_searcher(app):
+    """Search service of the "production" index"""
+    return SearchService('solr+{server}/{core}'.format(server=app.config['PLACES_SOLR_SERVER'],
+                                                       core=app.config['PLACES_SOLR_CORE_PRODUCTION']))
+
+
+def staging_searcher(app):
+    """Search service of the "staging" index"""
+    return SearchService('solr+{server}/{core}'.format(server=app.config['PLACES_SOLR_SERVER'],
+                                                       core=app.config['PLACES_SOLR_CORE_STAGING']))
+
+
+def staging_poi_service(app):
+    """POI service configured as the one of the app (same filters) but
+    searching the "staging" core
+    """
+    kwargs = dict(app.config.get('SERVICES', {}).get(BLUEPRINT_NAME, {}).get('POIService') or {})
+    kwargs['search_service'] = staging_searcher(app)
+    return POIService(**kwargs)
+
+
+@celery.task
+def warm_up_places_core(previous_result=None):
+    """Replay representative searches against the "staging" index (to fill
+    its caches) until their latency settles, if the result of the previous
+    task is True. Searches are PLACES_WARMUP_QUERIES, or searches recorded
+    from production (PLACES_WARMUP_RECORD_RATE), or a default set.
+    Failures of the warm-up do not prevent the swap.
+    :return True if the previous task succeeded
+    """
+    if previous_result not in (None, True):
+        return False
+    try:
+        app = create_app()
+        with app.blueprint_context(BLUEPRINT_NAME):
+            max_rounds = app.config.get('PLACES_WARMUP_MAX_ROUNDS', WARMUP_MAX_ROUNDS)
+            if not max_rounds:
+                return True
+            searches = (app.config.get('PLACES_WARMUP_QUERIES')
+                        or recorded_searches(kv_store, app.config.get('PLACES_WARMUP_RECORDED', WARMUP_RECORDED))
+                        or DEFAULT_WARMUP_SEARCHES)
+            warmer = IndexWarmer(staging_poi_service(app), searches,
+                                 threshold=app.config.get('PLACES_WARMUP_THRESHOLD', WARMUP_THRESHOLD),
+                                 max_rounds=max_rounds,
+                                 geofilter_centre=app.config.get('PLACES_GEOFILTER_CENTRE', [51.7531, -1.2584]),
+                                 geofilter_distance=app.config.get('PLACES_GEOFILTER_DISTANCE', 10))
+            report = warmer.run()
+            logger.info("Staging core warmed up in {seconds:.1f}s, {rounds} rounds of {searches} searches".format(
+                seconds=report['seconds'], rounds=len(report['rounds']), searches=len(searches)),
+                extra={'data': report})
+    except:
+        logger.error("Error warming up the staging core", exc_info=True)
+    return True
+
+
+def invalidate_search_cache():
+    """Invalidate results of searches cached (the index in production has
+    changed), failures are logged as entries expire anyway
+    """
+    try:
+        generation = SearchCache(kv_store).invalidate()
+        logger.info("Search cache invalidated, generation {generation}".format(generation=generation))
+    except Exception:
+        logger.warning("Couldn't invalidate the search cache", exc_info=True)
 
 
 @celery.task
 def swap_places_cores(previous_result=None):
     """Swap staging and production indices if the
-    result of the previous task is True (i.e. success)
+    result of the previous task is True (i.e. success),
+    cached results of searches are invalidated
     """
     if previous_result in (None, True):
         app = create_app()
@@ -66,11 +430,13 @@ def swap_places_cores(previous_result=None):
             staging_core = app.config['PLACES_SOLR_CORE_STAGING']
             production_core = app.config['PLACES_SOLR_CORE_PRODUCTION']
 
-            swap_response = requests.get("{server}/admin/cores?action=SWAP&core={new}&other={old}".format(server=solr_server,
-                                                                                                          new=production_core,
-                                                                                                          old=staging_core))
+            swap_response = http_client.get("{server}/admin/cores?action=SWAP&core={new}&other={old}".format(server=solr_server,
+                                                                                                             new=production_core,
+                                                                                                             old=staging_core),
+                                            timeout=120)
             if swap_response.ok:
                 logger.info("Cores swapped")
+                invalidate_search_cache()
                 return True
             else:
                 logger.warning("Error when swapping core {response}".format(response=swap_response.status_code))
@@ -79,6 +445,210 @@ def swap_places_cores(previous_result=None):
     return False
 
 
+OXPOINTS_RDF_MEDIA_TYPE = 'text/turtle'  # default RDF serialization
+# configuration keys of OxPoints extensions merged in the OxPoints graph
+OXPOINTS_EXTENSIONS_URLS = ('OXPOINTS_SHAPES_URL', 'OXPOINTS_ACCESSIBILITY_URL',
+                            'OXPOINTS_COURSES_LOCATIONS_URL')
+# configuration keys of the resources of importers, with their media type
+IMPORT_URLS = (('OXPOINTS_IMPORT_URL', OXPOINTS_RDF_MEDIA_TYPE),) \
+    + tuple((key, OXPOINTS_RDF_MEDIA_TYPE) for key in OXPOINTS_EXTENSIONS_URLS) \
+    + (('OSM_IMPORT_URL', None),
+       ('NAPTAN_IMPORT_URL', None),
+       ('LIBRARY_DATA_IMPORT_URL', None))
+
+
+def import_resources(app):
+    """Resources of all the importers configured
+    :return list of (url, media type or None)
+    """
+    return [(app.config[key], media_type) for key, media_type in IMPORT_URLS if app.config.get(key)]
+
+
+def resources_fingerprint(resources):
+    """Fingerprint of the content of resources
+    :param resources: dict of url -> metadata from the download cache
+    :return string or None if one of the resources couldn't be fetched
+    """
+    if not resources or not all(resources.values()):
+        return None
+    return hashlib.sha1(json.dumps(sorted((url, metadata['sha1'])
+                                          for url, metadata in resources.iteritems()))).hexdigest()
+
+
+def fetch_resource(url, force_update=False, media_type=None, prefetched=None):
+    """Location of a resource already fetched or get it
+    :param prefetched: (optional) dict of url -> location
+    """
+    if prefetched and url in prefetched:
+        if not prefetched[url] or os.path.exists(prefetched[url]):
+            return prefetched[url]
+        # prefetched by another host (download cache not shared)
+        logger.info("{url} not found at {location}, fetching it".format(url=url, location=prefetched[url]))
+    return get_resource(url, force_update, media_type=media_type)
+
+
+def index_merger(app):
+    """Merger of documents of a single importer against the documents
+    already in the index
+    """
+    return StagingIndexMerger(searcher, regions=regions_from_config(app.config))
+
+
+def run_indexed_importer(app, run_importer, **kwargs):
+    """Run a single importer merging its documents against the index,
+    documents are committed (hard commit) if it has succeeded
+    :param run_importer: function running the importer, see :py:data:`IMPORTERS`
+    :return True if the importer has succeeded
+    """
+    merger = index_merger(app)
+    if run_importer(app, merger, **kwargs):
+        merger.commit()
+        return True
+    return False
+
+
+def run_osm_importer(app, merger, url=None, force_update=False, prefetched=None):
+    url = url or app.config['OSM_IMPORT_URL']
+    osm = fetch_resource(url, force_update, prefetched=prefetched)
+    if osm:
+        logger.info("OSM Downloaded - Stored here: %s" % osm)
+        options = dict(processes=app.config.get('OSM_IMPORT_PROCESSES'),
+                       prefilter_nodes=app.config.get('OSM_IMPORT_PREFILTER_NODES', False),
+                       node_store_dir=app.config.get('OSM_IMPORT_NODE_STORE_DIR'),
+                       merger=merger)
+        with open(osm, 'rb') as f:
+            if url.endswith('.pbf'):
+                importer = OSMPBFImporter(searcher, 5, f, **options)
+            else:
+                compression = 'bz2' if url.endswith('.bz2') else None
+                importer = OSMImporter(searcher, 5, f, compression=compression,
+                                       buffer_size=app.config.get('OSM_IMPORT_BUFFER_SIZE',
+                                                                  OSM_DEFAULT_BUFFER_SIZE),
+                                       **options)
+            importer.run()
+        return True
+    else:
+        logger.info("OSM hasn't been imported - resource not loaded")
+    return False
+
+
+def get_oxpoints_resources(app, url=None, force_update=False, prefetched=None):
+    """Download OxPoints and its extensions
+    :param prefetched: (optional) dict of url -> location of resources
+                       already fetched
+    :return list of (url, location) or None if OxPoints or one of the
+            extensions configured couldn't be loaded
+    """
+    url = url or app.config['OXPOINTS_IMPORT_URL']
+    oxpoints = fetch_resource(url, force_update, media_type=OXPOINTS_RDF_MEDIA_TYPE,
+                              prefetched=prefetched)
+    if not oxpoints:
+        return None
+    logger.info("OxPoints Downloaded - Stored here: %s" % oxpoints)
+    resources = [(url, oxpoints)]
+    for key in OXPOINTS_EXTENSIONS_URLS:
+        if key in app.config:
+            location = fetch_resource(app.config[key], force_update=force_update,
+                                      media_type=OXPOINTS_RDF_MEDIA_TYPE, prefetched=prefetched)
+            if not location:
+                logger.warning("OxPoints extension {url} couldn't be loaded".format(url=app.config[key]))
+                return None
+            resources.append((app.config[key], location))
+    return resources
+
+
+def load_oxpoints_graph(app, resources):
+    """Graph of OxPoints and its extensions, parsed resources are cached in
+    OXPOINTS_GRAPH_CACHE_DIR (if configured) and shared by importers
+    """
+    directory = app.config.get('OXPOINTS_GRAPH_CACHE_DIR')
+    cache = GraphCache(directory) if directory else None
+    return load_graph(resources, OXPOINTS_RDF_MEDIA_TYPE, cache=cache,
+                      compact=app.config.get('OXPOINTS_COMPACT_GRAPH', False))
+
+
+def run_oxpoints_importer(app, merger, url=None, force_update=False, prefetched=None):
+    static_files_dir = app.config.get('STATIC_FILES_IMPORT_DIRECTORY', None)
+    resources = get_oxpoints_resources(app, url=url, force_update=force_update,
+                                       prefetched=prefetched)
+    if resources:
+        graph = load_oxpoints_graph(app, resources)
+        importer = OxpointsImporter(searcher, 10, None, None, None, None, static_files_dir,
+                                    rdf_media_type=OXPOINTS_RDF_MEDIA_TYPE, merger=merger,
+                                    graph=graph, processes=app.config.get('OXPOINTS_IMPORT_PROCESSES'))
+        importer.import_data()
+        if static_files_dir:
+            sync_static_files.delay(importer.downloads)
+        return True
+    else:
+        logger.info("OxPoints hasn't been imported - resource not loaded")
+    return False
+
+
+def run_naptan_importer(app, merger, url=None, force_update=False, prefetched=None):
+    url = url or app.config['NAPTAN_IMPORT_URL']
+    naptan = fetch_resource(url, force_update, prefetched=prefetched)
+    if naptan:
+        archive = zipfile.ZipFile(open(naptan))
+        f = archive.open('NaPTAN.xml')
+        naptan = NaPTANImporter(searcher, 10, f, ['340'], 'identifiers', merger=merger)
+        naptan.run()
+        return True
+    else:
+        logger.info("Naptan hasn't been imported - resource not loaded")
+    return False
+
+
+def run_ox_library_data_importer(app, merger, url=None, force_update=False, prefetched=None):
+    url = url or app.config['LIBRARY_DATA_IMPORT_URL']
+    library_data = fetch_resource(url, force_update, prefetched=prefetched)
+    if library_data:
+        file = open(library_data)
+        importer = OxLibraryDataImporter(searcher, 10, file, merger=merger)
+        importer.run()
+        return True
+    else:
+        logger.info("OxLibraryData hasn't been imported - resource not loaded")
+    return False
+
+
+# (name, function running the importer) in the order used by import_all
+IMPORTERS = (
+    ('OxPoints', run_oxpoints_importer),
+    ('OSM', run_osm_importer),
+    ('NaPTAN', run_naptan_importer),
+    ('OxLibraryData', run_ox_library_data_importer),
+)
+# configuration keys of the resources of each importer
+IMPORTERS_URLS = {
+    'OxPoints': ('OXPOINTS_IMPORT_URL',) + OXPOINTS_EXTENSIONS_URLS,
+    'OSM': ('OSM_IMPORT_URL',),
+    'NaPTAN': ('NAPTAN_IMPORT_URL',),
+    'OxLibraryData': ('LIBRARY_DATA_IMPORT_URL',),
+}
+
+
+def importer_urls(app, name):
+    """URLs of the resources of an importer configured
+    """
+    return [app.config[key] for key in IMPORTERS_URLS.get(name, ()) if app.config.get(key)]
+
+
+@celery.task
+def sync_static_files(files):
+    """Download new and changed files referenced by documents (e.g. images
+    of OxPoints) in STATIC_FILES_IMPORT_DIRECTORY, files which are not
+    referenced anymore are deleted
+    :param files: list of (url, location)
+    """
+    app = create_app()
+    with app.blueprint_context(BLUEPRINT_NAME):
+        sync = FileSync(kv_store, app.config['STATIC_FILES_IMPORT_DIRECTORY'],
+                        concurrency=app.config.get('STATIC_FILES_SYNC_CONCURRENCY', SYNC_CONCURRENCY),
+                        per_host=app.config.get('STATIC_FILES_SYNC_PER_HOST', SYNC_PER_HOST))
+        return sync.sync(files).as_dict()
+
+
 @celery.task
 def import_osm(previous_result=None, url=None, force_update=False):
     """Run the OSM importer if previous importer has succeeded
@@ -87,24 +657,7 @@ def import_osm(previous_result=None, url=None, force_update=False):
         try:
             app = create_app()
             with app.blueprint_context(BLUEPRINT_NAME):
-                url = url or app.config['OSM_IMPORT_URL']
-                osm = get_resource(url, force_update)
-                if osm:
-                    logger.info("OSM Downloaded - Stored here: %s" % osm)
-                    osm = open(osm)
-                    handler = OSMHandler(searcher, 5)
-                    parser = make_parser(['xml.sax.xmlreader.IncrementalParser'])
-                    parser.setContentHandler(handler)
-                    # Parse in 8k chunks
-                    buffer = osm.read(8192)
-                    bunzip = bz2.BZ2Decompressor()
-                    while buffer:
-                        parser.feed(bunzip.decompress(buffer))
-                        buffer = osm.read(8192)
-                    parser.close()
-                    return True
-                else:
-                    logger.info("OSM hasn't been imported - resource not loaded")
+                return run_indexed_importer(app, run_osm_importer, url=url, force_update=force_update)
         except:
             logger.error("Error running OSM importer", exc_info=True)
     return False
@@ -117,15 +670,14 @@ def import_oxpoints_organisation_descendants(previous_result=None, url=None, for
     if previous_result in (None, True):
         try:
             app = create_app()
-            RDF_MEDIA_TYPE = 'text/turtle'  # default RDF serialization
             with app.blueprint_context(BLUEPRINT_NAME):
-                url = url or app.config['OXPOINTS_IMPORT_URL']
-                oxpoints = get_resource(url, force_update, media_type=RDF_MEDIA_TYPE)
-                if oxpoints:
-                    logger.info("OxPoints Downloaded - Stored here: %s" % oxpoints)
-                    oxpoints = open(oxpoints)
-                    importer = OxpointsDescendantsImporter(kv_store, oxpoints, Org.subOrganizationOf,
-                                                           rdf_media_type=RDF_MEDIA_TYPE)
+                resources = get_oxpoints_resources(app, url=url, force_update=force_update)
+                if resources:
+                    # same graph as the OxPoints importer, from the cache
+                    # if none of the resources has changed
+                    graph = load_oxpoints_graph(app, resources)
+                    importer = OxpointsDescendantsImporter(kv_store, None, Org.subOrganizationOf,
+                                                           graph=graph)
                     importer.import_data()
                     return True
                 else:
@@ -142,59 +694,8 @@ def import_oxpoints(previous_result=None, url=None, force_update=False):
     if previous_result in (None, True):
         try:
             app = create_app()
-            RDF_MEDIA_TYPE = 'text/turtle'  # default RDF serialization
             with app.blueprint_context(BLUEPRINT_NAME):
-                url = url or app.config['OXPOINTS_IMPORT_URL']
-
-                static_files_dir = app.config.get('STATIC_FILES_IMPORT_DIRECTORY', None)
-                oxpoints = get_resource(url, force_update, media_type=RDF_MEDIA_TYPE)
-
-                if 'OXPOINTS_SHAPES_URL' in app.config:
-                    url_shapes = app.config['OXPOINTS_SHAPES_URL']
-                    oxpoints_shape = get_resource(url_shapes, force_update, media_type=RDF_MEDIA_TYPE)
-                else:
-                    oxpoints_shape = None
-
-                if 'OXPOINTS_ACCESSIBILITY_URL' in app.config:
-                    url_accessibility = app.config['OXPOINTS_ACCESSIBILITY_URL']
-                    oxpoints_accessibility = get_resource(url_accessibility,
-                                                          force_update=force_update,
-                                                          media_type=RDF_MEDIA_TYPE)
-                else:
-                    oxpoints_accessibility = None
-
-                if 'OXPOINTS_COURSES_LOCATIONS_URL' in app.config:
-                    url_courses = app.config['OXPOINTS_COURSES_LOCATIONS_URL']
-                    oxpoints_courses = get_resource(url_courses,
-                                                    force_update=force_update,
-                                                    media_type=RDF_MEDIA_TYPE)
-                else:
-                    oxpoints_courses = None
-
-                if oxpoints:
-                    logger.info("OxPoints Downloaded - Stored here: %s" % oxpoints)
-                    oxpoints = open(oxpoints)
-                    if oxpoints_shape:
-                        shapes = open(oxpoints_shape)
-                    else:
-                        shapes = None
-
-                    if oxpoints_accessibility:
-                        accessibility = open(oxpoints_accessibility)
-                    else:
-                        accessibility = None
-
-                    if oxpoints_courses:
-                        courses = open(oxpoints_courses)
-                    else:
-                        courses = None
-
-                    importer = OxpointsImporter(searcher, 10, oxpoints, shapes, accessibility, courses, static_files_dir,
-                                                rdf_media_type=RDF_MEDIA_TYPE)
-                    importer.import_data()
-                    return True
-                else:
-                    logger.info("OxPoints hasn't been imported - resource not loaded")
+                return run_indexed_importer(app, run_oxpoints_importer, url=url, force_update=force_update)
         except:
             logger.error("Error running OxPoints importer", exc_info=True)
     return False
@@ -206,16 +707,7 @@ def import_naptan(previous_result=None, url=None, force_update=False):
         try:
             app = create_app()
             with app.blueprint_context(BLUEPRINT_NAME):
-                url = url or app.config['NAPTAN_IMPORT_URL']
-                naptan = get_resource(url, force_update)
-                if naptan:
-                    archive = zipfile.ZipFile(open(naptan))
-                    f = archive.open('NaPTAN.xml')
-                    naptan = NaPTANImporter(searcher, 10, f, ['340'], 'identifiers')
-                    naptan.run()
-                    return True
-                else:
-                    logger.info("Naptan hasn't been imported - resource not loaded")
+                return run_indexed_importer(app, run_naptan_importer, url=url, force_update=force_update)
         except:
             logger.error("Error running NaPTAN importer", exc_info=True)
     return False
@@ -227,15 +719,7 @@ def import_ox_library_data(previous_result=None, url=None, force_update=False):
         try:
             app = create_app()
             with app.blueprint_context(BLUEPRINT_NAME):
-                url = url or app.config['LIBRARY_DATA_IMPORT_URL']
-                library_data = get_resource(url, force_update)
-                if library_data:
-                    file = open(library_data)
-                    importer = OxLibraryDataImporter(searcher, 10, file)
-                    importer.run()
-                    return True
-                else:
-                    logger.info("OxLibraryData hasn't been imported - resource not loaded")
+                return run_indexed_importer(app, run_ox_library_data_importer, url=url, force_update=force_update)
         except:
             logger.error("Error running OxLibraryData importer", exc_info=True)
     return False
@@ -5,10 +5,13 @@ from werkzeug.wrappers import BaseResponse
 from moxie.core.views import ServiceView, accepts
 from moxie.core.representations import JSON, HAL_JSON
 from moxie.core.exceptions import BadRequest, NotFound
+from moxie.core.kv import kv_store
 from moxie.places.representations import (HALPOISearchRepresentation, HALPOIsRepresentation,
                                           HALPOIRepresentation, HALTypesRepresentation,
                                           GeoJsonPointsRepresentation, POIsRepresentation)
 from .services import POIService
+from .warmup import search_spec, record_search, DEFAULT_RECORDED
+from .regions import OXFORD, DEFAULT_CENTRE, DEFAULT_DISTANCE, region_names
 
 
 class Search(ServiceView):
@@ -38,6 +41,7 @@ class Search(ServiceView):
         self.facet_fields = arguments.poplist('facet')
         self.other_args = arguments.copy()
         self.in_oxford = arguments.pop('inoxford', False)   # filter only results "in oxford"
+        self.regions = arguments.poplist('region')          # filter only results in these regions
 
         if self.type and self.types_exact:
             raise BadRequest("You cannot have both 'type' and 'type_exact' parameters at the moment.")
@@ -50,28 +54,49 @@ class Search(ServiceView):
         if university_only and exclude_university:
             raise BadRequest("Parameters 'university_only' and 'exclude_university' are mutually exclusive.")
 
+        poi_service = POIService.from_context()
+
         if university_only:
-            additional_filters.append("type_exact:\/university*")
+            additional_filters.append(poi_service.type_filter("/university"))
         if exclude_university:
-            additional_filters.append("-type_exact:\/university*")
+            additional_filters.append("-" + poi_service.type_filter("/university"))
 
         additional_filters.extend(["%s:%s" % (key, val or True) for (key, val) in arguments.iteritems(multi=True)])
 
-        poi_service = POIService.from_context()
-
         kwargs = {
             'pois_type': self.type,
             'types_exact': self.types_exact,
             'filter_queries': additional_filters
         }
 
+        regions = list(self.regions)
+        available_regions = region_names(current_app.config) if poi_service.regions_field else []
+        in_oxford = False
         if self.in_oxford:
-            kwargs['geofilter_centre'] = current_app.config.get('PLACES_GEOFILTER_CENTRE', [51.7531, -1.2584])
-            kwargs['geofilter_distance'] = current_app.config.get('PLACES_GEOFILTER_DISTANCE', 10)
+            if OXFORD in available_regions:
+                # computed when importing, see moxie.places.regions
+                regions.append(OXFORD)
+            else:
+                in_oxford = True
+                kwargs['geofilter_centre'] = current_app.config.get('PLACES_GEOFILTER_CENTRE', DEFAULT_CENTRE)
+                kwargs['geofilter_distance'] = current_app.config.get('PLACES_GEOFILTER_DISTANCE', DEFAULT_DISTANCE)
+        for region in regions:
+            if region not in available_regions:
+                raise BadRequest("Unknown region '{region}'.".format(region=region))
+        if regions:
+            kwargs['regions'] = regions
 
         # Only pass `facets` if we have user-speciified facets
         if self.facet_fields:
             kwargs['facets'] = self.facet_fields
+        # sample of searches replayed to warm up new indices
+        record_rate = current_app.config.get('PLACES_WARMUP_RECORD_RATE')
+        if record_rate:
+            spec = search_spec(self.query, location, pois_type=self.type, types_exact=self.types_exact,
+                               filter_queries=additional_filters, facets=self.facet_fields,
+                               inoxford=in_oxford, regions=regions)
+            record_search(kv_store, spec, record_rate,
+                          limit=current_app.config.get('PLACES_WARMUP_RECORDED', DEFAULT_RECORDED))
         results, self.size, self.facets = poi_service.get_results(
             self.query, location, self.start, self.count, **kwargs)
         return results
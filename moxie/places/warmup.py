@@ -0,0 +1,148 @@
+import json
+import logging
+import random
+import time
+
+from moxie.core.metrics import statsd
+
+logger = logging.getLogger(__name__)
+
+RECORDED_SEARCHES_KEY = '%s_recorded_searches' % __name__
+DEFAULT_THRESHOLD = 100     # milliseconds
+DEFAULT_MAX_ROUNDS = 5
+DEFAULT_RECORDED = 50       # number of recorded searches kept
+
+# searches replayed when none is configured nor recorded
+DEFAULT_SEARCHES = [
+    {},
+    {'q': 'library'},
+    {'q': 'college', 'inoxford': True},
+    {'q': 'museum', 'location': [51.7531, -1.2584]},
+    {'type': '/university/college'},
+    {'type': '/transport/bus-stop', 'location': [51.7531, -1.2584], 'inoxford': True},
+]
+
+
+def search_spec(query, location, pois_type=None, types_exact=None, filter_queries=None,
+                facets=None, inoxford=False, regions=None):
+    """Description of a search (as passed to the search view) which can be
+    recorded and replayed
+    :return dict
+    """
+    spec = {'q': query}
+    if location:
+        spec['location'] = [float(location[0]), float(location[1])]
+    if pois_type:
+        spec['type'] = pois_type
+    if types_exact:
+        spec['type_exact'] = list(types_exact)
+    if filter_queries:
+        spec['filters'] = list(filter_queries)
+    if facets:
+        spec['facet'] = list(facets)
+    if inoxford:
+        spec['inoxford'] = True
+    if regions:
+        spec['region'] = list(regions)
+    return spec
+
+
+def record_search(kv, spec, rate, limit=DEFAULT_RECORDED):
+    """Record a sample of searches to be replayed when warming up an index,
+    only the ``limit`` most recent are kept
+    :param kv: key-value store (redis)
+    :param spec: search, see :py:func:`search_spec`
+    :param rate: fraction of searches recorded
+    """
+    if not rate or random.random() >= rate:
+        return
+    try:
+        kv.lpush(RECORDED_SEARCHES_KEY, json.dumps(spec))
+        kv.ltrim(RECORDED_SEARCHES_KEY, 0, limit - 1)
+    except Exception:
+        logger.warning("Couldn't record search", exc_info=True)
+
+
+def recorded_searches(kv, limit=DEFAULT_RECORDED):
+    """Searches recorded by :py:func:`record_search`
+    :return list of specs
+    """
+    return [json.loads(spec) for spec in kv.lrange(RECORDED_SEARCHES_KEY, 0, limit - 1)]
+
+
+class IndexWarmer(object):
+    """Replay searches against an index (through
+    :py:meth:`~moxie.places.services.POIService.get_results`) until their
+    latency has settled: rounds of all the searches are replayed until the
+    95th percentile of a round is below ``threshold`` or ``max_rounds`` have
+    been replayed.
+
+    :param service: :py:class:`~moxie.places.services.POIService` of the index
+    :param searches: list of searches, see :py:func:`search_spec`
+    :param threshold: latency in milliseconds
+    :param max_rounds: maximum number of rounds
+    :param geofilter_centre: lat/lon of the centre of ``inoxford`` searches (made
+                             with a geofilter rather than with a region)
+    :param geofilter_distance: distance in km of ``inoxford`` searches
+    """
+
+    def __init__(self, service, searches, threshold=DEFAULT_THRESHOLD, max_rounds=DEFAULT_MAX_ROUNDS,
+                 geofilter_centre=None, geofilter_distance=None):
+        self.service = service
+        self.searches = searches
+        self.threshold = threshold
+        self.max_rounds = max_rounds
+        self.geofilter_centre = geofilter_centre
+        self.geofilter_distance = geofilter_distance
+
+    def replay(self, spec):
+        """Replay a search
+        :return latency in milliseconds or None if the search failed
+        """
+        kwargs = {'pois_type': spec.get('type'),
+                  'types_exact': spec.get('type_exact'),
+                  'filter_queries': list(spec.get('filters', []))}
+        if spec.get('facet'):
+            kwargs['facets'] = spec['facet']
+        if spec.get('region'):
+            kwargs['regions'] = spec['region']
+        if spec.get('inoxford'):
+            kwargs['geofilter_centre'] = self.geofilter_centre
+            kwargs['geofilter_distance'] = self.geofilter_distance
+        started = time.time()
+        try:
+            self.service.get_results(spec.get('q', ''), spec.get('location'), 0, 35, **kwargs)
+        except Exception:
+            logger.warning("Warm-up search failed", exc_info=True, extra={'data': {'search': spec}})
+            return None
+        return (time.time() - started) * 1000
+
+    def run(self):
+        """Replay rounds of searches
+        :return dict (rounds: list of round timings, settled: True if the
+                latency has settled below the threshold, seconds)
+        """
+        started = time.time()
+        rounds = []
+        settled = False
+        while not settled and len(rounds) < self.max_rounds and self.searches:
+            latencies = [self.replay(spec) for spec in self.searches]
+            timings = sorted(latency for latency in latencies if latency is not None)
+            if not timings:
+                break
+            current = {'median': timings[len(timings) // 2],
+                       'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+                       'max': timings[-1],
+                       'failed': len(latencies) - len(timings)}
+            rounds.append(current)
+            statsd.timing('places.warmup.round.p95', int(current['p95']))
+            logger.info("Warm-up round {round}: median {median:.0f}ms, p95 {p95:.0f}ms, "
+                        "max {max:.0f}ms, {failed} failed".format(round=len(rounds), **current))
+            settled = current['p95'] <= self.threshold
+        report = {'rounds': rounds, 'settled': settled, 'seconds': time.time() - started}
+        statsd.gauge('places.warmup.rounds', len(rounds))
+        statsd.timing('places.warmup', int(report['seconds'] * 1000))
+        if not settled:
+            logger.warning("Latency of searches hasn't settled below {threshold}ms after "
+                           "{rounds} rounds".format(threshold=self.threshold, rounds=len(rounds)))
+        return report
@@ -0,0 +1,185 @@
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import mock
+
+from moxie.core.download_cache import DownloadCache
+
+
+class MemoryKV(object):
+
+    def __init__(self):
+        self.values = dict()
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+
+class MockResponse(object):
+
+    def __init__(self, url, status_code, content='', headers=None, fail_after=None):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.reason = 'Reason'
+        self.fail_after = fail_after
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise IOError('Connection reset')
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class Server(object):
+    """Serves resources, supports conditional and range requests"""
+
+    def __init__(self):
+        self.resources = dict()
+        self.requests = []
+        self.fail_after = None
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(headers)
+        if url not in self.resources:
+            return MockResponse(url, 404)
+        content, etag = self.resources[url]
+        if headers.get('If-None-Match') == etag:
+            return MockResponse(url, 304)
+        fail_after, self.fail_after = self.fail_after, None
+        if 'Range' in headers and headers.get('If-Range') == etag:
+            start = int(headers['Range'][len('bytes='):-1])
+            return MockResponse(url, 206, content[start:], fail_after=fail_after, headers={
+                'etag': etag,
+                'content-range': 'bytes {start}-{end}/{size}'.format(start=start, end=len(content) - 1,
+                                                                      size=len(content))})
+        return MockResponse(url, 200, content, fail_after=fail_after,
+                            headers={'etag': etag, 'content-length': str(len(content))})
+
+
+class DownloadCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = Server()
+        self.server.resources['http://foo.bar/naptan.zip'] = ('n' * 100, '"n1"')
+        self.cache = DownloadCache(MemoryKV(), self.directory, chunk_size=10)
+        patcher = mock.patch('moxie.core.download_cache.http_client')
+        http_client = patcher.start()
+        http_client.get.side_effect = self.server.get
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, location):
+        with open(location) as f:
+            return f.read()
+
+    def test_content_addressed(self):
+        location = self.cache.fetch('http://foo.bar/naptan.zip')
+        self.assertEqual(os.path.basename(location), hashlib.sha1('n' * 100).hexdigest())
+        self.assertEqual(self.read(location), 'n' * 100)
+        self.server.resources['http://foo.bar/copy.zip'] = ('n' * 100, '"c1"')
+        self.assertEqual(self.cache.fetch('http://foo.bar/copy.zip'), location)
+
+    def test_not_modified(self):
+        location = self.cache.fetch('http://foo.bar/naptan.zip')
+        self.assertEqual(self.cache.fetch('http://foo.bar/naptan.zip'), location)
+        self.assertEqual(self.server.requests[-1]['If-None-Match'], '"n1"')
+
+    def test_force_update(self):
+        self.cache.fetch('http://foo.bar/naptan.zip')
+        self.cache.fetch('http://foo.bar/naptan.zip', force_update=True)
+        self.assertNotIn('If-None-Match', self.server.requests[-1])
+
+    def test_changed(self):
+        old = self.cache.fetch('http://foo.bar/naptan.zip')
+        self.server.resources['http://foo.bar/naptan.zip'] = ('N' * 50, '"n2"')
+        new = self.cache.fetch('http://foo.bar/naptan.zip')
+        self.assertEqual(self.read(new), 'N' * 50)
+        self.assertNotEqual(old, new)
+        self.assertEqual(self.cache.metadata('http://foo.bar/naptan.zip')['etag'], '"n2"')
+
+    def test_changed_shared_blob(self):
+        self.server.resources['http://foo.bar/copy.zip'] = ('n' * 100, '"c1"')
+        location = self.cache.fetch('http://foo.bar/naptan.zip')
+        self.cache.fetch('http://foo.bar/copy.zip')
+        self.server.resources['http://foo.bar/naptan.zip'] = ('N' * 50, '"n2"')
+        self.cache.fetch('http://foo.bar/naptan.zip')
+        self.assertEqual(self.cache.metadata('http://foo.bar/copy.zip')['location'], location)
+        self.assertEqual(self.read(location), 'n' * 100)
+
+    def test_previous_version_evicted(self):
+        self.cache.budget = 60
+        old = self.cache.fetch('http://foo.bar/naptan.zip')
+        self.server.resources['http://foo.bar/naptan.zip'] = ('N' * 50, '"n2"')
+        new = self.cache.fetch('http://foo.bar/naptan.zip')
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_resume(self):
+        self.server.fail_after = 30
+        self.assertRaises(IOError, self.cache.fetch, 'http://foo.bar/naptan.zip')
+        self.assertIsNone(self.cache.metadata('http://foo.bar/naptan.zip'))
+        location = self.cache.fetch('http://foo.bar/naptan.zip')
+        self.assertEqual(self.server.requests[-1]['Range'], 'bytes=30-')
+        self.assertEqual(self.server.requests[-1]['If-Range'], '"n1"')
+        self.assertEqual(self.read(location), 'n' * 100)
+        self.assertEqual(os.path.basename(location), hashlib.sha1('n' * 100).hexdigest())
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'partial')), [])
+
+    def test_resume_changed(self):
+        self.server.fail_after = 30
+        self.assertRaises(IOError, self.cache.fetch, 'http://foo.bar/naptan.zip')
+        self.server.resources['http://foo.bar/naptan.zip'] = ('N' * 50, '"n2"')
+        # If-Range doesn't match, whole resource sent
+        self.assertEqual(self.read(self.cache.fetch('http://foo.bar/naptan.zip')), 'N' * 50)
+
+    def test_incomplete(self):
+        response = MockResponse('http://foo.bar/naptan.zip', 200, 'n' * 50, headers={'content-length': '100'})
+        with mock.patch('moxie.core.download_cache.http_client') as http_client:
+            http_client.get.return_value = response
+            self.assertFalse(self.cache.fetch('http://foo.bar/naptan.zip'))
+
+    def test_checksum(self):
+        response = MockResponse('http://foo.bar/naptan.zip', 200, 'n' * 100,
+                                headers={'content-md5': base64.b64encode(hashlib.md5('other').digest())})
+        with mock.patch('moxie.core.download_cache.http_client') as http_client:
+            http_client.get.return_value = response
+            self.assertFalse(self.cache.fetch('http://foo.bar/naptan.zip'))
+            response.headers['content-md5'] = base64.b64encode(hashlib.md5('n' * 100).digest())
+            self.assertTrue(self.cache.fetch('http://foo.bar/naptan.zip'))
+
+    def test_lru_eviction(self):
+        cache = DownloadCache(self.cache.kv, self.directory, budget=250)
+        for name in ('a', 'b', 'c'):
+            self.server.resources['http://foo.bar/' + name] = (name * 100, name)
+        a = cache.fetch('http://foo.bar/a')
+        b = cache.fetch('http://foo.bar/b')
+        os.utime(b, (time.time() - 60, os.path.getmtime(b)))
+        os.utime(a, (time.time() - 30, os.path.getmtime(a)))
+        cache.fetch('http://foo.bar/c')
+        self.assertTrue(os.path.exists(a))
+        self.assertFalse(os.path.exists(b))
+        self.assertIsNone(cache.metadata('http://foo.bar/b'))
+
+    def test_prefetch(self):
+        self.server.resources['http://foo.bar/oxpoints.ttl'] = ('o' * 100, '"o1"')
+        resources = self.cache.prefetch([('http://foo.bar/naptan.zip', None),
+                                         ('http://foo.bar/oxpoints.ttl', 'text/turtle'),
+                                         ('http://foo.bar/missing', None)])
+        self.assertEqual(resources['http://foo.bar/naptan.zip']['sha1'], hashlib.sha1('n' * 100).hexdigest())
+        self.assertEqual(self.read(resources['http://foo.bar/oxpoints.ttl']['location']), 'o' * 100)
+        self.assertIsNone(resources['http://foo.bar/missing'])
@@ -0,0 +1,179 @@
+import errno
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import mock
+
+from moxie.core.file_sync import FileSync
+
+
+class MemoryKV(object):
+
+    def __init__(self):
+        self.values = dict()
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+
+class MockResponse(object):
+
+    def __init__(self, status_code, content='', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.reason = 'Reason'
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FileSyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.kv = MemoryKV()
+        self.sync = FileSync(self.kv, self.directory)
+        self.remote = {'http://foo.bar/a.jpg': ('aaaa', '"etag-a"'),
+                       'http://foo.bar/b.jpg': ('bbbbbbbb', '"etag-b"')}
+        self.requests = []
+        patcher = mock.patch('moxie.core.file_sync.http_client')
+        self.http_client = patcher.start()
+        self.http_client.get.side_effect = self.get
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append((url, headers))
+        content, etag = self.remote[url]
+        if headers.get('If-None-Match') == etag:
+            return MockResponse(304)
+        return MockResponse(200, content, {'etag': etag})
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read(self, name):
+        with open(self.path(name)) as f:
+            return f.read()
+
+    def files(self):
+        return [('http://foo.bar/a.jpg', self.path('1/a.jpg')),
+                ('http://foo.bar/a.jpg', self.path('2/a.jpg')),
+                ('http://foo.bar/b.jpg', self.path('1/b.jpg'))]
+
+    def test_download(self):
+        report = self.sync.sync(self.files())
+        self.assertEqual(self.read('1/a.jpg'), 'aaaa')
+        self.assertEqual(self.read('2/a.jpg'), 'aaaa')
+        self.assertEqual(self.read('1/b.jpg'), 'bbbbbbbb')
+        # a.jpg downloaded once
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual((report.files, report.downloaded, report.bytes_downloaded, report.bytes_saved),
+                         (3, 2, 12, 4))
+        self.assertEqual(sorted(os.listdir(self.path('1'))), ['a.jpg', 'b.jpg'])
+
+    def test_unchanged(self):
+        self.sync.sync(self.files())
+        self.requests = []
+        report = self.sync.sync(self.files())
+        self.assertEqual(sorted(headers['If-None-Match'] for _, headers in self.requests),
+                         ['"etag-a"', '"etag-b"'])
+        self.assertEqual((report.unchanged, report.bytes_downloaded, report.bytes_saved), (2, 0, 16))
+
+    def test_changed(self):
+        self.sync.sync(self.files())
+        self.remote['http://foo.bar/a.jpg'] = ('AAAA', '"etag-a2"')
+        report = self.sync.sync(self.files())
+        self.assertEqual(self.read('1/a.jpg'), 'AAAA')
+        self.assertEqual(self.read('2/a.jpg'), 'AAAA')
+        self.assertEqual((report.downloaded, report.unchanged), (1, 1))
+
+    def test_same_content_without_validators(self):
+        self.sync.sync(self.files())
+        self.remote['http://foo.bar/a.jpg'] = ('aaaa', '"etag-other"')
+        mtime = os.path.getmtime(self.path('1/a.jpg'))
+        report = self.sync.sync(self.files())
+        self.assertEqual(report.unchanged, 2)
+        self.assertEqual(os.path.getmtime(self.path('1/a.jpg')), mtime)
+
+    def test_missing_file_downloaded(self):
+        self.sync.sync(self.files())
+        os.unlink(self.path('1/a.jpg'))
+        self.sync.sync(self.files())
+        self.assertEqual(self.read('1/a.jpg'), 'aaaa')
+
+    def test_delete_unreferenced(self):
+        self.sync.sync(self.files())
+        report = self.sync.sync(self.files()[:2])
+        self.assertEqual(report.deleted, 1)
+        self.assertFalse(os.path.exists(self.path('1/b.jpg')))
+
+    def test_failure_keeps_file(self):
+        self.sync.sync(self.files())
+        self.http_client.get.side_effect = lambda url, headers=None, **kwargs: MockResponse(500)
+        report = self.sync.sync(self.files())
+        self.assertEqual(report.failed, 2)
+        self.assertEqual(report.deleted, 0)
+        self.assertEqual(self.read('1/b.jpg'), 'bbbbbbbb')
+        self.assertEqual(len(self.sync.load_manifest()), 3)
+
+    def test_move_across_devices(self):
+        def rename(source, destination):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        with mock.patch('moxie.core.file_sync.os.rename', side_effect=rename):
+            self.sync.sync(self.files())
+        self.assertEqual(self.read('1/a.jpg'), 'aaaa')
+        self.assertEqual(self.read('2/a.jpg'), 'aaaa')
+        self.assertEqual(sorted(os.listdir(self.path('1'))), ['a.jpg', 'b.jpg'])
+
+    def test_move_to_new_directory(self):
+        self.sync.sync(self.files())
+        files = self.files() + [('http://foo.bar/b.jpg', self.path('3/b.jpg'))]
+        self.remote['http://foo.bar/b.jpg'] = ('BBBB', '"etag-b2"')
+        report = self.sync.sync(files)
+        self.assertEqual(report.failed, 0)
+        self.assertEqual(self.read('3/b.jpg'), 'BBBB')
+        self.assertEqual(self.read('1/b.jpg'), 'BBBB')
+
+    def test_write_failure(self):
+        self.sync.sync(self.files())
+        self.remote['http://foo.bar/a.jpg'] = ('AAAA', '"etag-a2"')
+        with mock.patch.object(self.sync, 'move', side_effect=OSError(errno.EACCES, 'Denied')):
+            report = self.sync.sync(self.files())
+        self.assertEqual((report.failed, report.unchanged), (1, 1))
+        self.assertEqual(self.read('1/a.jpg'), 'aaaa')
+        # manifest saved, temporary file removed
+        self.assertEqual(self.sync.load_manifest()[self.path('1/a.jpg')]['etag'], '"etag-a"')
+        self.assertEqual(sorted(os.listdir(self.path('1'))), ['a.jpg', 'b.jpg'])
+
+    def test_per_host_concurrency(self):
+        active, maximum = [0], [0]
+        lock = threading.Lock()
+
+        def get(url, headers=None, **kwargs):
+            with lock:
+                active[0] += 1
+                maximum[0] = max(maximum[0], active[0])
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+            return MockResponse(200, 'x')
+
+        self.http_client.get.side_effect = get
+        sync = FileSync(self.kv, self.directory, concurrency=8, per_host=2)
+        sync.sync([('http://foo.bar/{i}.jpg'.format(i=i), self.path('{i}.jpg'.format(i=i)))
+                   for i in range(10)])
+        self.assertEqual(maximum[0], 2)
@@ -0,0 +1,62 @@
+import unittest
+import mock
+
+from moxie.core.http import HTTPClient, DEFAULT_TIMEOUT
+
+
+class HTTPClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = HTTPClient()
+
+    def test_session_per_host(self):
+        first = self.client.session('http://foo.bar/solr/places/select')
+        second = self.client.session('http://foo.bar/solr/places/update')
+        other = self.client.session('http://bar.foo/Naptan.aspx')
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+
+    def test_session_per_scheme(self):
+        http = self.client.session('http://foo.bar/')
+        https = self.client.session('https://foo.bar/')
+        self.assertIsNot(http, https)
+
+    def test_default_timeout(self):
+        session = self.client.session('http://foo.bar/')
+        with mock.patch.object(session, 'request') as mock_request:
+            self.client.get('http://foo.bar/data')
+            mock_request.assert_called_with('GET', 'http://foo.bar/data', timeout=DEFAULT_TIMEOUT)
+
+    def test_custom_timeout(self):
+        session = self.client.session('http://foo.bar/')
+        with mock.patch.object(session, 'request') as mock_request:
+            self.client.post('http://foo.bar/update', 'data', timeout=120)
+            mock_request.assert_called_with('POST', 'http://foo.bar/update', data='data', timeout=120)
+
+    def test_reset_after_fork(self):
+        session = self.client.session('http://foo.bar/')
+        self.client.reset_after_fork()
+        self.assertIsNot(session, self.client.session('http://foo.bar/'))
+
+    def test_init_app_resizes_pools(self):
+        session = self.client.session('http://foo.bar/')
+        app = mock.Mock()
+        app.config = {'HTTP_POOL_SIZE': 2}
+        self.client.init_app(app)
+        self.assertEqual(self.client.pool_size, 2)
+        self.assertIsNot(session, self.client.session('http://foo.bar/'))
+
+    def test_read_errors_not_retried(self):
+        policy = self.client.get_retry_policy()
+        self.assertIs(policy.read, False)
+        self.assertEqual(policy.connect, self.client.retries)
+
+    def test_session_without_retries(self):
+        retrying = self.client.session('http://foo.bar/')
+        session = self.client.session('http://foo.bar/', retry=False)
+        self.assertIsNot(retrying, session)
+        self.assertEqual(session.get_adapter('http://foo.bar/').max_retries.total, 0)
+        with mock.patch.object(session, 'request') as mock_request:
+            self.client.post('http://foo.bar/update', 'data', retry=False)
+            mock_request.assert_called_with('POST', 'http://foo.bar/update', data='data',
+                                            timeout=DEFAULT_TIMEOUT)
@@ -0,0 +1,43 @@
+import unittest
+import mock
+
+from moxie.places.benchmark import TimedSearcher, compare, random_searches, type_searches
+from moxie.places.geo import haversine
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_random_searches(self):
+        searches = random_searches(20, centre=(51.7531, -1.2584), spread=2, types=['/a', '/b'])
+        self.assertEqual(len(searches), 20)
+        self.assertEqual(searches, random_searches(20, centre=(51.7531, -1.2584), spread=2,
+                                                   types=['/a', '/b']))
+        for search in searches:
+            self.assertLessEqual(haversine((51.7531, -1.2584), search['location']), 2.01)
+        self.assertEqual(searches[1]['pois_type'], '/b')
+
+    def test_timed_searcher(self):
+        backend = mock.Mock()
+        backend.search.return_value = mock.Mock(_raw_response={'responseHeader': {'QTime': 12}})
+        searcher = TimedSearcher(backend)
+        searcher.search({}, fq=[])
+        searcher.search({}, fq=[])
+        self.assertEqual((searcher.requests, searcher.qtime), (2, 24))
+        self.assertEqual(searcher.get_by_ids, backend.get_by_ids)
+
+    def test_compare(self):
+        def strategy(name, ids):
+            searcher = TimedSearcher(mock.Mock())
+            service = mock.Mock()
+            service.get_results.return_value = ([mock.Mock(id=i) for i in ids], len(ids), None)
+            return name, service, searcher
+        report = compare([strategy('global', ['a', 'b']), strategy('rings', ['a', 'c'])],
+                         random_searches(4), warmup=random_searches(2, seed=1))
+        self.assertEqual([r['name'] for r in report], ['global', 'rings'])
+        self.assertEqual(report[0]['recall'], 1.0)
+        self.assertEqual(report[1]['recall'], 0.5)
+
+    def test_type_searches(self):
+        searches = type_searches(5, types=['/a', '/b'])
+        self.assertEqual([(s['pois_type'], s['start']) for s in searches],
+                         [('/a', 0), ('/b', 0), ('/a', 35), ('/b', 35), ('/a', 70)])
@@ -0,0 +1,28 @@
+import unittest
+
+from moxie.places.geo import haversine, quantise_location
+
+
+class GeoTestCase(unittest.TestCase):
+
+    def test_haversine(self):
+        self.assertEqual(haversine((51.7531, -1.2584), ('51.7531', '-1.2584')), 0)
+        # Radcliffe Camera to Oxford railway station, about 1.2km
+        self.assertAlmostEqual(haversine((51.7534, -1.2540), (51.7535, -1.2700)), 1.1, places=1)
+        # a degree of latitude
+        self.assertAlmostEqual(haversine((0, 0), (1, 0)), 111.2, places=1)
+
+    def test_quantise_same_cell(self):
+        self.assertEqual(quantise_location((51.75310, -1.25840), 250),
+                         quantise_location(('51.75320', '-1.25850'), 250))
+
+    def test_quantise_within_cell(self):
+        location = (51.7531, -1.2584)
+        for cell in (100, 250, 1000):
+            quantised = quantise_location(location, cell)
+            # at most half of the diagonal of a cell away
+            self.assertLess(haversine(location, quantised) * 1000, cell * 0.75)
+
+    def test_quantise_cells_differ(self):
+        self.assertNotEqual(quantise_location((51.7531, -1.2584), 100),
+                            quantise_location((51.7631, -1.2584), 100))
@@ -0,0 +1,48 @@
+import unittest
+import mock
+
+from moxie.places.import_run import ImportRun, RUNNING, FAILED, SUCCEEDED
+from moxie.tests.test_places_tasks import MemoryKV
+
+
+class ImportRunTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.kv = MemoryKV()
+        self.run = ImportRun.start(self.kv, incremental=False)
+
+    def test_last(self):
+        self.assertIsNone(ImportRun.last(MemoryKV()))
+        run = ImportRun.last(self.kv)
+        self.assertEqual(run.id, self.run.id)
+        self.assertEqual(run.status, RUNNING)
+        self.assertFalse(run.attributes['incremental'])
+
+    def test_stages(self):
+        with mock.patch('moxie.places.import_run.statsd') as statsd:
+            with self.run.stage('import_osm', bytes=42) as stage:
+                stage['docs'] = 3
+            with self.run.stage('index') as stage:
+                stage['status'] = FAILED
+            with self.assertRaises(ValueError):
+                with self.run.stage('swap'):
+                    raise ValueError()
+            self.assertEqual(statsd.timing.call_count, 3)
+            statsd.timing.assert_any_call('places.import.import_osm', mock.ANY)
+        run = ImportRun.last(self.kv)
+        self.assertTrue(run.completed('import_osm'))
+        self.assertEqual(run.stages['import_osm']['docs'], 3)
+        self.assertEqual(run.stages['import_osm']['bytes'], 42)
+        self.assertTrue(run.stages['import_osm']['process_peak_rss'] > 0)
+        self.assertTrue(run.stages['import_osm']['peak_rss_increase'] >= 0)
+        self.assertFalse(run.completed('index'))
+        self.assertEqual(run.stages['swap']['status'], FAILED)
+
+    def test_start_replaces_last_run(self):
+        with self.run.stage('prefetch'):
+            pass
+        self.run.finish(SUCCEEDED)
+        self.assertEqual(ImportRun.last(self.kv).status, SUCCEEDED)
+        run = ImportRun.start(self.kv)
+        self.assertEqual(ImportRun.last(self.kv).stages, {})
+        self.assertEqual(ImportRun.last(self.kv).id, run.id)
@@ -0,0 +1,45 @@
+import unittest
+import bz2
+import random
+from StringIO import StringIO
+
+from moxie.places.importers.bz2_streams import split_streams, decompress
+from moxie.places.importers.pipeline import make_pool
+
+
+class Bz2StreamsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(42)
+        self.parts = [''.join(rnd.choice('<node id="1"/>\n') for _ in range(20000)) for _ in range(5)]
+        self.multi_stream = ''.join(bz2.compress(part) for part in self.parts)
+        self.data = ''.join(self.parts)
+
+    def test_split_streams(self):
+        segments = list(split_streams(StringIO(self.multi_stream), read_size=1000))
+        self.assertEqual(len(segments), 5)
+        self.assertEqual([bz2.decompress(s) for s in segments], self.parts)
+
+    def test_decompress_multi_stream(self):
+        chunks = list(decompress(StringIO(self.multi_stream), buffer_size=30000))
+        self.assertEqual(''.join(chunks), self.data)
+        # small streams are gathered in larger buffers
+        self.assertTrue(len(chunks) < 5)
+
+    def test_decompress_pool(self):
+        pool = make_pool(2)
+        try:
+            self.assertEqual(''.join(decompress(StringIO(self.multi_stream), pool=pool, buffer_size=1000)),
+                             self.data)
+        finally:
+            pool.terminate()
+
+    def test_decompress_single_stream(self):
+        # segments are cut at 16 * buffer_size and decompressed serially
+        single = bz2.compress(self.data)
+        self.assertTrue(len(single) > 16 * 200)
+        self.assertEqual(''.join(decompress(StringIO(single), buffer_size=200)), self.data)
+
+    def test_decompress_truncated(self):
+        truncated = self.multi_stream[:-100]
+        self.assertRaises(IOError, lambda: ''.join(decompress(StringIO(truncated))))
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import unittest
+import cPickle
+import tempfile
+from StringIO import StringIO
+
+import rdflib
+from rdflib import URIRef, Literal, BNode, RDF
+from rdflib.namespace import DC
+
+from moxie.places.importers.compact_graph import (CompactGraph, turtle_to_ntriples,
+                                                  load_compact_graph)
+from moxie.places.importers.rdf_namespaces import OxPoints, Org, Geo
+
+test_turtle = """@prefix dc: <http://purl.org/dc/elements/1.1/> .
+@prefix org: <http://www.w3.org/ns/org#> .
+@prefix oxp: <http://ns.ox.ac.uk/namespace/oxpoints/2009/02/owl#> .
+@prefix geo: <http://www.w3.org/2003/01/geo/wgs84_pos#> .
+@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .
+
+<http://oxpoints.oucs.ox.ac.uk/id/1> a oxp:University ;
+    dc:title "University of Oxford"@en .
+
+<http://oxpoints.oucs.ox.ac.uk/id/2> a oxp:Department, oxp:Unit ;
+    dc:title "Caf\\u00e9 \\"Department\\"" ;
+    org:subOrganizationOf <http://oxpoints.oucs.ox.ac.uk/id/1> ;
+    oxp:hasOUCSCode "dept", "other" ;
+    geo:lat "51.75"^^xsd:float ;
+    geo:long -1.25 ;
+    oxp:contact [ dc:title "Reception" ] .
+
+<http://oxpoints.oucs.ox.ac.uk/id/3> a oxp:Department ;
+    dc:title "Third" ;
+    org:subOrganizationOf <http://oxpoints.oucs.ox.ac.uk/id/1> ;
+    oxp:hasOUCSCode "dept" .
+"""
+
+
+def oxpoints(ident):
+    return URIRef('http://oxpoints.oucs.ox.ac.uk/id/{ident}'.format(ident=ident))
+
+
+class CompactGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rdflib_graph = rdflib.Graph()
+        self.rdflib_graph.parse(StringIO(test_turtle), format='turtle')
+        with tempfile.NamedTemporaryFile(suffix='.ttl') as f:
+            f.write(test_turtle)
+            f.flush()
+            self.graph = load_compact_graph([f.name], 'text/turtle')
+
+    def without_bnodes(self, triples):
+        return set(t for t in triples if not any(isinstance(term, BNode) for term in t))
+
+    def test_same_triples(self):
+        self.assertEqual(len(self.graph), len(self.rdflib_graph))
+        self.assertEqual(self.without_bnodes(self.graph), self.without_bnodes(self.rdflib_graph))
+
+    def test_turtle_to_ntriples(self):
+        out = StringIO()
+        self.assertEqual(turtle_to_ntriples(StringIO(test_turtle), out), 16)
+        graph = rdflib.Graph()
+        graph.parse(StringIO(out.getvalue()), format='nt')
+        self.assertEqual(self.without_bnodes(graph), self.without_bnodes(self.rdflib_graph))
+
+    def test_value(self):
+        self.assertEqual(self.graph.value(oxpoints(2), DC.title), Literal(u'Café "Department"'))
+        self.assertEqual(self.graph.value(oxpoints(1), DC.title), Literal('University of Oxford', lang='en'))
+        self.assertEqual(self.graph.value(oxpoints(2), Geo.lat).toPython(), 51.75)
+        self.assertIsNone(self.graph.value(oxpoints(1), Geo.lat))
+        self.assertIsNone(self.graph.value(oxpoints(42), DC.title))
+        contact = self.graph.value(oxpoints(2), OxPoints.contact)
+        self.assertIsInstance(contact, BNode)
+        self.assertEqual(self.graph.value(contact, DC.title), Literal('Reception'))
+
+    def test_objects(self):
+        self.assertEqual(set(self.graph.objects(oxpoints(2), OxPoints.hasOUCSCode)),
+                         set([Literal('dept'), Literal('other')]))
+        self.assertEqual(set(self.graph.objects(oxpoints(2), RDF.type)),
+                         set([OxPoints.Department, OxPoints.Unit]))
+
+    def test_subjects(self):
+        self.assertEqual(set(self.graph.subjects(RDF.type, OxPoints.Department)),
+                         set([oxpoints(2), oxpoints(3)]))
+        self.assertEqual(set(self.graph.subjects(OxPoints.hasOUCSCode, Literal('dept'))),
+                         set([oxpoints(2), oxpoints(3)]))
+
+    def test_inverse_triples(self):
+        self.assertEqual(set(self.graph.triples((None, Org.subOrganizationOf, oxpoints(1)))),
+                         set(self.rdflib_graph.triples((None, Org.subOrganizationOf, oxpoints(1)))))
+
+    def test_subject_objects(self):
+        self.assertEqual(set(self.graph.subject_objects(Org.subOrganizationOf)),
+                         set(self.rdflib_graph.subject_objects(Org.subOrganizationOf)))
+
+    def test_contains(self):
+        self.assertIn((oxpoints(2), Geo.lat, None), self.graph)
+        self.assertNotIn((oxpoints(3), Geo.lat, None), self.graph)
+
+    def test_frozen(self):
+        self.assertRaises(TypeError, self.graph.add, (oxpoints(4), DC.title, Literal('New')))
+
+    def test_pickle(self):
+        graph = cPickle.loads(cPickle.dumps(self.graph, cPickle.HIGHEST_PROTOCOL))
+        self.assertEqual(graph.value(oxpoints(3), DC.title), Literal('Third'))
+        self.assertEqual(len(graph), len(self.graph))
+
+    def test_add(self):
+        graph = CompactGraph()
+        for triple in self.rdflib_graph:
+            graph.add(triple)
+        self.assertEqual(set(graph), set(self.rdflib_graph))
+
+    def test_repeated_triples(self):
+        graph = CompactGraph()
+        for _ in range(2):
+            graph.add((oxpoints(3), RDF.type, OxPoints.Building))
+            graph.add((oxpoints(3), DC.title, Literal('Third')))
+        graph.add((oxpoints(3), DC.title, Literal('Third', lang='en')))
+        self.assertEqual(len(graph), 3)
+        self.assertEqual(list(graph.subjects(RDF.type, OxPoints.Building)), [oxpoints(3)])
+        self.assertEqual(sorted(graph.objects(oxpoints(3), DC.title)),
+                         sorted([Literal('Third'), Literal('Third', lang='en')]))
@@ -0,0 +1,45 @@
+import json
+import unittest
+
+from moxie.places.importers.delta import DocumentDelta, document_hash
+
+
+class MemoryKV(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+
+class DocumentDeltaTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.kv = MemoryKV()
+        self.documents = [{'id': 'osm:1', 'name': 'Radcam', 'tags': ['books']},
+                          {'id': 'osm:2', 'name': 'Bodleian'},
+                          {'id': 'osm:3', 'name': 'Carfax'}]
+        delta = DocumentDelta(self.kv, 'hashes')
+        self.assertFalse(delta.exists())
+        self.assertEqual(list(delta.record(self.documents)), self.documents)
+        delta.save()
+
+    def test_hash_ignores_version(self):
+        doc = {'id': 'osm:1', 'name': 'Radcam'}
+        self.assertEqual(document_hash(doc), document_hash(dict(doc, _version_=42)))
+        self.assertNotEqual(document_hash(doc), document_hash(dict(doc, name='Radcliffe Camera')))
+
+    def test_changes(self):
+        delta = DocumentDelta(self.kv, 'hashes')
+        self.assertTrue(delta.exists())
+        documents = [{'id': 'osm:1', 'name': 'Radcam', 'tags': ['books']},
+                     {'id': 'osm:2', 'name': 'Bodleian Library'},
+                     {'id': 'osm:4', 'name': 'Martyrs'}]
+        self.assertEqual([doc['id'] for doc in delta.changed(documents)], ['osm:2', 'osm:4'])
+        self.assertEqual((delta.added, delta.updated, delta.unchanged), (1, 1, 1))
+        self.assertEqual(delta.deleted(), ['osm:3'])
+        delta.save()
+        self.assertEqual(sorted(json.loads(self.kv['hashes'])), ['osm:1', 'osm:2', 'osm:4'])
+
+    def test_unchanged(self):
+        delta = DocumentDelta(self.kv, 'hashes')
+        self.assertEqual(list(delta.changed(self.documents)), [])
+        self.assertEqual(delta.deleted(), [])
@@ -0,0 +1,74 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from moxie.places.importers.compact_graph import CompactGraph
+from moxie.places.importers.graph_cache import GraphCache, load_graph, fingerprint
+
+SAMPLE = 'moxie/tests/data/sample-oxpoints.rdf'
+RESOURCES = [('http://oxpoints/', SAMPLE)]
+
+
+class GraphCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = GraphCache(self.directory)
+        self.etag = patch('moxie.places.importers.graph_cache.get_cached_etag_location',
+                          return_value=('"etag-1"', SAMPLE))
+        self.get_etag = self.etag.start()
+
+    def tearDown(self):
+        self.etag.stop()
+        shutil.rmtree(self.directory)
+
+    def test_parsed_once(self):
+        graph = load_graph(RESOURCES, 'xml', cache=self.cache)
+        with patch('rdflib.Graph.parse') as parse:
+            cached = load_graph(RESOURCES, 'xml', cache=self.cache)
+            self.assertFalse(parse.called)
+        self.assertEqual(len(cached), len(graph))
+        self.assertEqual(set(cached), set(graph))
+
+    def test_rebuilt_on_change(self):
+        load_graph(RESOURCES, 'xml', cache=self.cache)
+        self.get_etag.return_value = ('"etag-2"', SAMPLE)
+        with patch('rdflib.Graph.parse') as parse:
+            load_graph(RESOURCES, 'xml', cache=self.cache)
+            self.assertTrue(parse.called)
+
+    def test_compact(self):
+        graph = load_graph(RESOURCES, 'xml', cache=self.cache)
+        compact = load_graph(RESOURCES, 'xml', cache=self.cache, compact=True)
+        self.assertIsInstance(compact, CompactGraph)
+        self.assertEqual(len(compact), len(graph))
+        cached = load_graph(RESOURCES, 'xml', cache=self.cache, compact=True)
+        self.assertIsInstance(cached, CompactGraph)
+
+    def test_fingerprint_without_etag(self):
+        self.get_etag.return_value = (None, None)
+        self.assertEqual(fingerprint(RESOURCES), fingerprint(RESOURCES))
+        self.assertNotEqual(fingerprint(RESOURCES), fingerprint([('http://other/', SAMPLE)]))
+
+    def test_prune(self):
+        graph = load_graph(RESOURCES, 'xml')
+        for key in ('a', 'b', 'c'):
+            self.cache.set(key, graph)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.assertTrue(self.cache.get('c') is not None)
+
+    def test_private_directory(self):
+        directory = os.path.join(self.directory, 'graphs')
+        GraphCache(directory)
+        self.assertEqual(os.stat(directory).st_mode & 0777, 0700)
+        os.chmod(directory, 0777)
+        self.assertRaises(ValueError, GraphCache, directory)
+
+    def test_not_owned(self):
+        graph = load_graph(RESOURCES, 'xml')
+        self.cache.set('a', graph)
+        with patch('os.getuid', return_value=os.getuid() + 1):
+            self.assertIsNone(self.cache.get('a'))
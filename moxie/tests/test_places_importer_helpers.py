@@ -2,7 +2,7 @@ import unittest
 import mock
 import flask
 
-from moxie.places.importers.helpers import merge_docs, merge_keys, merge_values, find_type_name, prepare_document
+from moxie.places.importers.helpers import merge_docs, merge_keys, merge_values, find_type_name, prepare_document, add_type_path
 
 app = flask.Flask(__name__)
 
@@ -104,5 +104,11 @@ class HelpersTestCase(unittest.TestCase):
     def test_find_multiple_type_names(self):
         self.assertEqual(["University car park", "Transport"], find_type_name(["/transport/car-park/university", "/transport"]))
 
+    def test_add_type_path(self):
+        doc = add_type_path({'type': ['/transport/car-park/university', '/transport/bus-stop']})
+        self.assertEqual(doc['type_path'], ['/transport', '/transport/bus-stop', '/transport/car-park',
+                                            '/transport/car-park/university'])
+        self.assertEqual(add_type_path({'type': '/university'})['type_path'], ['/university'])
+
     def tearDown(self):
         self.ctx.pop()
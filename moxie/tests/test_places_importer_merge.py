@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import unittest
+import itertools
+import copy
+import flask
+import mock
+
+from moxie.places.importers.merge import MergeEngine, SpillWriter, StagingIndexMerger
+from moxie.places.regions import Region
+
+app = flask.Flask(__name__)
+
+
+class MergeEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+        self.sources = [
+            ({'id': 'oxpoints:1', 'name': 'Radcliffe Camera', 'type': '/university/library',
+              'identifiers': ['oxpoints:1', 'osm:42'], 'website': 'http://ox.ac.uk'}, 10, False),
+            ({'id': 'osm:42', 'name': 'Radcam', 'type': '/amenities/public-library',
+              'identifiers': ['osm:42'], 'website': 'http://osm.org', 'tags': ['books']}, 5, False),
+            ({'identifiers': ['oxpoints:1'], '_library_subject': ['History']}, 10, True),
+            ({'id': 'atco:340', 'name': 'Stop', 'type': '/transport/bus-stop',
+              'identifiers': ['atco:340']}, 10, False),
+            ({'identifiers': ['librarydata:unknown'], '_library_subject': ['Maths']}, 10, True),
+        ]
+
+    def merge(self, sources):
+        # one source per document
+        engine = MergeEngine()
+        for doc, precedence, enrich_only in sources:
+            engine.add(copy.deepcopy(doc), precedence, enrich_only=enrich_only)
+            engine.end_source()
+        return sorted(engine.documents(), key=lambda d: d['id'])
+
+    def test_each_document_emitted_once(self):
+        docs = self.merge(self.sources)
+        self.assertEqual(sorted(d['id'] for d in docs), ['atco:340', 'oxpoints:1'])
+
+    def test_merge_rules(self):
+        docs = dict((d['id'], d) for d in self.merge(self.sources))
+        library = docs['oxpoints:1']
+        self.assertEqual(library['name'], 'Radcliffe Camera')
+        self.assertEqual(library['website'], 'http://ox.ac.uk')
+        self.assertEqual(library['meta_precedence'], 10)
+        self.assertEqual(set(library['identifiers']), set(['oxpoints:1', 'osm:42']))
+        self.assertEqual(set(library['type']), set(['/university/library', '/amenities/public-library']))
+        self.assertEqual(library['tags'], ['books'])
+        self.assertEqual(library['_library_subject'], ['History'])
+        self.assertEqual(library['type_path'], ['/amenities', '/amenities/public-library',
+                                                '/university', '/university/library'])
+
+    def test_regions(self):
+        engine = MergeEngine(regions=[Region('oxford', centre=[51.7531, -1.2584], distance=5)])
+        engine.add({'id': 'osm:1', 'name': 'Radcam', 'type': '/university/library', 'location': '51.7534,-1.2540',
+                    'identifiers': ['osm:1']}, 5)
+        engine.add({'id': 'osm:2', 'name': 'Abingdon', 'type': '/transport/bus-stop', 'location': '51.6710,-1.2830',
+                    'identifiers': ['osm:2']}, 5)
+        docs = dict((d['id'], d) for d in engine.documents())
+        self.assertEqual(docs['osm:1']['regions'], ['oxford'])
+        self.assertNotIn('regions', docs['osm:2'])
+
+    def test_staging_index_regions(self):
+        indexer = mock.Mock()
+        # document in the index with stale regions, its location has changed
+        indexer.search_for_ids.return_value = mock.Mock(results=[
+            {'id': 'osm:1', 'name': 'Stop', 'type': ['/transport/bus-stop'], 'location': '51.7534,-1.2540',
+             'identifiers': ['osm:1'], 'regions': ['oxford'], 'meta_precedence': 5}])
+        merger = StagingIndexMerger(indexer, regions=[Region('oxford', centre=[51.7531, -1.2584], distance=5)])
+        merged = merger.add({'id': 'osm:1', 'name': 'Stop', 'type': '/transport/bus-stop',
+                             'location': '51.6710,-1.2830', 'identifiers': ['osm:1']}, 10)
+        self.assertNotIn('regions', merged)
+        indexer.search_for_ids.return_value = mock.Mock(results=[])
+        merged = merger.add({'id': 'osm:2', 'name': 'Radcam', 'type': '/university/library',
+                             'location': '51.7534,-1.2540', 'identifiers': ['osm:2']}, 10)
+        self.assertEqual(merged['regions'], ['oxford'])
+        self.assertEqual(merged['type_path'], ['/university', '/university/library'])
+
+    def test_staging_index_commit(self):
+        indexer = mock.Mock()
+        indexer.search_for_ids.return_value = mock.Mock(results=[])
+        merger = StagingIndexMerger(indexer)
+        merger.add({'id': 'osm:1', 'name': 'Stop', 'type': '/transport/bus-stop', 'identifiers': ['osm:1']}, 5)
+        merger.end_source()
+        indexer.commit.assert_called_once_with(soft=True)
+        merger.commit()
+        indexer.commit.assert_called_with()
+
+    def test_order_independent(self):
+        def without_id(docs):
+            return sorted(dict((k, v) for k, v in d.items() if k != 'id') for d in docs)
+        expected = without_id(self.merge(self.sources))
+        for sources in itertools.permutations(self.sources):
+            self.assertEqual(without_id(self.merge(sources)), expected)
+
+    def test_id_of_first_source(self):
+        stop = {'id': 'osm:1', 'name': 'Stop', 'type': '/transport/bus-stop', 'identifiers': ['osm:1', 'atco:340']}
+        naptan = {'id': 'atco:340', 'name': 'Bus stop', 'type': '/transport/bus-stop', 'identifiers': ['atco:340']}
+        docs = self.merge([(stop, 5, False), (naptan, 10, False)])
+        self.assertEqual([d['id'] for d in docs], ['osm:1'])
+        self.assertEqual(docs[0]['name'], 'Bus stop')
+        docs = self.merge([(naptan, 10, False), (stop, 5, False)])
+        self.assertEqual([d['id'] for d in docs], ['atco:340'])
+
+    def test_same_source_not_merged(self):
+        engine = MergeEngine()
+        engine.add({'id': 'osm:1', 'name': 'a', 'type': '/transport', 'identifiers': ['osm:1', 'atco:1']}, 5)
+        engine.add({'id': 'osm:2', 'name': 'b', 'type': '/transport', 'identifiers': ['osm:2', 'atco:1']}, 5)
+        engine.end_source()
+        self.assertEqual(sorted(d['id'] for d in engine.documents()), ['osm:1', 'osm:2'])
+
+    def test_same_source_merged_through_another_source(self):
+        engine = MergeEngine()
+        engine.add({'id': 'osm:1', 'name': 'a', 'type': '/transport', 'identifiers': ['osm:1']}, 5)
+        engine.add({'id': 'osm:2', 'name': 'b', 'type': '/transport', 'identifiers': ['osm:2']}, 5)
+        engine.end_source()
+        engine.add({'id': 'atco:1', 'name': 'c', 'type': '/transport', 'identifiers': ['atco:1', 'osm:1', 'osm:2']}, 10)
+        docs = list(engine.documents())
+        self.assertEqual(len(docs), 1)
+        self.assertEqual(docs[0]['id'], 'osm:1')
+
+    def test_transitive_identifiers(self):
+        docs = self.merge([
+            ({'id': 'a', 'name': 'a', 'type': '/transport', 'identifiers': ['a', 'b']}, 1, False),
+            ({'id': 'c', 'name': 'c', 'type': '/transport', 'identifiers': ['c']}, 1, False),
+            ({'id': 'b', 'name': 'b', 'type': '/transport', 'identifiers': ['b', 'c']}, 1, False),
+        ])
+        self.assertEqual(len(docs), 1)
+        self.assertEqual(docs[0]['id'], 'a')
+        self.assertEqual(set(docs[0]['identifiers']), set(['a', 'b', 'c']))
+
+    def test_spill_files(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        paths = []
+        # one spill file per source
+        for i, (doc, precedence, enrich_only) in enumerate(self.sources):
+            path = os.path.join(directory, str(i))
+            spill = SpillWriter(path)
+            spill.add(copy.deepcopy(doc), precedence, enrich_only=enrich_only)
+            self.assertFalse(os.path.exists(path))
+            spill.end_source()
+            paths.append(path)
+        engine = MergeEngine()
+        for path in paths:
+            engine.add_spill(path)
+        self.assertEqual(sorted(engine.documents(), key=lambda d: d['id']), self.merge(self.sources))
+
+    def tearDown(self):
+        self.ctx.pop()
@@ -2,10 +2,10 @@ import unittest
 import flask
 
 from mock import Mock
-from xml.sax import parse, parseString
+from StringIO import StringIO
 
 from moxie.core.search import SearchService, SearchResponse
-from moxie.places.importers.naptan import NaptanXMLHandler, NaPTANImporter
+from moxie.places.importers.naptan import NaPTANImporter, NaptanIterParser
 
 
 test_stop_areas = """
@@ -78,61 +78,80 @@ class NaptanTestCase(unittest.TestCase):
         self.ctx = app.test_request_context()
         self.ctx.push()
 
+    def parse(self, areas, f=None):
+        """Stop points and stop areas by id"""
+        documents = NaptanIterParser(areas).parse(f or open(self.naptan_file))
+        stop_points, stop_areas = dict(), dict()
+        for doc in documents:
+            if doc['type'] == '/transport/stop-area':
+                stop_areas[doc['id']] = doc
+            else:
+                stop_points[doc['id']] = doc
+        return stop_points, stop_areas
+
     def test_finds_all_stops(self):
-        xml_handler = NaptanXMLHandler(['639'], 'identifiers')
-        parse(open(self.naptan_file), xml_handler)
-        self.assertEqual(len(xml_handler.stop_points), 6)
+        stop_points, _ = self.parse(['639'])
+        self.assertEqual(len(stop_points), 6)
 
     def test_finds_all_stop_areas(self):
-        xml_handler = NaptanXMLHandler(['639'], 'identifiers')
-        parse(open(self.naptan_file), xml_handler)
-        self.assertEqual(len(xml_handler.stop_areas), 6)
+        _, stop_areas = self.parse(['639'])
+        self.assertEqual(len(stop_areas), 6)
 
     def test_finds_no_stop_areas_in_different_location(self):
-        xml_handler = NaptanXMLHandler(['123'], 'identifiers')
-        parse(open(self.naptan_file), xml_handler)
-        self.assertEqual(len(xml_handler.stop_areas), 0)
+        _, stop_areas = self.parse(['123'])
+        self.assertEqual(len(stop_areas), 0)
 
     def test_find_single_rail_station_regardless_of_location(self):
-        xml_handler = NaptanXMLHandler(['123'], 'identifiers')
-        xml_handler2 = NaptanXMLHandler(['321'], 'identifiers')
-        parse(open(self.naptan_file), xml_handler)
-        parse(open(self.naptan_file), xml_handler2)
-        self.assertEqual(xml_handler.stop_points, xml_handler2.stop_points)
+        stop_points, _ = self.parse(['123'])
+        self.assertEqual(stop_points, self.parse(['321'])[0])
+        self.assertEqual(stop_points.keys(), ['crs:OXF'])
 
     def test_precedence_given_to_rail_CRSCode(self):
-        xml_handler = NaptanXMLHandler(['123'], 'identifiers')
-        parse(open(self.naptan_file), xml_handler)
-        idkey = xml_handler.stop_points.values()[0]['id'].split(':')[0]
+        stop_points, _ = self.parse(['123'])
+        idkey = stop_points.values()[0]['id'].split(':')[0]
         self.assertEqual(idkey, 'crs')
 
     def test_search_called_each_result(self):
+        stop_points, stop_areas = self.parse(['639'])
         naptan_importer = NaPTANImporter(self.mock_solr, 10, file(self.naptan_file), ['639'], 'identifiers')
         naptan_importer.run()
-        self.assertEqual(self.mock_solr.search_for_ids.call_count,
-                len(naptan_importer.handler.stop_points)+len(naptan_importer.handler.stop_areas))
+        self.assertEqual(self.mock_solr.search_for_ids.call_count, len(stop_points) + len(stop_areas))
+
+    def test_documents(self):
+        stop_points, stop_areas = self.parse(['639'])
+        rail = stop_points['crs:OXF']
+        self.assertEqual((rail['name'], rail['type'], rail['location']),
+                         ('Oxford Rail Station', '/transport/rail-station', '51.7535007473,-1.2701511727'))
+        self.assertEqual(rail['identifiers'], ['atco:639000023', 'crs:OXF'])
+        stop = stop_points['atco:639000022']
+        self.assertEqual((stop['name'], stop['type'], stop['location']),
+                         ('Outside 20 Albyn Grove', '/transport/bus-stop', '57.1409815049,-2.1189893199'))
+        self.assertEqual(stop['identifiers'], ['atco:639000022', 'naptan:23234369'])
+        self.assertEqual(stop['child_of'], ['stoparea:639GSHI22301'])
+        area = stop_areas['stoparea:639GSHI22301']
+        self.assertEqual((area['name'], area['location']), ('Strichen Junction', '57.4956482909,-1.8015616451'))
+        self.assertEqual(area['child_of'], ['stoparea:639GSHI21921'])
+        self.assertEqual(area['parent_of'], ['atco:639000022'])
+        self.assertEqual(stop_areas['stoparea:639GSHI21921']['parent_of'], ['stoparea:639GSHI22301'])
+
+    def test_iterparse_streams_stop_points(self):
+        docs = list(NaptanIterParser(['639']).parse(open(self.naptan_file)))
+        types = [doc['type'] for doc in docs]
+        self.assertEqual(types, sorted(types, key=lambda t: t == '/transport/stop-area'))
 
     def test_parent_child_stop_areas(self):
-        xml_handler = NaptanXMLHandler(['639'], 'identifiers')
-        parseString(test_stop_areas, xml_handler)
-        areas = xml_handler.annotate_stop_area_ancestry(xml_handler.stop_areas)
-        self.assertEqual(areas['639GSHI21581']['child_of'][0], areas['639GSHI20121']['id'])
-        self.assertEqual(areas['639GSHI20121']['parent_of'][0], areas['639GSHI21581']['id'])
+        _, areas = self.parse(['639'], StringIO(test_stop_areas))
+        self.assertEqual(areas['stoparea:639GSHI21581']['child_of'][0], 'stoparea:639GSHI20121')
+        self.assertIn('stoparea:639GSHI21581', areas['stoparea:639GSHI20121']['parent_of'])
 
     def test_parent_child_stop_areas_inactive(self):
-        xml_handler = NaptanXMLHandler(['639'], 'identifiers')
-        parseString(test_stop_areas, xml_handler)
-        areas = xml_handler.annotate_stop_area_ancestry(xml_handler.stop_areas)
-        with self.assertRaises(KeyError):
-            self.assertEqual(areas['639GSHI21580']['child_of'][0], areas['639GSHI20121']['id'])
+        _, areas = self.parse(['639'], StringIO(test_stop_areas))
+        self.assertNotIn('child_of', areas['stoparea:639GSHI21580'])
 
     def test_parent_child_stop_point(self):
-        xml_handler = NaptanXMLHandler(['639'], 'identifiers')
-        parseString(test_stop_areas, xml_handler)
-        areas = xml_handler.annotate_stop_area_ancestry(xml_handler.stop_areas)
-        points, areas = xml_handler.annotate_stop_point_ancestry(xml_handler.stop_points, areas)
-        self.assertEqual(points['639000022']['child_of'][0], areas['639GSHI21581']['id'])
-        self.assertEqual(areas['639GSHI21581']['parent_of'][0], points['639000022']['id'])
+        points, areas = self.parse(['639'], StringIO(test_stop_areas))
+        self.assertEqual(points['atco:639000022']['child_of'][0], 'stoparea:639GSHI21581')
+        self.assertEqual(areas['stoparea:639GSHI21581']['parent_of'][0], 'atco:639000022')
 
     def tearDown(self):
         self.ctx.pop()
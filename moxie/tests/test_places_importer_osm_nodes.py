@@ -0,0 +1,53 @@
+import unittest
+import tempfile
+import shutil
+
+from moxie.places.importers.osm_nodes import NodeLocationStore, sorted_ids
+
+
+class NodeLocationStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fill(self, store, ids):
+        for id in ids:
+            store.add(id, id / 10.0, -id / 10.0)
+        return store
+
+    def test_get(self):
+        store = self.fill(NodeLocationStore(), [1, 5, 42, 1000])
+        self.assertEqual(store[42], (4.2, -4.2))
+        self.assertEqual(len(store), 4)
+        self.assertFalse(6 in store)
+        self.assertRaises(KeyError, store.get, 6)
+
+    def test_unsorted(self):
+        store = self.fill(NodeLocationStore(), [42, 5, 1000, 1])
+        self.assertEqual(store[1], (0.1, -0.1))
+        self.assertEqual(store[1000], (100.0, -100.0))
+
+    def test_wanted(self):
+        store = self.fill(NodeLocationStore(wanted=sorted_ids([42, 5, 5])), [1, 5, 42, 1000])
+        self.assertEqual(len(store), 2)
+        self.assertTrue(5 in store)
+        self.assertFalse(1000 in store)
+
+    def test_added_after_lookup(self):
+        store = self.fill(NodeLocationStore(), [1, 5])
+        self.assertEqual(store[5], (0.5, -0.5))
+        store.add(3, 0.3, -0.3)
+        self.assertEqual(store[3], (0.3, -0.3))
+
+    def test_on_disk(self):
+        store = NodeLocationStore(directory=self.directory)
+        store.flush_size = 3
+        self.fill(store, [1, 5, 42, 1000, 7])
+        self.assertEqual(store[7], (0.7, -0.7))
+        self.assertEqual(store[1000], (100.0, -100.0))
+        self.assertFalse(6 in store)
+        self.assertEqual(store.nbytes, 5 * 24)
+        store.close()
@@ -0,0 +1,100 @@
+import unittest
+import struct
+import zlib
+import flask
+from StringIO import StringIO
+
+from moxie.places.importers.merge import MergeEngine
+from moxie.places.importers.osm import OSMImporter
+from moxie.places.importers.osm_pbf import OSMPBFImporter, decode_block, packed_deltas, zigzag
+from moxie.tests.test_places_importer_pipeline import test_osm
+
+app = flask.Flask(__name__)
+
+
+def varint(value):
+    if value < 0:
+        value += 1 << 64
+    out = ''
+    while True:
+        b = value & 0x7f
+        value >>= 7
+        if value:
+            out += chr(b | 0x80)
+        else:
+            return out + chr(b)
+
+
+def sint(value):
+    return varint((value << 1) ^ (value >> 63))
+
+
+def field(number, value):
+    """Encode a varint field (int) or a length delimited field (str)"""
+    if isinstance(value, str):
+        return varint(number << 3 | 2) + varint(len(value)) + value
+    return varint(number << 3) + varint(value)
+
+
+def packed(values, encode=varint):
+    return ''.join(encode(v) for v in values)
+
+
+def deltas(values):
+    previous, out = 0, []
+    for v in values:
+        out.append(v - previous)
+        previous = v
+    return packed(out, sint)
+
+
+def blob(blob_type, data):
+    blob = field(2, len(data)) + field(3, zlib.compress(data))
+    header = field(1, blob_type) + field(3, len(blob))
+    return struct.pack('!I', len(header)) + header + blob
+
+
+def make_pbf():
+    """Same elements as test_osm in test_places_importer_pipeline"""
+    strings = ['', 'amenity', 'pub', 'name', 'The Eagle and Child', 'cuisine', 'british;real_ale',
+               'bench', 'shop', 'supermarket', 'naptan:AtcoCode', '340000001']
+    string_table = field(1, ''.join(field(1, s) for s in strings))
+    ids = [1, 2, 3, 4]
+    lats = [517500000, 517600000, 517400000, 517000000]   # granularity 100, i.e. 1e-7 degrees
+    lons = [-12500000, -12600000, -12400000, -12000000]
+    keys_vals = [1, 2, 3, 4, 5, 6, 0, 0, 0, 1, 7, 0]
+    dense = field(1, deltas(ids)) + field(8, deltas(lats)) + field(9, deltas(lons)) + field(10, packed(keys_vals))
+    nodes_block = string_table + field(2, field(2, dense))
+    way = field(1, 10) + field(2, packed([8, 10])) + field(3, packed([9, 11])) + field(8, deltas([2, 3]))
+    ways_block = string_table + field(2, field(3, way))
+    return (blob('OSMHeader', field(4, 'DenseNodes')) + blob('OSMData', nodes_block) +
+            blob('OSMData', ways_block))
+
+
+class OSMPBFImporterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    def test_decoding(self):
+        self.assertEqual(zigzag(3), -2)
+        self.assertEqual(packed_deltas(deltas([5, 3, 300])), [5, 3, 300])
+
+    def test_same_documents_as_xml(self):
+        xml = OSMImporter(None, 5, StringIO(test_osm), merger=MergeEngine())
+        pbf = OSMPBFImporter(None, 5, StringIO(make_pbf()), processes=1, merger=MergeEngine())
+        xml_docs = sorted(xml.documents(), key=lambda doc: doc['id'])
+        pbf_docs = sorted(pbf.documents(), key=lambda doc: doc['id'])
+        self.assertEqual(len(pbf_docs), 2)
+        self.assertEqual(xml_docs, pbf_docs)
+
+    def test_pool_prefilter(self):
+        merger = MergeEngine()
+        importer = OSMPBFImporter(None, 5, StringIO(make_pbf()), processes=2, prefilter_nodes=True,
+                                  merger=merger)
+        importer.run()
+        self.assertEqual(sorted(doc['id'] for doc in merger.documents()), ['340000001', 'osm:1'])
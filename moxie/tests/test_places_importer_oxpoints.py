@@ -0,0 +1,99 @@
+import unittest
+import flask
+
+import rdflib
+from rdflib import URIRef, Literal, RDF
+from rdflib.namespace import DC, FOAF
+
+from moxie.places.importers.compact_graph import CompactGraph
+from moxie.places.importers.merge import MergeEngine
+from moxie.places.importers.oxpoints import OxpointsImporter
+from moxie.places.importers.rdf_namespaces import OxPoints, Org, Geo, SpatialRelations
+
+app = flask.Flask(__name__)
+
+
+def oxpoints(ident):
+    return URIRef('http://oxpoints.oucs.ox.ac.uk/id/{ident}'.format(ident=ident))
+
+
+class OxpointsImporterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+        self.graph = rdflib.Graph()
+        university = oxpoints('1')
+        self.add(university, OxPoints.University, 'University of Oxford')
+        # department merged with its building (same title)
+        department, building = oxpoints('2'), oxpoints('3')
+        self.add(department, OxPoints.Department, 'Sackler Library')
+        self.add(building, OxPoints.Building, 'Sackler Library')
+        self.graph.add([department, OxPoints.primaryPlace, building])
+        self.graph.add([department, Org.subOrganizationOf, university])
+        self.graph.add([building, Geo.lat, Literal(51.75)])
+        self.graph.add([building, Geo.long, Literal(-1.26)])
+        self.graph.add([building, FOAF.img, URIRef('http://example.com/sackler.jpg')])
+        # room (processed before buildings) merged with its site
+        room, site = oxpoints('4'), oxpoints('5')
+        self.add(room, OxPoints.Room, 'Lecture Theatre')
+        self.add(site, OxPoints.Site, 'Lecture Theatre')
+        self.graph.add([room, OxPoints.primaryPlace, site])
+        self.graph.add([room, SpatialRelations.within, building])
+        # building processed before the site merging it, not skipped
+        site2, building2 = oxpoints('6'), oxpoints('7')
+        self.add(site2, OxPoints.Site, 'Old Building')
+        self.add(building2, OxPoints.Building, 'Old Building')
+        self.graph.add([site2, OxPoints.primaryPlace, building2])
+        for i in range(8, 40):
+            self.add(oxpoints(i), OxPoints.Room, 'Room {i}'.format(i=i))
+            self.graph.add([oxpoints(i), SpatialRelations.within, building])
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    def add(self, subject, rdf_type, title):
+        self.graph.add([subject, RDF.type, rdf_type])
+        self.graph.add([subject, DC.title, Literal(title)])
+
+    def run_importer(self, processes):
+        merger = MergeEngine()
+        importer = OxpointsImporter(None, 10, None, None, None, None, '/tmp/static/',
+                                    merger=merger, graph=self.graph, processes=processes)
+        importer.import_data()
+        return importer, list(merger.documents()), importer.downloads
+
+    def test_merged_things(self):
+        importer, docs, downloads = self.run_importer(1)
+        ids = [doc['id'] for doc in docs]
+        self.assertIn('oxpoints:2', ids)
+        self.assertNotIn('oxpoints:3', ids)
+        self.assertNotIn('oxpoints:5', ids)
+        self.assertIn('oxpoints:6', ids)
+        self.assertEqual(importer.merged_things, [oxpoints('3'), oxpoints('5'), oxpoints('7')])
+        self.assertEqual(downloads, [('http://example.com/sackler.jpg',
+                                      '/tmp/static/oxpoints/3/depiction/original/sackler.jpg')])
+
+    def test_pool_same_documents(self):
+        importer, docs, downloads = self.run_importer(1)
+        pool_importer, pool_docs, pool_downloads = self.run_importer(2)
+        self.assertEqual(pool_docs, docs)
+        self.assertEqual(pool_importer.merged_things, importer.merged_things)
+        self.assertEqual(pool_downloads, downloads)
+
+    def test_compact_graph(self):
+        importer, docs, downloads = self.run_importer(1)
+        graph = CompactGraph()
+        # triples repeated by the sources (e.g. OxPoints and shapes)
+        for triple in list(self.graph) * 2:
+            graph.add(triple)
+        self.graph = graph
+        compact_importer, compact_docs, compact_downloads = self.run_importer(1)
+        self.assertEqual(self.sorted_lists(compact_docs), self.sorted_lists(docs))
+        ids = [doc['id'] for doc in compact_docs]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(compact_importer.merged_things, importer.merged_things)
+
+    def sorted_lists(self, docs):
+        return [dict((key, sorted(value) if isinstance(value, list) else value)
+                     for key, value in doc.iteritems()) for doc in docs]
@@ -1,8 +1,10 @@
 import unittest
 
+import mock
 import rdflib
 from rdflib import URIRef, Literal, RDF
-from moxie.places.importers.oxpoints_helpers import find_location, find_shape
+from moxie.places.importers.oxpoints_helpers import (find_location, find_shape,
+                                                    AncestorResolver)
 from moxie.places.importers.rdf_namespaces import (Org, OxPoints, Geo,
                                                    SpatialRelations, Geometry)
 
@@ -70,3 +72,51 @@ class OxpointsHelpersImporterTestCase(unittest.TestCase):
     def test_shape_site(self):
         result = find_shape(self.graph, URIRef('http://oxpoints/site1'))
         self.assertEqual(self.site_shape_value, result)
+
+
+class AncestorResolverTestCase(OxpointsHelpersImporterTestCase):
+
+    def setUp(self):
+        super(AncestorResolverTestCase, self).setUp()
+        self.resolver = AncestorResolver(self.graph)
+
+    def test_same_results(self):
+        for subject in set(self.graph.subjects()):
+            self.assertEqual(self.resolver.location(subject), find_location(self.graph, subject))
+            self.assertEqual(self.resolver.shape(subject), find_shape(self.graph, subject))
+
+    def test_ancestors_memoised(self):
+        self.assertEqual(self.resolver.location(URIRef('http://oxpoints/sublibrary1')), (51, 12))
+        self.assertEqual(self.resolver.locations[URIRef('http://oxpoints/library1')], ((51, 12), 1))
+        with mock.patch.object(self.resolver, '_location_step') as step:
+            self.assertEqual(self.resolver.location(URIRef('http://oxpoints/library1')), (51, 12))
+            self.assertFalse(step.called)
+
+    def test_shape_validated_once(self):
+        room2 = URIRef('http://oxpoints/room2')
+        self.graph.add([room2, SpatialRelations.within, URIRef('http://oxpoints/building2')])
+        self.resolver = AncestorResolver(self.graph)
+        with mock.patch('moxie.places.importers.oxpoints_helpers.wkt_loads') as wkt_loads:
+            self.resolver.shape(URIRef('http://oxpoints/room1'))
+            self.resolver.shape(room2)
+            self.assertEqual(wkt_loads.call_count, 1)
+
+    def test_max_depth(self):
+        graph = rdflib.Graph()
+        places = [URIRef('http://oxpoints/place%d' % i) for i in range(12)]
+        for child, parent in zip(places, places[1:]):
+            graph.add([child, SpatialRelations.within, parent])
+        graph.add([places[-1], Geo.lat, Literal(51)])
+        graph.add([places[-1], Geo.long, Literal(12)])
+        resolver = AncestorResolver(graph)
+        for subject in reversed(places):
+            self.assertEqual(resolver.location(subject), find_location(graph, subject))
+        self.assertIsNone(resolver.location(places[0]))
+        self.assertEqual(resolver.location(places[2]), (51, 12))
+
+    def test_cycle(self):
+        graph = rdflib.Graph()
+        a, b = URIRef('http://oxpoints/a'), URIRef('http://oxpoints/b')
+        graph.add([a, SpatialRelations.within, b])
+        graph.add([b, SpatialRelations.within, a])
+        self.assertIsNone(AncestorResolver(graph).location(a))
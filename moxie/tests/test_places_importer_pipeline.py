@@ -0,0 +1,148 @@
+import unittest
+import bz2
+import flask
+from StringIO import StringIO
+
+from moxie.places.importers.pipeline import ImportPipeline
+from moxie.places.importers.merge import MergeEngine
+from moxie.places.importers.osm import OSMImporter
+from moxie.places.importers.ox_library_data import OxLibraryDataImporter
+
+test_osm = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+ <node id="1" lat="51.75" lon="-1.25">
+  <tag k="amenity" v="pub"/>
+  <tag k="name" v="The Eagle and Child"/>
+  <tag k="cuisine" v="british;real_ale"/>
+ </node>
+ <node id="2" lat="51.76" lon="-1.26"/>
+ <node id="3" lat="51.74" lon="-1.24"/>
+ <node id="4" lat="51.70" lon="-1.20">
+  <tag k="amenity" v="bench"/>
+ </node>
+ <way id="10">
+  <nd ref="2"/>
+  <nd ref="3"/>
+  <tag k="shop" v="supermarket"/>
+  <tag k="naptan:AtcoCode" v="340000001"/>
+ </way>
+</osm>
+"""
+
+test_libraries = """<?xml version="1.0" encoding="UTF-8"?>
+<libraries>
+ <library>
+  <id>42</id>
+  <hours><termtime>9-5</termtime></hours>
+  <subjects><subject>History</subject></subjects>
+ </library>
+ <library>
+  <id>43</id>
+  <subjects><subject>Maths</subject></subjects>
+ </library>
+</libraries>
+"""
+
+app = flask.Flask(__name__)
+
+
+class NumbersPipeline(ImportPipeline):
+
+    name = 'numbers'
+
+    def __init__(self, merger, count):
+        super(NumbersPipeline, self).__init__(None, 10, merger=merger)
+        self.count = count
+        self.parsed = 0
+
+    def parse(self):
+        for i in range(self.count):
+            self.parsed += 1
+            yield i
+
+    def transform_record(self, record):
+        if record == 3:
+            raise ValueError('Invalid record')
+        if record % 2:
+            return {'id': 'number:%d' % record}
+
+
+class ImportPipelineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    def test_documents_lazy(self):
+        pipeline = NumbersPipeline(MergeEngine(), 10)
+        documents = pipeline.documents()
+        self.assertEqual(next(documents), {'id': 'number:1'})
+        self.assertEqual(pipeline.parsed, 2)
+
+    def test_run_metrics(self):
+        merger = MergeEngine()
+        pipeline = NumbersPipeline(merger, 10)
+        pipeline.run()
+        # 3 is invalid, even numbers are skipped
+        self.assertEqual(len(merger), 4)
+        metrics = dict((m.name, m) for m in pipeline.metrics)
+        self.assertEqual([m.name for m in pipeline.metrics], ['parse', 'transform', 'merge', 'write'])
+        self.assertEqual(metrics['parse'].items, 10)
+        self.assertEqual(metrics['transform'].items, 4)
+        self.assertEqual(metrics['merge'].items, 4)
+        self.assertTrue(metrics['transform'].peak_rss > 0)
+
+    def test_osm_importer(self):
+        merger = MergeEngine()
+        importer = OSMImporter(None, 5, StringIO(test_osm), buffer_size=64, merger=merger)
+        importer.run()
+        docs = dict((doc['id'], doc) for doc in merger.documents())
+        self.assertEqual(sorted(docs.keys()), ['340000001', 'osm:1'])
+        self.assertEqual(docs['osm:1']['tags'], ['british', 'real ale'])
+        self.assertEqual(docs['340000001']['identifiers'], ['osm:10', 'atco:340000001'])
+        self.assertEqual(docs['340000001']['location'], '51.75,-1.25')
+
+    def test_osm_importer_relation_after_way(self):
+        osm = test_osm.replace('</osm>', """ <way id="11">
+  <nd ref="2"/>
+  <nd ref="3"/>
+  <tag k="amenity" v="pub"/>
+  <tag k="name" v="The Eagle"/>
+ </way>
+ <relation id="20">
+  <member type="way" ref="11" role=""/>
+  <tag k="name" v="Some Relation"/>
+  <tag k="disused:amenity" v="pub"/>
+ </relation>
+</osm>""")
+        merger = MergeEngine()
+        importer = OSMImporter(None, 5, StringIO(osm), merger=merger)
+        importer.run()
+        docs = dict((doc['id'], doc) for doc in merger.documents())
+        self.assertEqual(docs['osm:11']['name'], 'The Eagle')
+
+    def test_osm_importer_prefilter_nodes(self):
+        merger = MergeEngine()
+        importer = OSMImporter(None, 5, StringIO(test_osm), prefilter_nodes=True, merger=merger)
+        self.assertEqual(list(importer.wanted_nodes()), [2, 3])
+        importer.run()
+        self.assertEqual(len(merger), 2)
+
+    def test_osm_importer_bz2(self):
+        importer = OSMImporter(None, 5, StringIO(bz2.compress(test_osm)), compression='bz2',
+                               buffer_size=64, merger=MergeEngine())
+        self.assertEqual(len(list(importer.documents())), 2)
+
+    def test_library_importer(self):
+        merger = MergeEngine()
+        importer = OxLibraryDataImporter(None, 10, StringIO(test_libraries), merger=merger)
+        importer.run()
+        self.assertEqual(len(merger), 2)
+        entry = merger.groups()[0][0]
+        self.assertTrue(entry[0])   # enrich only
+        self.assertEqual(entry[5]['identifiers'], ['librarydata:42'])
+        self.assertEqual(entry[5]['_library_opening_hours_termtime'], '9-5')
+        self.assertEqual(entry[5]['_library_subject'], ['History'])
@@ -0,0 +1,55 @@
+import unittest
+
+from moxie.places.regions import Region, add_regions, parse_wkt_polygon, regions_from_config, region_names
+
+# rough square around the city centre, with a hole around Christ Church Meadow
+CITY_CENTRE = ("POLYGON((-1.270 51.745, -1.240 51.745, -1.240 51.760, -1.270 51.760, -1.270 51.745),"
+               "(-1.255 51.746, -1.245 51.746, -1.245 51.750, -1.255 51.750, -1.255 51.746))")
+
+RADCAM = '51.7534,-1.2540'
+MEADOW = '51.7480,-1.2500'
+HEADINGTON = '51.7590,-1.2150'
+ABINGDON = '51.6710,-1.2830'
+
+
+class RegionsTestCase(unittest.TestCase):
+
+    def test_parse_wkt_polygon(self):
+        rings = parse_wkt_polygon(CITY_CENTRE)
+        self.assertEqual(len(rings), 2)
+        self.assertEqual(rings[0][0], (51.745, -1.270))
+        self.assertEqual(len(parse_wkt_polygon("MULTIPOLYGON(((0 0, 1 0, 1 1, 0 0)),((2 2, 3 2, 3 3, 2 2)))")), 2)
+        self.assertRaises(ValueError, parse_wkt_polygon, "POINT(0 0)")
+
+    def test_circle(self):
+        oxford = Region('oxford', centre=[51.7531, -1.2584], distance=5)
+        self.assertTrue(oxford.contains(RADCAM.split(',')))
+        self.assertTrue(oxford.contains(HEADINGTON.split(',')))
+        self.assertFalse(oxford.contains(ABINGDON.split(',')))
+
+    def test_polygon(self):
+        centre = Region('centre', polygon=CITY_CENTRE)
+        self.assertTrue(centre.contains(RADCAM.split(',')))
+        self.assertFalse(centre.contains(MEADOW.split(',')))
+        self.assertFalse(centre.contains(HEADINGTON.split(',')))
+
+    def test_invalid_region(self):
+        self.assertRaises(ValueError, Region, 'nowhere', centre=[51.75, -1.25])
+
+    def test_regions_from_config(self):
+        regions = regions_from_config({'PLACES_GEOFILTER_DISTANCE': 5})
+        self.assertEqual([(r.name, r.distance) for r in regions], [('oxford', 5)])
+        regions = regions_from_config({'PLACES_REGIONS': {'oxford': {'centre': [51.75, -1.25], 'distance': 10},
+                                                          'centre': {'polygon': CITY_CENTRE}}})
+        self.assertEqual([r.name for r in regions], ['centre', 'oxford'])
+
+    def test_region_names(self):
+        self.assertEqual(region_names({}), ['oxford'])
+        self.assertEqual(region_names({'PLACES_REGIONS': {'centre': {'polygon': CITY_CENTRE}}}), ['centre'])
+
+    def test_add_regions(self):
+        regions = [Region('centre', polygon=CITY_CENTRE), Region('oxford', centre=[51.7531, -1.2584], distance=5)]
+        self.assertEqual(add_regions({'location': RADCAM}, regions)['regions'], ['centre', 'oxford'])
+        self.assertEqual(add_regions({'location': HEADINGTON}, regions)['regions'], ['oxford'])
+        self.assertNotIn('regions', add_regions({'location': ABINGDON, 'regions': ['oxford']}, regions))
+        self.assertNotIn('regions', add_regions({'id': 'x'}, regions))
@@ -0,0 +1,115 @@
+import json
+import unittest
+import mock
+
+from moxie.places.search_cache import SearchCache, canonical_search, GENERATION_KEY
+from moxie.places.services import POIService
+
+
+class MemoryKV(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+    def setex(self, key, ttl, value):
+        self[key] = value
+
+    def expire(self, key, ttl):
+        pass
+
+    def incr(self, key):
+        self[key] = int(self.get(key, 0)) + 1
+        return self[key]
+
+
+class SearchCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.kv = MemoryKV()
+        self.cache = SearchCache(self.kv, max_entries=2, max_bytes=100)
+
+    def test_canonical_search(self):
+        self.assertEqual(canonical_search(' radcliffe  camera', None, 0, 35, types_exact=['/b', '/a'],
+                                          filter_queries=['y:1', 'x:1']),
+                         canonical_search('radcliffe camera', None, '0', '35', types_exact=['/a', '/b'],
+                                          filter_queries=['x:1', 'y:1']))
+        self.assertNotEqual(canonical_search('library', None, 0, 35),
+                            canonical_search('library', None, 35, 35))
+        self.assertNotEqual(canonical_search('library', None, 0, 35),
+                            canonical_search('library', None, 0, 35, geofilter_centre=[51.7, -1.2],
+                                             geofilter_distance=10))
+
+    def test_get_set(self):
+        value, generation = self.cache.get('search')
+        self.assertIsNone(value)
+        self.cache.set('search', generation, [1, 2], 0.05)
+        self.assertEqual(self.cache.get('search'), ([1, 2], 0))
+
+    def test_invalidate(self):
+        self.cache.set('search', 0, [1], 0.05)
+        self.assertEqual(self.cache.invalidate(), 1)
+        self.assertEqual(self.cache.get('search'), (None, 1))
+
+    def test_bounds(self):
+        self.cache.set('large', 0, ['x' * 100], 0.05)
+        self.assertIsNone(self.cache.get('large')[0])
+        for search in ('a', 'b', 'c'):
+            self.cache.set(search, 0, [search], 0.05)
+        self.assertEqual(self.cache.get('b')[0], ['b'])
+        self.assertIsNone(self.cache.get('c')[0])
+
+    def test_metrics(self):
+        with mock.patch('moxie.places.search_cache.statsd') as statsd:
+            self.cache.get('search')
+            self.cache.set('search', 0, [1], 0.05)
+            self.cache.get('search')
+            statsd.incr.assert_any_call('places.search_cache.miss')
+            statsd.incr.assert_any_call('places.search_cache.hit')
+            statsd.incr.assert_any_call('places.search_cache.saved_ms', 50)
+
+    def test_corrupt_entry(self):
+        self.kv[self.cache.key(0, 'search')] = '{"value": [1'
+        self.kv[self.cache.key(0, 'other')] = '{"elapsed_ms": 5}'
+        self.assertEqual(self.cache.get('search'), (None, 0))
+        self.assertEqual(self.cache.get('other'), (None, 0))
+        self.cache.set('search', 0, [1], 0.05)
+        self.assertEqual(self.cache.get('search'), ([1], 0))
+
+    def test_kv_unavailable(self):
+        self.cache.kv = mock.Mock(get=mock.Mock(side_effect=IOError))
+        self.assertEqual(self.cache.get('search'), (None, None))
+        self.cache.set('search', None, [1], 0.05)
+
+
+class POIServiceCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.kv = MemoryKV()
+        patcher = mock.patch('moxie.places.services.kv_store', self.kv)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.searcher = mock.Mock()
+        self.searcher.search.return_value = mock.Mock(
+            results=[{'id': 'osm:1', 'name': 'Radcam', 'type': ['/university/library']}],
+            size=1, facets=None)
+
+    def test_cached_results(self):
+        with mock.patch('moxie.places.services.searcher', self.searcher):
+            service = POIService(cache_ttl=60)
+            first = service.get_results('radcam', None, 0, 35)
+            second = service.get_results(' radcam', None, 0, 35)
+        self.assertEqual(self.searcher.search.call_count, 1)
+        self.assertEqual(first[0][0].id, second[0][0].id)
+        self.assertEqual(second[1:], (1, None))
+        self.kv[GENERATION_KEY] = 1
+        with mock.patch('moxie.places.services.searcher', self.searcher):
+            service.get_results('radcam', None, 0, 35)
+        self.assertEqual(self.searcher.search.call_count, 2)
+
+    def test_disabled(self):
+        with mock.patch('moxie.places.services.searcher', self.searcher):
+            service = POIService()
+            service.get_results('radcam', None, 0, 35)
+            service.get_results('radcam', None, 0, 35)
+        self.assertEqual(self.searcher.search.call_count, 2)
+        self.assertEqual(self.kv, {})
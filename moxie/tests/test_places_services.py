@@ -40,3 +40,83 @@ class POIServiceTestCase(unittest.TestCase):
         poi_service = POIService()
         args = ['foobar', 'foofoo']
         self.assertEqual(args, poi_service._args_to_friendly(poi_service._args_to_internal(args)))
+
+    def test_get_results_quantised_location(self):
+        with mock.patch('moxie.places.services.searcher') as mock_searcher:
+            mock_searcher.search.return_value = mock.Mock(
+                results=[{'id': 'osm:1', 'name': 'Radcam', 'type': ['/university/library'],
+                          'location': '51.7534,-1.2540', '_dist_': 0.2}],
+                size=1, facets=None)
+            poi_service = POIService(location_cell=250)
+            first, _, _ = poi_service.get_results('', ('51.75310', '-1.25840'), 0, 35, facets=None)
+            poi_service.get_results('', ('51.75320', '-1.25850'), 0, 35, facets=None)
+            (first_query,), _ = mock_searcher.search.call_args_list[0]
+            (second_query,), _ = mock_searcher.search.call_args_list[1]
+            self.assertEqual(first_query['pt'], second_query['pt'])
+            self.assertNotEqual(first_query['pt'], '51.75310,-1.25840')
+            # distance from the exact location
+            self.assertAlmostEqual(first[0].distance, 0.30, places=2)
+
+    def _ring_response(self, ring_size, size, ids):
+        return mock.Mock(results=[{'id': i, 'name': i, 'type': ['/transport/bus-stop']} for i in ids],
+                         size=ring_size,
+                         facets={'facet_queries': {'{!ex=ring}*:*': size},
+                                 'facet_fields': {'type': ['/transport/bus-stop', size]}})
+
+    def test_get_results_geo_rings(self):
+        with mock.patch('moxie.places.services.searcher') as mock_searcher:
+            mock_searcher.search.side_effect = [self._ring_response(1, 50, ['a']),
+                                                self._ring_response(10, 50, ['a', 'b'])]
+            poi_service = POIService(geo_rings=[1, 5, 25])
+            results, size, facets = poi_service.get_results('', (51.7531, -1.2584), 0, 10)
+            self.assertEqual(mock_searcher.search.call_count, 2)
+            (query,), kwargs = mock_searcher.search.call_args
+            self.assertEqual(kwargs['fq'], ['{!geofilt tag=ring d=5}'])
+            self.assertEqual(query['facet.field'], ['{!ex=ring}type'])
+            self.assertEqual([poi.id for poi in results], ['a', 'b'])
+            # size and facets of the whole search
+            self.assertEqual(size, 50)
+            self.assertEqual(facets, {'type': {'/transport/bus-stop': 50}})
+
+    def test_get_results_geo_rings_all_results(self):
+        with mock.patch('moxie.places.services.searcher') as mock_searcher:
+            mock_searcher.search.return_value = self._ring_response(3, 3, ['a', 'b', 'c'])
+            poi_service = POIService(geo_rings=[1, 5, 25])
+            results, size, _ = poi_service.get_results('', (51.7531, -1.2584), 0, 10)
+            self.assertEqual(mock_searcher.search.call_count, 1)
+            self.assertEqual(size, 3)
+
+    def test_get_results_geo_rings_fallback(self):
+        with mock.patch('moxie.places.services.searcher') as mock_searcher:
+            mock_searcher.search.side_effect = [self._ring_response(1, 50, ['a']),
+                                                self._ring_response(2, 50, ['a', 'b']),
+                                                self._ring_response(50, 50, ['a', 'b', 'c'])]
+            poi_service = POIService(geo_rings=[1, 5])
+            results, size, _ = poi_service.get_results('', (51.7531, -1.2584), 0, 10)
+            (query,), kwargs = mock_searcher.search.call_args
+            self.assertEqual(kwargs['fq'], [])
+            self.assertEqual(query['facet.field'], ['type'])
+            self.assertEqual(size, 50)
+
+    def test_get_results_geo_rings_full_text(self):
+        with mock.patch('moxie.places.services.searcher') as mock_searcher:
+            mock_searcher.search.return_value = self._ring_response(50, 50, ['a'])
+            poi_service = POIService(geo_rings=[1, 5])
+            poi_service.get_results('library', (51.7531, -1.2584), 0, 10)
+            self.assertEqual(mock_searcher.search.call_count, 1)
+            (query,), kwargs = mock_searcher.search.call_args
+            self.assertNotIn('facet.query', query)
+
+    def test_type_filter(self):
+        self.assertEqual(POIService(type_path_field='type_path').type_filter('/university/college'),
+                         'type_path:"/university/college"')
+        self.assertEqual(POIService().type_filter('/university/college'), 'type_exact:\/university\/college*')
+
+    def test_get_results_regions(self):
+        with mock.patch('moxie.places.services.searcher') as mock_searcher:
+            mock_searcher.search.return_value = mock.Mock(results=[], query_suggestion=None)
+            POIService(regions_field='regions').get_results('college', None, 0, 10, regions=['oxford'])
+            _, kwargs = mock_searcher.search.call_args
+            self.assertEqual(kwargs['fq'], ['regions:"oxford"'])
+            # regions not indexed
+            self.assertRaises(ValueError, POIService().get_results, 'college', None, 0, 10, regions=['oxford'])
@@ -0,0 +1,359 @@
+import os
+import shutil
+import tempfile
+import unittest
+import flask
+import mock
+
+from moxie.worker import celery
+from moxie.places import tasks
+from moxie.places.import_run import ImportRun
+from moxie.places.search_cache import GENERATION_KEY as SEARCH_CACHE_GENERATION_KEY
+
+app = flask.Flask(__name__)
+
+
+class MemoryKV(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+    def delete(self, key):
+        self.pop(key, None)
+
+    def setnx(self, key, value):
+        if key in self:
+            return False
+        self[key] = value
+        return True
+
+    def setex(self, key, ttl, value):
+        self[key] = value
+
+    def expire(self, key, ttl):
+        pass
+
+    def incr(self, key):
+        self[key] = int(self.get(key, 0)) + 1
+        return self[key]
+
+    def rename(self, key, new_key):
+        self[new_key] = self.pop(key)
+
+    def hset(self, key, field, value):
+        self.setdefault(key, {})[field] = value
+
+    def hgetall(self, key):
+        return dict(self.get(key, {}))
+
+
+class FetchResourceTestCase(unittest.TestCase):
+
+    def test_prefetched(self):
+        with tempfile.NamedTemporaryFile() as f:
+            with mock.patch.object(tasks, 'get_resource') as get_resource:
+                self.assertEqual(tasks.fetch_resource('http://foo.bar/naptan.zip',
+                                                      prefetched={'http://foo.bar/naptan.zip': f.name}),
+                                 f.name)
+            self.assertFalse(get_resource.called)
+
+    def test_prefetched_on_another_host(self):
+        with mock.patch.object(tasks, 'get_resource', return_value='/tmp/local') as get_resource:
+            self.assertEqual(tasks.fetch_resource('http://foo.bar/naptan.zip',
+                                                  prefetched={'http://foo.bar/naptan.zip': '/missing/n1'}),
+                             '/tmp/local')
+        get_resource.assert_called_once_with('http://foo.bar/naptan.zip', False, media_type=None)
+
+
+class IndexedImporterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = mock.Mock(config={})
+        patcher = mock.patch.object(tasks, 'searcher')
+        self.searcher = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_committed(self):
+        run_importer = mock.Mock(return_value=True)
+        self.assertTrue(tasks.run_indexed_importer(self.app, run_importer, url='http://foo.bar/naptan.zip'))
+        run_importer.assert_called_once_with(self.app, mock.ANY, url='http://foo.bar/naptan.zip')
+        self.searcher.commit.assert_called_once_with()
+
+    def test_failed_not_committed(self):
+        self.assertFalse(tasks.run_indexed_importer(self.app, mock.Mock(return_value=False)))
+        self.assertFalse(self.searcher.commit.called)
+
+
+class ImportAllTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = {'OXPOINTS_IMPORT_URL': 'http://foo.bar/oxpoints',
+                       'OXPOINTS_SHAPES_URL': 'http://foo.bar/shapes',
+                       'NAPTAN_IMPORT_URL': 'http://foo.bar/naptan.zip',
+                       'PLACES_SOLR_SERVER': 'http://solr',
+                       'PLACES_SOLR_CORE_STAGING': 'staging',
+                       'PLACES_SOLR_CORE_PRODUCTION': 'production'}
+        self.resources = {'http://foo.bar/oxpoints': {'sha1': 'o1', 'location': '/tmp/o1', 'size': 10},
+                          'http://foo.bar/shapes': {'sha1': 's1', 'location': '/tmp/s1', 'size': 10},
+                          'http://foo.bar/naptan.zip': {'sha1': 'n1', 'location': '/tmp/n1', 'size': 10}}
+        self.spill_dir = tempfile.mkdtemp()
+        self.config['PLACES_IMPORT_SPILL_DIR'] = self.spill_dir
+        self.kv = MemoryKV()
+        self.production = mock.MagicMock(writer=self.writer)
+        self.importer = mock.Mock(side_effect=self.import_documents)
+        self.documents = []
+        moxie_app = mock.MagicMock()
+        moxie_app.config = self.config
+        celery.conf.CELERY_ALWAYS_EAGER = True
+        self.addCleanup(setattr, celery.conf, 'CELERY_ALWAYS_EAGER', False)
+        self.addCleanup(shutil.rmtree, self.spill_dir)
+        ctx = app.test_request_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+        for name, value in (('create_app', mock.Mock(return_value=moxie_app)),
+                            ('prefetch_resources', mock.Mock(side_effect=lambda *args, **kwargs: self.resources)),
+                            ('kv_store', self.kv),
+                            ('http_client', mock.Mock()),
+                            ('searcher', mock.MagicMock(writer=self.writer)),
+                            ('swap_places_cores', mock.Mock(return_value=True)),
+                            ('warm_up_places_core', mock.Mock(return_value=True)),
+                            ('production_searcher', mock.Mock(return_value=self.production)),
+                            ('IMPORTERS', (('Test', self.importer),
+                                           ('Other', self.import_other))),
+                            ('IMPORTERS_URLS', {'Test': ('OXPOINTS_IMPORT_URL', 'OXPOINTS_SHAPES_URL'),
+                                                'Other': ('NAPTAN_IMPORT_URL',)})):
+            patcher = mock.patch.object(tasks, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def import_documents(self, app, merger, force_update=False, prefetched=None):
+        merger.add({'id': 'oxpoints:1', 'name': 'Camera', 'type': '/university/library',
+                    'identifiers': ['oxpoints:1', 'osm:1']}, 10)
+        merger.end_source()
+        return True
+
+    def import_other(self, app, merger, force_update=False, prefetched=None):
+        merger.add({'id': 'osm:1', 'name': 'Radcam', 'type': '/amenities/public-library',
+                    'identifiers': ['osm:1'], 'tags': ['books']}, 5)
+        merger.add({'identifiers': ['oxpoints:1'], '_library_subject': ['History']}, 10,
+                   enrich_only=True)
+        return True
+
+    def writer(self, **kwargs):
+        writer = mock.MagicMock()
+        entered = writer.__enter__.return_value
+        entered.write.side_effect = self.documents.extend
+        entered.docs = entered.bytes_sent = 0
+        return writer
+
+    def test_import_resources(self):
+        self.assertEqual(tasks.import_resources(mock.Mock(config=self.config)),
+                         [('http://foo.bar/oxpoints', 'text/turtle'),
+                          ('http://foo.bar/shapes', 'text/turtle'),
+                          ('http://foo.bar/naptan.zip', None)])
+
+    def test_oxpoints_extension_failed(self):
+        oxpoints, shapes = os.path.join(self.spill_dir, 'o1'), os.path.join(self.spill_dir, 's1')
+        for path in (oxpoints, shapes):
+            open(path, 'w').close()
+        prefetched = {'http://foo.bar/oxpoints': oxpoints, 'http://foo.bar/shapes': None}
+        self.assertIsNone(tasks.get_oxpoints_resources(mock.Mock(config=self.config), prefetched=prefetched))
+        prefetched['http://foo.bar/shapes'] = shapes
+        self.assertEqual(tasks.get_oxpoints_resources(mock.Mock(config=self.config), prefetched=prefetched),
+                         [('http://foo.bar/oxpoints', oxpoints), ('http://foo.bar/shapes', shapes)])
+
+    def test_prefetched_locations(self):
+        self.assertTrue(tasks.import_all())
+        self.assertEqual(self.importer.call_args[1]['prefetched'],
+                         {'http://foo.bar/oxpoints': '/tmp/o1',
+                          'http://foo.bar/shapes': '/tmp/s1',
+                          'http://foo.bar/naptan.zip': '/tmp/n1'})
+
+    def test_merged(self):
+        self.assertTrue(tasks.import_all())
+        self.assertEqual(len(self.documents), 1)
+        doc = self.documents[0]
+        self.assertEqual(doc['id'], 'oxpoints:1')
+        self.assertEqual(doc['name'], 'Camera')
+        self.assertEqual(doc['tags'], ['books'])
+        self.assertEqual(doc['_library_subject'], ['History'])
+        tasks.warm_up_places_core.assert_called_once_with()
+        tasks.swap_places_cores.assert_called_once_with()
+        # spill files removed
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_run_record(self):
+        tasks.import_all()
+        run = ImportRun.last(self.kv)
+        self.assertEqual(run.status, 'succeeded')
+        self.assertEqual(sorted(run.stages), ['import_other', 'import_test', 'index', 'prefetch',
+                                              'swap', 'warmup'])
+        self.assertTrue(all(stage['status'] == 'completed' for stage in run.stages.values()))
+        self.assertEqual(run.stages['import_test']['docs'], 1)
+        self.assertEqual(run.stages['import_test']['inputs'], {'http://foo.bar/oxpoints': 'o1',
+                                                               'http://foo.bar/shapes': 's1'})
+
+    def test_importer_failed(self):
+        self.importer.side_effect = ValueError
+        tasks.import_all()
+        self.assertEqual(self.documents, [])
+        self.assertFalse(tasks.swap_places_cores.called)
+        run = ImportRun.last(self.kv)
+        self.assertEqual(run.status, 'failed')
+        self.assertEqual(run.stages['import_test']['status'], 'failed')
+        self.assertEqual(run.stages['import_other']['status'], 'completed')
+        # resumed, only the importer which failed runs again
+        self.importer.side_effect = self.import_documents
+        with mock.patch.object(self, 'import_other') as import_other:
+            self.assertTrue(tasks.import_all())
+            self.assertFalse(import_other.called)
+        self.assertEqual(len(self.documents), 1)
+        self.assertEqual(self.documents[0]['tags'], ['books'])
+        run = ImportRun.last(self.kv)
+        self.assertEqual(run.status, 'succeeded')
+        self.assertTrue(run.stages['import_other']['reused'])
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_resume_changed_resources(self):
+        self.importer.side_effect = ValueError
+        tasks.import_all()
+        self.importer.side_effect = self.import_documents
+        self.resources['http://foo.bar/naptan.zip'] = {'sha1': 'n2', 'location': '/tmp/n2', 'size': 10}
+        tasks.import_all()
+        self.assertFalse(ImportRun.last(self.kv).stages['import_other'].get('reused'))
+
+    def test_resume_full_rebuild(self):
+        self.importer.side_effect = ValueError
+        tasks.import_all()
+        self.importer.side_effect = self.import_documents
+        tasks.import_all(full_rebuild=True)
+        run = ImportRun.last(self.kv)
+        self.assertFalse(run.stages['import_other'].get('reused'))
+        # spill files of the failed run removed
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_import_running(self):
+        self.kv[tasks.IMPORT_LOCK_KEY] = 'other'
+        self.assertFalse(tasks.import_all())
+        self.assertFalse(self.importer.called)
+        self.assertIsNone(ImportRun.last(self.kv))
+        del self.kv[tasks.IMPORT_LOCK_KEY]
+        self.assertTrue(tasks.import_all())
+        # released once the run has finished
+        self.assertNotIn(tasks.IMPORT_LOCK_KEY, self.kv)
+
+    def test_timed_out_run_not_resumed(self):
+        self.importer.side_effect = ValueError
+        tasks.import_all()
+        run = ImportRun.last(self.kv)
+        run.attributes['status'] = 'running'
+        run.save()
+        spill_dir = run.attributes['spill_dir']
+        self.importer.side_effect = self.import_documents
+        tasks.import_all()
+        run = ImportRun.last(self.kv)
+        self.assertNotIn('resumed', run.attributes)
+        self.assertFalse(run.stages['import_other'].get('reused'))
+        # spill directory of the run left as is
+        self.assertTrue(os.path.isdir(spill_dir))
+
+    def test_unchanged(self):
+        tasks.import_all()
+        self.assertTrue(tasks.import_all())
+        self.assertEqual(self.importer.call_count, 1)
+        self.assertEqual(tasks.swap_places_cores.call_count, 1)
+
+    def test_unchanged_forced(self):
+        tasks.import_all()
+        tasks.import_all(force_update_all=True)
+        self.assertEqual(self.importer.call_count, 2)
+
+    def test_changed(self):
+        tasks.import_all()
+        self.resources['http://foo.bar/shapes'] = {'sha1': 's2', 'location': '/tmp/s2', 'size': 10}
+        tasks.import_all()
+        self.assertEqual(self.importer.call_count, 2)
+
+    def test_not_swapped(self):
+        tasks.swap_places_cores.return_value = False
+        tasks.import_all()
+        self.assertEqual(ImportRun.last(self.kv).stages['swap']['status'], 'failed')
+        tasks.swap_places_cores.return_value = True
+        tasks.import_all()
+        # staging core already indexed, only swapped
+        self.assertEqual(self.importer.call_count, 1)
+        self.assertEqual(len(self.documents), 1)
+        self.assertEqual(tasks.swap_places_cores.call_count, 2)
+        self.assertTrue(ImportRun.last(self.kv).stages['index']['reused'])
+        self.assertIn(tasks.DOCUMENT_HASHES_KEY, self.kv)
+
+    def test_swap_error_not_skipped(self):
+        tasks.swap_places_cores.side_effect = IOError('Read timed out')
+        tasks.import_all()
+        self.assertEqual(ImportRun.last(self.kv).status, 'failed')
+        tasks.swap_places_cores.side_effect = None
+        tasks.import_all()
+        # swap may have been applied, staging core indexed again
+        run = ImportRun.last(self.kv)
+        self.assertEqual(run.status, 'succeeded')
+        self.assertFalse(run.stages['index'].get('reused'))
+        self.assertEqual(len(self.documents), 2)
+
+    def test_bookkeeping_after_swap(self):
+        with mock.patch.object(self.kv, 'rename', side_effect=ValueError('no such key')):
+            self.assertTrue(tasks.import_all())
+        run = ImportRun.last(self.kv)
+        self.assertEqual(run.status, 'succeeded')
+        self.assertEqual(self.kv[tasks.IMPORTED_RESOURCES_KEY], run.attributes['fingerprint'])
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_no_pending_hashes(self):
+        with mock.patch.object(tasks.DocumentDelta, 'save'):
+            with mock.patch.object(self.kv, 'rename') as rename:
+                self.assertTrue(tasks.import_all())
+        self.assertFalse(rename.called)
+        self.assertEqual(ImportRun.last(self.kv).status, 'succeeded')
+        self.assertNotIn(tasks.DOCUMENT_HASHES_KEY, self.kv)
+
+    def test_failed_resource(self):
+        self.resources['http://foo.bar/shapes'] = None
+        tasks.import_all()
+        tasks.import_all()
+        self.assertEqual(self.importer.call_count, 2)
+        self.assertNotIn('http://foo.bar/shapes', self.importer.call_args[1]['prefetched'])
+
+    def test_incremental(self):
+        self.config['PLACES_IMPORT_INCREMENTAL'] = True
+        # no hashes of a previous import, full rebuild
+        tasks.import_all()
+        self.assertEqual(tasks.swap_places_cores.call_count, 1)
+        self.assertEqual(len(self.documents), 1)
+        self.resources['http://foo.bar/naptan.zip'] = {'sha1': 'n2', 'location': '/tmp/n2', 'size': 10}
+        other = mock.Mock(return_value=True)
+        with mock.patch.object(tasks, 'IMPORTERS', (('Test', self.importer), ('Other', other))):
+            tasks.import_all()
+        self.assertEqual(tasks.swap_places_cores.call_count, 1)
+        self.assertEqual(tasks.warm_up_places_core.call_count, 1)
+        # staging core emptied once, for the full rebuild
+        self.assertEqual(tasks.http_client.post.call_count, 2)
+        # merged document changed (no tags anymore)
+        self.assertEqual(len(self.documents), 2)
+        self.assertNotIn('tags', self.documents[1])
+        self.production.delete_by_ids.assert_called_once_with([])
+        self.production.commit.assert_called_once_with()
+        # cached searches invalidated by the incremental import
+        self.assertEqual(self.kv[SEARCH_CACHE_GENERATION_KEY], 1)
+
+    def test_incremental_unchanged_documents(self):
+        self.config['PLACES_IMPORT_INCREMENTAL'] = True
+        tasks.import_all()
+        self.resources['http://foo.bar/naptan.zip'] = {'sha1': 'n2', 'location': '/tmp/n2', 'size': 10}
+        tasks.import_all()
+        self.assertEqual(len(self.documents), 1)
+
+    def test_full_rebuild(self):
+        self.config['PLACES_IMPORT_INCREMENTAL'] = True
+        tasks.import_all()
+        tasks.import_all(full_rebuild=True, force_update_all=True)
+        self.assertEqual(tasks.swap_places_cores.call_count, 2)
+        self.assertFalse(self.production.delete_by_ids.called)
@@ -0,0 +1,46 @@
+import unittest
+import mock
+
+from moxie.core.app import Moxie
+from moxie.core.exceptions import BadRequest
+from moxie.places.views import Search
+
+
+class SearchViewTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Moxie(__name__)
+        self.service = mock.Mock(regions_field=None)
+        self.service.get_results.return_value = ([], 0, None)
+        patcher = mock.patch('moxie.places.views.POIService.from_context', return_value=self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search(self, query_string):
+        with self.app.test_request_context('/search?' + query_string):
+            Search().handle_request()
+        _, kwargs = self.service.get_results.call_args
+        return kwargs
+
+    def test_inoxford_geofilter(self):
+        kwargs = self.search('q=college&inoxford=true')
+        self.assertNotIn('regions', kwargs)
+        self.assertEqual(kwargs['geofilter_distance'], 10)
+
+    def test_inoxford_region(self):
+        self.service.regions_field = 'regions'
+        kwargs = self.search('q=college&inoxford=true')
+        self.assertEqual(kwargs['regions'], ['oxford'])
+        self.assertNotIn('geofilter_centre', kwargs)
+
+    def test_inoxford_region_not_configured(self):
+        self.service.regions_field = 'regions'
+        self.app.config['PLACES_REGIONS'] = {'centre': {'centre': [51.75, -1.25], 'distance': 1}}
+        kwargs = self.search('q=college&inoxford=true&region=centre')
+        self.assertEqual(kwargs['regions'], ['centre'])
+        self.assertEqual(kwargs['geofilter_distance'], 10)
+
+    def test_unknown_region(self):
+        self.assertRaises(BadRequest, self.search, 'q=college&region=centre')
+        self.service.regions_field = 'regions'
+        self.assertRaises(BadRequest, self.search, 'q=college&region=centre')
@@ -0,0 +1,82 @@
+import json
+import unittest
+import mock
+
+from moxie.places.warmup import IndexWarmer, search_spec, record_search, recorded_searches
+
+
+class MemoryKV(object):
+
+    def __init__(self):
+        self.lists = dict()
+
+    def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, value)
+
+    def ltrim(self, key, start, end):
+        self.lists[key] = self.lists[key][start:end + 1]
+
+    def lrange(self, key, start, end):
+        return self.lists.get(key, [])[start:end + 1]
+
+
+class IndexWarmerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.service = mock.Mock()
+        self.latencies = []
+        patcher = mock.patch('moxie.places.warmup.time')
+        self.time = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock = [0]
+        self.time.time.side_effect = lambda: self.clock[0]
+
+        def get_results(*args, **kwargs):
+            self.clock[0] += self.latencies.pop(0) / 1000.0
+        self.service.get_results.side_effect = get_results
+
+    def test_settled(self):
+        # cold round then warm round
+        self.latencies = [900, 500, 20, 10]
+        warmer = IndexWarmer(self.service, [{'q': 'library'}, {'type': '/university/college'}],
+                             threshold=50)
+        report = warmer.run()
+        self.assertTrue(report['settled'])
+        self.assertEqual(len(report['rounds']), 2)
+        self.assertAlmostEqual(report['rounds'][0]['max'], 900)
+        self.assertAlmostEqual(report['rounds'][1]['p95'], 20)
+
+    def test_max_rounds(self):
+        self.latencies = [900] * 3
+        report = IndexWarmer(self.service, [{'q': 'library'}], threshold=50, max_rounds=3).run()
+        self.assertFalse(report['settled'])
+        self.assertEqual(len(report['rounds']), 3)
+
+    def test_replay(self):
+        self.latencies = [10]
+        warmer = IndexWarmer(self.service, [], geofilter_centre=[51.75, -1.25], geofilter_distance=10)
+        spec = search_spec('museum', ('51.7', '-1.2'), pois_type='/university', facets=['type'],
+                           inoxford=True)
+        self.assertAlmostEqual(warmer.replay(json.loads(json.dumps(spec))), 10)
+        self.service.get_results.assert_called_once_with(
+            'museum', [51.7, -1.2], 0, 35, pois_type='/university', types_exact=None,
+            filter_queries=[], facets=['type'], geofilter_centre=[51.75, -1.25], geofilter_distance=10)
+
+    def test_replay_region(self):
+        self.latencies = [10]
+        warmer = IndexWarmer(self.service, [])
+        warmer.replay(search_spec('college', None, regions=['oxford']))
+        self.service.get_results.assert_called_once_with(
+            'college', None, 0, 35, pois_type=None, types_exact=None, filter_queries=[], regions=['oxford'])
+
+    def test_failed_search(self):
+        self.service.get_results.side_effect = ValueError
+        report = IndexWarmer(self.service, [{'q': 'library'}]).run()
+        self.assertEqual(report['rounds'], [])
+
+    def test_record_searches(self):
+        kv = MemoryKV()
+        for i in range(5):
+            record_search(kv, search_spec(str(i), None), 1, limit=3)
+        record_search(kv, search_spec('never', None), 0)
+        self.assertEqual(recorded_searches(kv), [{'q': '4'}, {'q': '3'}, {'q': '2'}])
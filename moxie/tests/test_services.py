@@ -1,14 +1,26 @@
 import unittest
+import mock
 
 from flask import Blueprint
 from moxie import create_app
-from moxie.core.service import Service, NoConfiguredService
+from moxie.core.service import Service, NoConfiguredService, ServiceRegistry
 
 
 class TestProvider(Service):
     pass
 
 
+class SharedService(Service):
+    shared = True
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.resets = 0
+
+    def reset_after_fork(self):
+        self.resets += 1
+
+
 class ArgService(Service):
     def __init__(self, **kwargs):
         self.kwargs = kwargs
@@ -20,7 +32,8 @@ class ServiceTest(unittest.TestCase):
         self.app = create_app()
         services = {'foobar': {'TestProvider': {}},
                 'barfoo': {'TestProvider': {}},
-                'blueblue': {'ArgService': {'mox': 'ie'}},
+                'blueblue': {'ArgService': {'mox': 'ie'},
+                             'SharedService': {'mox': 'ie'}},
                 }
         self.app.config['SERVICES'] = services
         bp = Blueprint('foobar', 'foobar')
@@ -56,3 +69,53 @@ class ServiceTest(unittest.TestCase):
         with self.app.blueprint_context('foobar'):
             with self.assertRaises(NoConfiguredService):
                 ArgService.from_context()
+
+
+class ServiceRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['SERVICES'] = {'blueblue': {'SharedService': {'mox': 'ie'}}}
+        self.registry = ServiceRegistry()
+        patcher = mock.patch('moxie.core.service.registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_shared_service_reused_across_contexts(self):
+        with self.app.app_context():
+            first = SharedService.from_context(blueprint_name='blueblue')
+        with self.app.app_context():
+            second = SharedService.from_context(blueprint_name='blueblue')
+        self.assertIs(first, second)
+        self.assertEqual(self.registry.stats()['constructed'], 1)
+        self.assertEqual(self.registry.stats()['hits'], 1)
+
+    def test_unshared_service_not_reused_across_contexts(self):
+        self.app.config['SERVICES']['blueblue']['ArgService'] = {}
+        with self.app.app_context():
+            first = ArgService.from_context(blueprint_name='blueblue')
+        with self.app.app_context():
+            second = ArgService.from_context(blueprint_name='blueblue')
+        self.assertIsNot(first, second)
+        self.assertEqual(self.registry.stats()['constructed'], 0)
+
+    def test_config_change_builds_new_service(self):
+        with self.app.app_context():
+            first = SharedService.from_context(blueprint_name='blueblue')
+        self.app.config['SERVICES']['blueblue']['SharedService'] = {'mox': 'ford'}
+        with self.app.app_context():
+            second = SharedService.from_context(blueprint_name='blueblue')
+        self.assertIsNot(first, second)
+        self.assertEqual(second.kwargs, {'mox': 'ford'})
+
+    def test_reset_after_fork(self):
+        with self.app.app_context():
+            service = SharedService.from_context(blueprint_name='blueblue')
+        callback = mock.Mock()
+        self.registry.register_after_fork(callback)
+        with mock.patch('os.getpid', return_value=-1):
+            with self.app.app_context():
+                self.assertIs(service, SharedService.from_context(blueprint_name='blueblue'))
+        self.assertEqual(service.resets, 1)
+        callback.assert_called_once_with()
+        self.assertEqual(self.registry.stats()['misses'], 0)
@@ -1,9 +1,85 @@
 import unittest
+import json
+import mock
 
-from moxie.core.search.solr import SolrSearch
+from moxie.core.search import SearchServerException
+from moxie.core.search.solr import SolrSearch, SolrIndexWriter
 
 
 class SolrTest(unittest.TestCase):
 
     def test_solr_escape(self):
         self.assertEqual(SolrSearch.solr_escape("osm:1234"), "osm\:1234")
+
+
+class SolrIndexWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.solr = SolrSearch('places', 'http://foo.bar/solr/')
+        self.solr.connection = mock.Mock()
+        patcher = mock.patch.object(SolrIndexWriter, 'RETRY_DELAY', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pages_from_generator(self):
+        documents = ({'id': str(i)} for i in range(5))
+        with self.solr.writer(page_size=2, concurrency=2) as writer:
+            writer.write(documents)
+        self.assertEqual(self.solr.connection.call_count, 3)
+        self.assertEqual(writer.stats['docs'], 5)
+        self.assertEqual(writer.stats['pages'], 3)
+        sent = sorted(json.loads(c[1]['data'])[0]['id'] for c in self.solr.connection.call_args_list)
+        self.assertEqual(sent, ['0', '2', '4'])
+
+    def test_commit_within(self):
+        with self.solr.writer(commit_within=1000) as writer:
+            writer.write([{'id': '1'}])
+        params = self.solr.connection.call_args[1]['params']
+        self.assertEqual(params['commitWithin'], '1000')
+
+    def test_retry_failed_page(self):
+        self.solr.connection.side_effect = [SearchServerException(), None]
+        with self.solr.writer(retries=1) as writer:
+            writer.write([{'id': '1'}])
+        self.assertEqual(writer.stats['retried'], 1)
+        self.assertEqual(writer.stats['docs'], 1)
+
+    def test_failed_page_raises(self):
+        self.solr.connection.side_effect = SearchServerException()
+        with self.assertRaises(SearchServerException):
+            with self.solr.writer(retries=1) as writer:
+                writer.write([{'id': '1'}])
+        self.assertEqual(writer.stats['failed_pages'], 1)
+
+    def test_client_error_not_retried(self):
+        self.solr.connection.side_effect = [SearchServerException(status_code=400), None]
+        with self.assertRaises(SearchServerException):
+            with self.solr.writer(retries=1) as writer:
+                writer.write([{'id': '1'}])
+        self.assertEqual(writer.stats['retried'], 0)
+        self.assertEqual(writer.stats['failed_pages'], 1)
+
+    def test_server_error_retried(self):
+        self.solr.connection.side_effect = [SearchServerException(status_code=503), None]
+        with self.solr.writer(retries=1) as writer:
+            writer.write([{'id': '1'}])
+        self.assertEqual(writer.stats['retried'], 1)
+        self.assertEqual(writer.stats['docs'], 1)
+
+    def test_unexpected_error_recorded(self):
+        self.solr.connection.side_effect = ValueError()
+        with self.assertRaises(SearchServerException):
+            with self.solr.writer(retries=1) as writer:
+                writer.write([{'id': '1'}])
+        self.assertEqual(writer.stats['failed_pages'], 1)
+        self.assertIsInstance(writer.errors[0], ValueError)
+
+    def test_soft_commit(self):
+        self.solr.commit(soft=True)
+        params = self.solr.connection.call_args[1]['params']
+        self.assertEqual(params, {'softCommit': 'true'})
+
+    def test_delete_by_ids(self):
+        self.solr.delete_by_ids(['osm:1', 'osm:2', 'osm:3'], count_per_page=2)
+        sent = [json.loads(c[1]['data']) for c in self.solr.connection.call_args_list]
+        self.assertEqual(sent, [{'delete': ['osm:1', 'osm:2']}, {'delete': ['osm:3']}])
@@ -1,5 +1,4 @@
 import logging
-import requests
 
 from lxml import etree
 from itertools import chain
@@ -7,6 +6,7 @@ from . import TransportRTIProvider
 from requests.exceptions import RequestException
 from moxie.core.exceptions import ServiceUnavailable
 from moxie.core.metrics import statsd
+from moxie.core.http import http_client
 
 logger = logging.getLogger(__name__)
 
@@ -62,8 +62,8 @@ class CloudAmberBusRtiProvider(TransportRTIProvider):
         """
         try:
             with statsd.timer('transport.providers.cloudamber.rti_request'):
-                response = requests.get(self.get_url(naptan_code),
-                                        timeout=self.timeout)
+                response = http_client.get(self.get_url(naptan_code),
+                                           timeout=self.timeout)
                 response.raise_for_status()
         except RequestException:
             logger.warning('Error in request to Cloudamber', exc_info=True,
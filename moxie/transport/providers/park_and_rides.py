@@ -1,11 +1,11 @@
 import logging
 import json
-import requests
 from lxml import etree
 from requests.exceptions import RequestException
 from datetime import datetime
 
 from moxie.core.kv import kv_store
+from moxie.core.http import http_client
 from moxie.core.service import ProviderException
 from . import TransportRTIProvider
 
@@ -57,7 +57,7 @@ class OxfordParkAndRideProvider(TransportRTIProvider):
 
     def import_data(self):
         try:
-            response = requests.get(self.url, timeout=self.timeout)
+            response = http_client.get(self.url, timeout=self.timeout)
             response.raise_for_status()
         except RequestException as re:
             logger.warning('Error in request to Park & Ride info', exc_info=True,
@@ -126,5 +126,5 @@ class OxfordParkAndRideProvider(TransportRTIProvider):
 
 if __name__ == '__main__':
     provider = OxfordParkAndRideProvider()
-    response = requests.get(provider.url, timeout=provider.timeout)
+    response = http_client.get(provider.url, timeout=provider.timeout)
     print provider.parse_html(response.text)